@@ -0,0 +1,124 @@
+"""
+batch.py
+
+Indexes a list of repositories on a process pool, without the message queue.
+Each line of the input file is a repository url or local path, optionally
+preceded by its repository id:
+
+    https://github.com/rails/rails
+    53f1c0e9a1b2c3d4e5f60718 https://github.com/sinatra/sinatra
+    /srv/mirrors/linux
+
+Results are streamed as NDJSON, one document per repository (see
+`Indexer.serialize`), or written to the configured sinks (Mongo and
+ElasticSearch) like a worker would; the sinks need repository ids. Completed
+lines are appended to a state file, so an interrupted batch resumes where it
+stopped.
+"""
+
+import json
+import os
+import sys
+from datetime import datetime
+from multiprocessing import Pool
+from time import time
+from indexer import Indexer
+from cfg.loader import cfg
+
+
+def parse(line):
+    """
+    :param line: string input line
+    :return: tuple (id or None, url)
+    """
+    fields = line.split()
+    _id, url = (None, fields[0]) if len(fields) == 1 else fields[:2]
+    if os.path.isdir(url):
+        url = os.path.abspath(url).rstrip('/')
+    return _id, url
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def job(line):
+    """
+    Pool target, indexes a single input line. Local paths are cloned into the
+    workspace like urls, so the source is never touched.
+    :param line: string input line
+    :return: tuple (line, NDJSON string or None, error or None)
+    """
+    try:
+        _id, url = parse(line)
+        if job.sinks and not _id:
+            raise ValueError('a repository id is required to write to sinks')
+
+        with Indexer(os.getpid(), _id or url, url) as indexer:
+            indexer.load().analyse()
+            if job.sinks:
+                indexer.process_results()
+                return line, None, None
+            return line, json.dumps(indexer.serialize(), default=encode), None
+
+    except Exception as e:
+        return line, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def init(sinks):
+    job.sinks = sinks
+
+
+def read_lines(location):
+    with open(location) as f:
+        return [l.strip() for l in f if l.strip() and not l.startswith('#')]
+
+
+def run(args):
+    """
+    Runs a batch, see `dex batch --help`.
+    """
+    state = args.state or '{}.done'.format(args.input)
+    done = set(read_lines(state)) if os.path.isfile(state) else set()
+    lines = [l for l in read_lines(args.input) if l not in done]
+    total = len(lines) + len(done)
+
+    output = None
+    if not args.sinks:
+        output = sys.stdout if args.output == '-' else open(args.output, 'a')
+
+    sys.stderr.write('> {} jobs, {} already done\n'.format(total, len(done)))
+    pool = Pool(processes=args.processes or cfg.settings.general.workers,
+                initializer=init, initargs=(args.sinks,))
+    completed = failed = 0
+    start = time()
+    try:
+        with open(state, 'a') as progress:
+            for line, document, error in pool.imap_unordered(job, lines):
+                if error:
+                    failed += 1
+                    sys.stderr.write('\n! {}: {}\n'.format(line, error))
+                else:
+                    if document:
+                        output.write(document + '\n')
+                        output.flush()
+                    progress.write(line + '\n')
+                    progress.flush()
+
+                completed += 1
+                sys.stderr.write('\r> {}/{} jobs, {} failed, {:.2f} jobs/sec'
+                                 .format(len(done) + completed, total, failed,
+                                         completed / (time() - start)))
+                sys.stderr.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        sys.stderr.write('\n> interrupted, run again to resume')
+    finally:
+        pool.join()
+        if output and output is not sys.stdout:
+            output.close()
+
+    sys.stderr.write('\n> {} jobs in {:.1f}s\n'.format(completed, time() - start))
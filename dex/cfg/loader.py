@@ -8,19 +8,129 @@ A singleton class providing simple access to configurations.
 
     host = cgf_loader.cfg.database['host']
 
+Throughput settings listed in `LIVE_SETTINGS` can be changed without a restart.
+A process calls `refresh` at a safe point (workers do so between jobs); the
+configuration is re-read when the file has changed (`general.watch_config`) or
+when the shared generation it follows has been bumped, e.g. by SIGHUP in the
+main process.
 """
 
 import os
 import yaml
 import bunch
+from logging import getLogger
 from dex.core import constants
+from dex.core.exceptions.config import ConfigurationInvalid
+
+
+logger = getLogger('dex')
+
+LIVE_SETTINGS = (
+    # (section, key, minimum)
+    ('general', 'workers', 1),
+    ('general', 'clone_concurrency', 0),
+    ('mq', 'prefetch', 1),
+    ('metrics', 'resolution', 1),
+)
+"""Settings applied on reload, all others require a restart.
+"""
 
 
 class Loader:
     def __init__(self):
-        location = os.path.join(os.path.dirname(__file__), constants.CONFIG_FILE)
-        with open(location) as fp:
-            self.settings = bunch.Bunch.fromDict(yaml.load(fp))
+        self.location = os.path.join(os.path.dirname(__file__),
+                                     constants.CONFIG_FILE)
+        self.settings = self.__read()
+        self.__mtime = os.path.getmtime(self.location)
+        self.__generation = None
+        self.__seen = 0
+
+    def __read(self):
+        with open(self.location) as fp:
+            return bunch.Bunch.fromDict(yaml.load(fp))
+
+    def follow(self, generation):
+        """
+        Follows a shared generation counter; bumping it makes every follower
+        reload on its next `refresh`.
+        :param generation: multiprocessing.Value
+        :return: None
+        """
+        self.__generation = generation
+        self.__seen = generation.value
+
+    def refresh(self):
+        """
+        Reloads the configuration if it is stale. Invalid configurations are
+        logged and ignored.
+        :return: list of (section, key) changed
+        """
+        stale = False
+        if self.__generation is not None and \
+                self.__generation.value != self.__seen:
+            self.__seen = self.__generation.value
+            stale = True
+        if self.settings.general.watch_config and \
+                os.path.getmtime(self.location) != self.__mtime:
+            stale = True
+
+        if not stale:
+            return []
+        try:
+            return self.reload()
+        except ConfigurationInvalid as e:
+            logger.error('Configuration not reloaded: {}'.format(e))
+            return []
+
+    def reload(self):
+        """
+        Reads and validates the configuration file, then applies the live
+        settings. Changes to any other setting are reported but not applied.
+        :return: list of (section, key) changed
+        """
+        self.__mtime = os.path.getmtime(self.location)
+        try:
+            settings = self.__read()
+        except (IOError, yaml.YAMLError) as e:
+            raise ConfigurationInvalid(str(e))
+        self.__validate(settings)
+
+        changed = []
+        for section, key, minimum in LIVE_SETTINGS:
+            if settings[section][key] != self.settings[section][key]:
+                self.settings[section][key] = settings[section][key]
+                changed.append((section, key))
+
+        if self.__static(settings) != self.__static(self.settings):
+            logger.warning('Configuration changed outside of the live '
+                           'settings, restart to apply.')
+
+        if changed:
+            logger.info('Configuration reloaded: {}'.format(
+                ', '.join('.'.join(c) for c in changed)))
+        return changed
+
+    @staticmethod
+    def __static(settings):
+        """
+        Copy of the settings without the live settings.
+        """
+        static = bunch.unbunchify(settings)
+        for section, key, minimum in LIVE_SETTINGS:
+            static[section].pop(key, None)
+        return static
+
+    @staticmethod
+    def __validate(settings):
+        for section, key, minimum in LIVE_SETTINGS:
+            try:
+                value = settings[section][key]
+            except (KeyError, TypeError):
+                raise ConfigurationInvalid('{}.{} is missing'.format(section,
+                                                                     key))
+            if not isinstance(value, int) or value < minimum:
+                raise ConfigurationInvalid('{}.{} must be an integer >= {}'
+                                           .format(section, key, minimum))
 
 
 cfg = Loader()
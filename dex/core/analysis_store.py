@@ -0,0 +1,80 @@
+"""
+analysis_store.py
+
+Keeps the normalized analysis outputs a search document is built from - the
+language breakdown and the README text - so search documents can be
+regenerated without cloning. One document per repository in `analyses`:
+
+    {
+        _id: ObjectId,          # repository id
+        name: 'rails',
+        url: 'https://github.com/rails/rails',
+        processed: datetime,
+        languages: [[name, files, lines, comments, blank, percentage], ...],
+        readme: Binary,         # zlib compressed utf-8, or None
+        index: 'repositories',  # index or alias the document was written to
+        written: datetime       # UTC, when it was written
+    }
+
+Languages are stored common language first, in the order they are indexed.
+"""
+
+import zlib
+from datetime import datetime
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from dex.core.model.language import Language
+from dex.core.model.result import Result
+
+
+class AnalysisStore(object):
+
+    def __init__(self, db):
+        self.collection = db.analyses
+
+    def write(self, repository, result, index=None):
+        """
+        Stores the analysis outputs held by a Result.
+        :param repository: ObjectId
+        :param result: Result
+        :param index: string index or alias its search document is written to
+        :return: None
+        """
+        readme = result.readme
+        if readme:
+            if isinstance(readme, unicode):
+                readme = readme.encode('utf-8')
+            readme = Binary(zlib.compress(readme))
+
+        self.collection.update(
+            {'_id': ObjectId(str(repository))},
+            {
+                'name': result.name,
+                'url': result.url,
+                'processed': result.processed,
+                'languages': [[l.name, l.files, l.lines, l.comments, l.blank,
+                               l.percentage] for l in result.languages],
+                'readme': readme or None,
+                'index': index,
+                'written': datetime.utcnow()
+            },
+            upsert=True
+        )
+
+    def results(self, query=None, batch_size=500):
+        """
+        Rebuilds Results from the store.
+        :param query: dict restricting the repositories, all by default
+        :param batch_size: int documents fetched per round trip
+        :return: generator of (ObjectId, Result)
+        """
+        for document in self.collection.find(query or {})\
+                .batch_size(batch_size):
+            result = Result(document['name'], document['url'])
+            result.processed = document['processed']
+            result.languages = [Language(*row)
+                                for row in document['languages']]
+            if document['readme']:
+                result.readme = zlib.decompress(document['readme'])\
+                    .decode('utf-8')
+            yield document['_id'], result
@@ -0,0 +1,91 @@
+"""
+breaker.py
+
+Circuit breaker for an external backend (Mongo, ElasticSearch). After
+`threshold` consecutive failures the circuit opens and callers should stop
+taking work. Once `reset` seconds have passed a single probe is allowed
+(half-open); success closes the circuit, failure opens it again with the wait
+doubled, up to `max_reset`.
+"""
+
+from time import time
+from logging import getLogger
+
+
+logger = getLogger('dex')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, probe, threshold=3, reset=10, max_reset=300):
+        """
+        :param name: string backend name, used in reporting
+        :param probe: callable returning True when the backend is available
+        :param threshold: int consecutive failures before opening
+        :param reset: float seconds before the first probe
+        :param max_reset: float cap on the wait between probes
+        """
+        self.name = name
+        self.probe = probe
+        self.threshold = threshold
+        self.reset = reset
+        self.max_reset = max_reset
+        self.failures = 0
+        self.state = CLOSED
+        self.__wait = reset
+        self.__opened = 0
+
+    def success(self):
+        if self.state != CLOSED:
+            logger.info('{} available, resuming'.format(self.name))
+        self.failures = 0
+        self.state = CLOSED
+        self.__wait = self.reset
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN:
+            self.__wait = min(self.__wait * 2, self.max_reset)
+            self.__trip()
+        elif self.state == CLOSED and self.failures >= self.threshold:
+            self.__trip()
+
+    def __trip(self):
+        self.state = OPEN
+        self.__opened = time()
+        logger.error('{} unavailable after {} failures, pausing for {}s'
+                     .format(self.name, self.failures, self.__wait))
+
+    def remaining(self):
+        """
+        Seconds until the next probe is due, 0 when closed or due.
+        """
+        if self.state != OPEN:
+            return 0
+        return max(0, self.__opened + self.__wait - time())
+
+    def allow(self):
+        """
+        Whether work may proceed. When an open circuit is due a probe, the
+        probe is run and decides.
+        :return: boolean
+        """
+        if self.state == CLOSED:
+            return True
+        if self.remaining():
+            return False
+
+        self.state = HALF_OPEN
+        try:
+            available = self.probe()
+        except Exception:
+            available = False
+        if available:
+            self.success()
+        else:
+            self.failure()
+        return available
@@ -0,0 +1,186 @@
+"""
+checkpoint.py
+
+Resumable indexing. A job's checkpoint is a directory under
+`checkpoints.directory`, named by the job (repository) id, holding the clone
+and the results of every completed stage:
+
+    <directory>/<job id>/
+        lock                # pid of the worker holding the checkpoint
+        repository/         # the clone, the indexer works in place
+        clone               # stage markers and pickled stage results
+        languages
+        readme
+        sectors             # scores of the sectors sampled so far
+
+A retried job on the same node resumes after its last completed stage. The
+checkpoint is removed once the job completes or fails for good; checkpoints of
+jobs that never came back are removed after `checkpoints.max_age` hours.
+"""
+
+import cPickle
+import errno
+import os
+from shutil import rmtree
+from time import time
+from logging import getLogger
+from dex.cfg.loader import cfg
+
+
+logger = getLogger('dex')
+
+REPOSITORY = 'repository'
+LOCK = 'lock'
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class Checkpoint(object):
+
+    def __init__(self, job_id, root=None):
+        """
+        :param job_id: string repository ID
+        :param root: string checkpoint directory, defaults to the configured
+        """
+        self.root = os.path.join(root or cfg.settings.checkpoints.directory,
+                                 str(job_id))
+        self.location = os.path.join(self.root, REPOSITORY)
+
+    def __path(self, stage):
+        return os.path.join(self.root, stage)
+
+    def acquire(self):
+        """
+        Takes the checkpoint for this process. A checkpoint held by a live
+        process, e.g. a duplicate job in another worker, is not shared.
+        :return: boolean, whether the checkpoint was acquired
+        """
+        try:
+            os.makedirs(self.root)
+        except OSError:
+            pass  # resuming
+
+        lock = self.__path(LOCK)
+        for attempt in range(2):
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()))
+                os.close(fd)
+                return True
+            except OSError:
+                try:
+                    with open(lock) as f:
+                        pid = int(f.read() or 0)
+                except (IOError, ValueError):
+                    pid = 0
+                if pid and alive(pid):
+                    return False
+                try:
+                    os.remove(lock)  # left by a dead worker
+                except OSError:
+                    pass
+        return False
+
+    def release(self):
+        try:
+            os.remove(self.__path(LOCK))
+        except OSError:
+            pass
+        try:
+            # Marks the checkpoint as recently used, for `clean`.
+            os.utime(self.root, None)
+        except OSError:
+            pass
+
+    def has(self, stage):
+        return os.path.exists(self.__path(stage))
+
+    def save(self, stage, value=True):
+        """
+        Records a completed stage. Written to a temporary file and renamed, so
+        a worker dying mid-write leaves the previous checkpoint intact.
+        :param stage: string stage name
+        :param value: picklable stage result
+        :return: None
+        """
+        location = self.__path(stage)
+        with open(location + '.tmp', 'wb') as f:
+            cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(location + '.tmp', location)
+
+    def load(self, stage, default=None):
+        try:
+            with open(self.__path(stage), 'rb') as f:
+                return cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return default
+
+    def reset(self, *stages):
+        for stage in stages:
+            try:
+                os.remove(self.__path(stage))
+            except OSError:
+                pass
+
+    def clear(self):
+        rmtree(self.root, ignore_errors=True)
+
+
+def held(root=None):
+    """
+    Counts the checkpoints held by a live process, i.e. jobs in flight.
+    :return: int
+    """
+    root = root or cfg.settings.checkpoints.directory
+    count = 0
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return count
+
+    for name in names:
+        try:
+            with open(os.path.join(root, name, LOCK)) as f:
+                pid = int(f.read() or 0)
+        except (IOError, ValueError):
+            continue
+        if pid and alive(pid):
+            count += 1
+    return count
+
+
+def clean(root=None, max_age=None):
+    """
+    Removes checkpoints not used for `checkpoints.max_age` hours, unless held
+    by a live process.
+    :return: int number removed
+    """
+    root = root or cfg.settings.checkpoints.directory
+    limit = time() - 3600 * (max_age or cfg.settings.checkpoints.max_age)
+    removed = 0
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return removed
+
+    for name in names:
+        location = os.path.join(root, name)
+        try:
+            if os.path.getmtime(location) >= limit:
+                continue
+        except OSError:
+            continue
+
+        checkpoint = Checkpoint(name, root)
+        if checkpoint.acquire():
+            checkpoint.clear()
+            removed += 1
+    if removed:
+        logger.info('removed {} stale checkpoints'.format(removed))
+    return removed
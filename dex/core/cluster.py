@@ -0,0 +1,95 @@
+"""
+cluster.py
+
+Multi-node indexing. Nodes register in the `nodes` collection with a
+heartbeat; jobs on the shared indexing queue are routed by consistent hashing
+of the repository id onto per-node queues (see router.py), so a repository is
+indexed on the same node every time while the node set is stable.
+
+    {
+        _id: 'indexer-3',       # node name
+        queue: 'indexing.indexer-3',
+        heartbeat: datetime,
+        routed: 1200,           # jobs forwarded by this node's router
+        rebalances: 2,          # ring changes seen by this node's router
+        moved: 0.24,            # share of jobs remapped by the last change
+        jobs: 800,              # jobs indexed on this node
+        local: 650              # of which were last indexed on this node
+    }
+"""
+
+import socket
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from dex.cfg.loader import cfg
+
+
+def node_name():
+    return cfg.settings.cluster.node or socket.gethostname()
+
+
+def node_queue(node):
+    return '{}.{}'.format(cfg.settings.mq.queue_name, node)
+
+
+def consume_queue():
+    """
+    Queue the workers of this node consume from.
+    :return: string
+    """
+    if cfg.settings.cluster.enabled:
+        return node_queue(node_name())
+    return cfg.settings.mq.queue_name
+
+
+class NodeRegistry(object):
+
+    def __init__(self, db):
+        self.collection = db.nodes
+        self.collection.ensure_index([('heartbeat', ASCENDING)])
+
+    def heartbeat(self, node, **counters):
+        """
+        Registers or refreshes a node, incrementing any counters given.
+        :param node: string node name
+        :return: None
+        """
+        update = {'$set': {'heartbeat': datetime.utcnow(),
+                           'queue': node_queue(node)}}
+        if counters:
+            update['$inc'] = counters
+        self.collection.update({'_id': node}, update, upsert=True)
+
+    def record(self, node, **values):
+        self.collection.update({'_id': node}, {'$set': values})
+
+    def record_job(self, node, local):
+        """
+        Counts a job indexed on a node, and whether it was last indexed there.
+        """
+        self.collection.update({'_id': node},
+                               {'$inc': {'jobs': 1, 'local': int(local)}})
+
+    def live(self):
+        """
+        Nodes with a heartbeat within `cluster.expiry` seconds.
+        :return: list of string node names
+        """
+        since = datetime.utcnow() - \
+            timedelta(seconds=cfg.settings.cluster.expiry)
+        return [n['_id'] for n in self.collection.find(
+            {'heartbeat': {'$gte': since}}, {'_id': 1})]
+
+    def dead(self):
+        """
+        Registered nodes that left or stopped sending heartbeats.
+        :return: list of string node names
+        """
+        since = datetime.utcnow() - \
+            timedelta(seconds=cfg.settings.cluster.expiry)
+        return [n['_id'] for n in self.collection.find(
+            {'$or': [{'heartbeat': None}, {'heartbeat': {'$lt': since}}]},
+            {'_id': 1})]
+
+    def leave(self, node):
+        self.collection.update({'_id': node}, {'$set': {'heartbeat': None}})
@@ -0,0 +1,312 @@
+"""
+commit_index.py
+
+A compact binary index of a repository's history, so analyses read arrays
+rather than walking pygit2 objects. One file per repository under
+`commit_index.directory`, commits newest first:
+
+    header      magic, commit count, author count, author table size, HEAD
+    ids         uint8[n, 20]    raw commit ids
+    times       int64[n]        commit times
+    authors     int32[n]        row in the author table
+    parents     int32[n]        row of the first parent, -1 for none
+    additions   int64[n]        against the first parent, -1 until diffed
+    deletions   int64[n]
+    offsets     int64[a + 1]    author table: 'email\\0name' entries
+    table       bytes
+
+Arrays are little-endian and 8 byte aligned. The file is read through mmap
+and the arrays are NumPy views on it; nothing is copied or parsed beyond the
+author table.
+
+The index is updated incrementally: only commits not reachable from the
+indexed HEAD are walked. Per-commit churn is filled in over successive jobs,
+at most `commit_index.diff_budget` diffs per job.
+"""
+
+import mmap
+import os
+import struct
+from binascii import hexlify, unhexlify
+import numpy
+import pygit2
+
+
+MAGIC = 'DEXCI001'
+HEADER = struct.Struct('<8sqqq20s4x')
+ID_SIZE = 20
+
+# name, dtype; one value per commit
+ARRAYS = (
+    ('times', '<i8'),
+    ('authors', '<i4'),
+    ('parents', '<i4'),
+    ('additions', '<i8'),
+    ('deletions', '<i8'),
+)
+
+
+def utf8(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def aligned(offset):
+    return (offset + 7) & ~7
+
+
+class CommitIndex(object):
+
+    def __init__(self, head, ids, times, authors, parents, additions,
+                 deletions, emails, names):
+        self.head = head
+        self.ids = ids
+        self.times = times
+        self.authors = authors
+        self.parents = parents
+        self.additions = additions
+        self.deletions = deletions
+        self.emails = emails
+        self.names = names
+        self.__mmap = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def hex(self, i):
+        """
+        :param i: int row
+        :return: string hex id of the commit
+        """
+        return hexlify(self.ids[i].tostring())
+
+    def within(self, horizon):
+        """
+        Number of commits at or after a time. Commits are newest first, so
+        these are the leading rows.
+        :param horizon: int timestamp, 0 for all
+        :return: int
+        """
+        if not horizon:
+            return len(self)
+        return int(numpy.searchsorted(-self.times, -horizon, side='right'))
+
+    #---------------------------------------------------------------------------
+    #   Building
+    #---------------------------------------------------------------------------
+
+    @classmethod
+    def build(cls, repository, horizon=0, previous=None, skew=0):
+        """
+        Indexes the history reachable from HEAD. Given the previous index of
+        the repository, only commits it does not hold are walked, unless HEAD
+        was rewritten.
+        :param repository: pygit2.Repository
+        :param horizon: int timestamp, older commits are left out; 0 for the
+                        full history
+        :param previous: CommitIndex
+        :param skew: int seconds commits may be out of time order; the walk
+                     stops at the first commit older than horizon - skew
+        :return: CommitIndex
+        """
+        head = repository.head.target
+        if previous is not None and not cls.__extends(repository, head,
+                                                      previous):
+            previous = None
+        if previous is not None and previous.head == head.hex:
+            return previous
+
+        walker = repository.walk(head, pygit2.GIT_SORT_TIME)
+        if previous is not None:
+            walker.hide(pygit2.Oid(hex=previous.head))
+
+        emails = list(previous.emails) if previous is not None else []
+        names = list(previous.names) if previous is not None else []
+        author_rows = dict((email, i) for i, email in enumerate(emails))
+
+        walked = []
+        for commit in walker:
+            if horizon and commit.commit_time < horizon:
+                # Time order is not strict: a commit with a skewed clock may
+                # be followed by newer ones, so the walk goes on past the
+                # horizon for the skew allowed.
+                if commit.commit_time < horizon - skew:
+                    break
+                continue
+            email = commit.author.email
+            if email not in author_rows:
+                author_rows[email] = len(emails)
+                emails.append(email)
+                names.append(commit.author.name)
+            parent = commit.parents[0].id.raw if commit.parents else None
+            walked.append((commit.id.raw, commit.commit_time,
+                           author_rows[email], parent))
+
+        new = len(walked)
+        old = len(previous) if previous is not None else 0
+        ids = numpy.zeros((new + old, ID_SIZE), numpy.uint8)
+        times = numpy.zeros(new + old, numpy.int64)
+        authors = numpy.zeros(new + old, numpy.int32)
+        parents = numpy.full(new + old, -1, numpy.int32)
+        additions = numpy.full(new + old, -1, numpy.int64)
+        deletions = numpy.full(new + old, -1, numpy.int64)
+
+        rows = dict((raw, i) for i, (raw, _, _, _) in enumerate(walked))
+        for i, (raw, time, author, parent) in enumerate(walked):
+            ids[i] = numpy.frombuffer(raw, numpy.uint8)
+            times[i] = time
+            authors[i] = author
+            if parent in rows:
+                parents[i] = rows[parent]
+            elif parent is not None and previous is not None:
+                parents[i] = cls.__find(previous, parent, new)
+
+        if previous is not None:
+            ids[new:] = previous.ids
+            times[new:] = previous.times
+            authors[new:] = previous.authors
+            parents[new:] = numpy.where(previous.parents >= 0,
+                                        previous.parents + new, -1)
+            additions[new:] = previous.additions
+            deletions[new:] = previous.deletions
+
+        # The walk is not strictly newest first (skewed clocks), and merged
+        # branches can hold commits older than the indexed ones; restore
+        # newest first order and remap the parent rows.
+        order = numpy.argsort(-times, kind='mergesort')
+        if (order != numpy.arange(len(order))).any():
+            rank = numpy.empty_like(order)
+            rank[order] = numpy.arange(len(order))
+            ids, times, authors, additions, deletions = [
+                a[order] for a in (ids, times, authors, additions, deletions)]
+            parents = parents[order]
+            parents = numpy.where(parents >= 0, rank[parents], -1)\
+                .astype(numpy.int32)
+
+        return cls(head.hex, ids, times, authors, parents, additions,
+                   deletions, emails, names)
+
+    @staticmethod
+    def __extends(repository, head, previous):
+        """
+        Whether the indexed HEAD is still in the history, i.e. was not
+        rewritten.
+        """
+        if previous.head == head.hex:
+            return True
+        try:
+            return repository.descendant_of(head,
+                                            pygit2.Oid(hex=previous.head))
+        except (KeyError, ValueError, AttributeError, pygit2.GitError):
+            return False
+
+    @staticmethod
+    def __find(previous, raw, shift):
+        match = numpy.flatnonzero(
+            (previous.ids == numpy.frombuffer(raw, numpy.uint8)).all(axis=1))
+        return match[0] + shift if len(match) else -1
+
+    def diff(self, score, budget):
+        """
+        Fills in per-commit churn for up to `budget` commits not yet diffed,
+        newest first.
+        :param score: callable (parent hex, commit hex) -> (additions,
+                      deletions)
+        :param budget: int diffs
+        :return: int number diffed
+        """
+        if self.__mmap is not None:
+            raise ValueError('a mapped commit index is read only')
+        pending = numpy.flatnonzero((self.additions < 0) &
+                                    (self.parents >= 0))[:budget]
+        for i in pending:
+            self.additions[i], self.deletions[i] = \
+                score(self.hex(self.parents[i]), self.hex(i))
+        return len(pending)
+
+    #---------------------------------------------------------------------------
+    #   Storage
+    #---------------------------------------------------------------------------
+
+    def write(self, location):
+        """
+        Writes the index, atomically replacing any previous file.
+        :param location: string file path
+        :return: None
+        """
+        entries = ['{}\0{}'.format(utf8(email), utf8(name))
+                   for email, name in zip(self.emails, self.names)]
+        table = ''.join(entries)
+        offsets = numpy.cumsum([0] + [len(e) for e in entries])
+
+        with open(location + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self), len(self.emails), len(table),
+                                unhexlify(self.head)))
+            blocks = [numpy.ascontiguousarray(self.ids, numpy.uint8)]
+            blocks.extend(numpy.ascontiguousarray(getattr(self, name), dtype)
+                          for name, dtype in ARRAYS)
+            blocks.append(offsets.astype('<i8'))
+            for block in blocks:
+                f.write(block.tostring())
+                f.write('\0' * (aligned(f.tell()) - f.tell()))
+            f.write(table)
+        os.rename(location + '.tmp', location)
+
+    @classmethod
+    def open(cls, location):
+        """
+        Maps an index file. The arrays are views on the mapping.
+        :param location: string file path
+        :return: CommitIndex, or None if there is no valid index
+        """
+        try:
+            f = open(location, 'rb')
+        except IOError:
+            return None
+        with f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, author_count, table_size, head = \
+            HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            data.close()
+            return None
+
+        offset = HEADER.size
+        ids = numpy.frombuffer(data, numpy.uint8, count * ID_SIZE, offset)\
+            .reshape((count, ID_SIZE))
+        offset = aligned(offset + count * ID_SIZE)
+        arrays = dict()
+        for name, dtype in ARRAYS:
+            arrays[name] = numpy.frombuffer(data, dtype, count, offset)
+            offset = aligned(offset + arrays[name].nbytes)
+        offsets = numpy.frombuffer(data, '<i8', author_count + 1, offset)
+        offset = aligned(offset + offsets.nbytes)
+
+        table = data[offset:offset + table_size]
+        emails, names = [], []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            email, name = table[start:end].split('\0', 1)
+            emails.append(email.decode('utf-8', 'replace'))
+            names.append(name.decode('utf-8', 'replace'))
+
+        index = cls(hexlify(head), ids, arrays['times'], arrays['authors'],
+                    arrays['parents'], arrays['additions'],
+                    arrays['deletions'], emails, names)
+        index.__mmap = data
+        return index
+
+    def copy(self):
+        """
+        An in-memory copy, e.g. to update a mapped index.
+        """
+        return CommitIndex(self.head, self.ids.copy(), self.times.copy(),
+                           self.authors.copy(), self.parents.copy(),
+                           self.additions.copy(), self.deletions.copy(),
+                           list(self.emails), list(self.names))
+
+    def close(self):
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
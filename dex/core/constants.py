@@ -15,4 +15,20 @@ ENV_DB_HOST = 'ALGTHM_DB_HOST'
 
 ENV_DB_PORT = 'ALGTHM_DB_PORT'
 """DB port
-"""
\ No newline at end of file
+"""
+
+REPOSITORY_IDLE = 0
+"""Repository state, awaiting indexing
+"""
+
+REPOSITORY_QUEUED = 1
+"""Repository state, published to the indexing queue
+"""
+
+REPOSITORY_INDEXED = 2
+"""Repository state, indexed
+"""
+
+REPOSITORY_FAILED = 3
+"""Repository state, failed permanently or retries exhausted
+"""
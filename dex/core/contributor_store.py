@@ -0,0 +1,87 @@
+"""
+contributor_store.py
+
+Compact storage for the contributors of a repository. Instead of one document
+per contributor, a repository's contributors are held in a single document of
+parallel arrays, ordered by commits:
+
+    {
+        _id: ObjectId,          # repository
+        count: 120,
+        names: ['...'],
+        emails: ['...'],
+        commits: Binary,        # int64
+        additions: Binary,      # int64, of the contributor's commits
+        deletions: Binary,      # int64
+        estimated: Binary       # uint8, 1 where partly estimated from the
+                                # contributor's share of sector commits
+    }
+
+Arrays are packed as in metric_series.py.
+"""
+
+from bson.objectid import ObjectId
+from dex.core.digest import digest
+from dex.core.metric_series import pack, unpack
+from dex.core.model.contributor import Contributor
+
+
+class ContributorStore(object):
+    """
+    Reads and writes packed contributors in the `contributors` collection.
+    """
+
+    def __init__(self, db):
+        self.collection = db.contributors
+
+    @staticmethod
+    def serialize(repository, contributors):
+        contributors = sorted(contributors, key=lambda c: c.count,
+                              reverse=True)
+        return {
+            '_id': repository,
+            'count': len(contributors),
+            'names': [c.name for c in contributors],
+            'emails': [c.email for c in contributors],
+            'commits': pack('q', [c.count for c in contributors]),
+            'additions': pack('q', [c.additions for c in contributors]),
+            'deletions': pack('q', [c.deletions for c in contributors]),
+            'estimated': pack('B', [c.estimated for c in contributors])
+        }
+
+    @staticmethod
+    def deserialize(document):
+        # Documents written before per-commit churn are all estimated
+        estimated = unpack('B', document['estimated']) \
+            if 'estimated' in document else [1] * document['count']
+        columns = zip(document['names'], document['emails'],
+                      unpack('q', document['commits']),
+                      unpack('q', document['additions']),
+                      unpack('q', document['deletions']), estimated)
+        return [Contributor(name, email, count, additions, deletions,
+                            bool(flag))
+                for name, email, count, additions, deletions, flag in columns]
+
+    def write(self, repository, contributors, previous=None):
+        """
+        Replaces the stored contributors of the repository, unless their hash
+        matches that of the last write.
+        :param repository: ObjectId
+        :param contributors: list of Contributor
+        :param previous: string hash from the last write
+        :return: string hash
+        """
+        repository = ObjectId(str(repository))
+        document = self.serialize(repository, contributors)
+        hashed = digest(document)
+        if hashed != previous:
+            self.collection.save(document)
+        return hashed
+
+    def read(self, repository):
+        """
+        :param repository: ObjectId
+        :return: list of Contributor, most commits first
+        """
+        document = self.collection.find_one({'_id': ObjectId(str(repository))})
+        return self.deserialize(document) if document else []
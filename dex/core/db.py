@@ -31,9 +31,12 @@ class MongoConnection(object):
                 int(os.environ.get(constants.ENV_DB_PORT))
 
             database = cfg.settings.environments[cfg.settings.general.env].db
+            timeout = int(cfg.settings.boot.timeout * 1000)
             self.__client = MongoClient(
                 host=host,
                 port=port,
+                connectTimeoutMS=timeout,
+                serverSelectionTimeoutMS=timeout,
             )
             self.__db = self.__client[database]
 
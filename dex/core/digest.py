@@ -0,0 +1,71 @@
+"""
+digest.py
+
+Stable content hashes of sink payloads, so writes can be skipped when a job
+produced the same content as last time. Hashes are stored on the repository
+record:
+
+    hashes: {
+        search: {text: '...', repository: '...'},  # per top level field
+        series: {'2014': '...', '2015': '...'},     # per bucket
+        contributors: '...'
+    }
+
+A document is hashed over a canonical encoding - keys sorted, types tagged -
+so equal content hashes equally whatever the dict ordering or the process.
+"""
+
+import hashlib
+from datetime import datetime
+
+
+def feed(h, value):
+    if isinstance(value, dict):
+        h.update('{')
+        for key in sorted(value):
+            feed(h, key)
+            feed(h, value[key])
+        h.update('}')
+    elif isinstance(value, (list, tuple)):
+        h.update('[')
+        for item in value:
+            feed(h, item)
+        h.update(']')
+    elif isinstance(value, unicode):
+        feed(h, value.encode('utf-8'))
+    elif isinstance(value, str):
+        # Includes bson Binary
+        h.update('s{}:'.format(len(value)))
+        h.update(value)
+    elif isinstance(value, datetime):
+        h.update('d' + value.isoformat())
+    elif isinstance(value, float):
+        h.update('f' + repr(value))
+    else:
+        h.update('{}{!r};'.format(type(value).__name__[0], value))
+
+
+def digest(value, exclude=()):
+    """
+    :param value: document of dicts, lists, strings, numbers and datetimes
+    :param exclude: top level keys left out, e.g. timestamps of the run
+    :return: string hex digest
+    """
+    if exclude:
+        value = dict((k, v) for k, v in value.items() if k not in exclude)
+    h = hashlib.sha1()
+    feed(h, value)
+    return h.hexdigest()
+
+
+def changed(fields, previous):
+    """
+    Compares per field hashes against those stored.
+    :param fields: dict of field to hash
+    :param previous: dict of field to hash, or None
+    :return: list of fields whose hash differs, or None if the field set
+             changed and the document must be rewritten whole
+    """
+    if not previous or set(fields) != set(previous):
+        return None
+    return [f for f in sorted(fields) if fields[f] != previous[f]]
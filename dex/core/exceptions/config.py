@@ -0,0 +1,9 @@
+"""
+Configuration exceptions.
+"""
+
+class ConfigurationInvalid(Exception):
+    """
+    Raised when a configuration file fails validation on reload. The running configuration is left untouched.
+    """
+    pass
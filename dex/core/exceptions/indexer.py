@@ -22,6 +22,13 @@ class RepositoryCloneFailure(Exception):
     """
     pass
 
+class GitTimeout(Exception):
+    """
+    GitTimeout is thrown when a git client command, e.g. against a remote that stopped responding, did not finish in
+    time. It is not held against the repository for good; the job should be retried.
+    """
+    pass
+
 class StatisticsUnavailable(Exception):
     """
     NoStatisticsAvailable is thrown when no statistics were generated for a code base. This means the codebase contains
@@ -35,4 +42,11 @@ class ExternalSystemException(Exception):
     to elasticsearch failed. The exception message is logged to an error database and the worker is shutdown. This is
     to prevent the system from stalling and quietly idling instead sysadmins are informed of the issue.
     """
-    pass
\ No newline at end of file
+    pass
+
+class RebuildFailure(Exception):
+    """
+    RebuildFailure is thrown when a search index rebuild cannot start or complete without losing documents, e.g. the
+    rebuilt index holds fewer documents than expected. The alias is left where it was.
+    """
+    pass
@@ -0,0 +1,281 @@
+"""
+extractors.py
+
+The analyses run on a cloned repository, as registered plugins. An extractor
+declares the values it requires and the values it provides; the pipeline (see
+pipeline.py) runs every extractor once its requirements are available, so
+independent extractors run concurrently. Values an extractor `uses` are
+optional: they are waited for when an enabled extractor provides them, and
+None otherwise.
+
+An extractor is called with a dict holding the job's inputs - `id`,
+`location`, `name`, `url` and `checkpoint` - and the values it requires, and
+returns a dict of the values it provides. Extractors run on a thread, or with
+`mode=PROCESS` on a process of their own: CPU bound pygit2 work would
+otherwise hold the GIL of the worker. Process extractors get only picklable
+inputs and must return picklable values.
+
+An extractor reading commits or diffs declares `needs=HISTORY`; jobs whose
+enabled extractors only read the checkout are cloned shallow, see
+`Indexer.clone_strategy`.
+
+New analyses plug in with `register`:
+
+    @register('license', provides=('license',))
+    def extract_license(job):
+        ...
+"""
+
+import hashlib
+import re
+from os import devnull, makedirs, path
+from logging import getLogger
+import pygit2
+from bson.objectid import ObjectId
+from algthm.utils.file import match_in_dir
+from algthm.utils.string import normalize_string
+from dex.cfg.loader import cfg
+from dex.core.commit_index import CommitIndex
+from dex.core.exceptions.indexer import IndexerDependencyFailure
+from dex.core.exceptions.indexer import StatisticsUnavailable
+from dex.core.metric_sampler import MetricSampler, score
+from dex.core.model.languages import Languages
+from dex.core.paths import PathClassifier
+from dex.core.resources import timed_call
+
+
+logger = getLogger('dex')
+
+THREAD = 'thread'
+PROCESS = 'process'
+
+# What of the repository an extractor reads, see `Indexer.clone_strategy`
+SNAPSHOT = 'snapshot'  # the checkout of HEAD
+HISTORY = 'history'    # commits and their diffs
+
+CLOC_OUTPUT_FILE = 'cloc.yaml'
+CLOC_EXCLUDE_FILE = 'cloc.exclude'
+
+REGISTRY = []
+
+
+class Extractor(object):
+
+    __slots__ = ('name', 'function', 'requires', 'provides', 'mode', 'needs',
+                 'uses')
+
+    def __init__(self, name, function, requires=(), provides=(), mode=THREAD,
+                 needs=SNAPSHOT, uses=()):
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+        self.provides = tuple(provides)
+        self.mode = mode
+        self.needs = needs
+        self.uses = tuple(uses)
+
+    def __str__(self):
+        return 'Extractor [{}]'.format(self.name)
+
+
+def register(name, requires=(), provides=(), mode=THREAD, needs=SNAPSHOT,
+             uses=()):
+    """
+    Decorator registering an extractor function. Extractors run in
+    registration order where they do not depend on each other.
+    """
+    def decorate(function):
+        REGISTRY.append(Extractor(name, function, requires, provides, mode,
+                                  needs, uses))
+        return function
+    return decorate
+
+
+def registered():
+    return list(REGISTRY)
+
+
+def enabled():
+    """
+    The extractors named by `extractors.enabled`, all when unset.
+    """
+    names = cfg.settings.extractors.enabled
+    return [e for e in REGISTRY if names is None or e.name in names]
+
+
+#-------------------------------------------------------------------------------
+#   Extractors
+#-------------------------------------------------------------------------------
+
+@register('paths', provides=('paths', 'skipped'))
+def classify_paths(job):
+    """
+    Finds the vendored, generated, documentation and oversized files in the
+    checkout, see `PathClassifier`. They are left out of language statistics
+    and diff scoring; what was skipped is reported in `skipped`.
+    """
+    settings = cfg.settings.paths
+    if not settings.enabled:
+        return {'paths': None, 'skipped': dict()}
+
+    location = job['location']
+    paths = PathClassifier.from_checkout(location, settings.builtin,
+                                         settings.max_file_size)
+    excluded, skipped = paths.scan(location)
+    with open(path.join(location, CLOC_EXCLUDE_FILE), 'w') as f:
+        for excluded_location in excluded:
+            f.write(excluded_location + '\n')
+
+    logger.info('Skipping {} in {}'.format(', '.join(
+        '{} {} files ({} bytes)'.format(v['files'], kind, v['bytes'])
+        for kind, v in skipped.items()) or 'nothing', job['url']))
+    return {'paths': paths, 'skipped': skipped}
+
+
+@register('languages', provides=('languages', 'cloc'), uses=('paths',))
+def extract_language_statistics(job):
+    """
+    Method calls a subprocess 'cloc' to do some stats on the directory. The
+    result of this is saved to `CLOC_OUTPUT_FILE` in the repository
+    location. The results are in yaml format, which will be later read.
+    `cloc` understand language specific syntax for a vast number of
+    languages; it knows what language a file is written, and to a further
+    extent, what a comment looks like in this language. From this
+    information, we can determine its main language, eg, ruby framework, js,
+    etc. The wall and CPU seconds `cloc` took are provided as `cloc`.
+
+    Throws StatisticsUnavailable, if repo contains no code
+    """
+    location = job['location']
+    checkpoint = job['checkpoint']
+    report = path.join(location, CLOC_OUTPUT_FILE)
+    if checkpoint and checkpoint.has('languages') and path.isfile(report):
+        return {'languages': Languages(report, job['name']), 'cloc': None}
+
+    try:
+        dn = open(devnull, 'w')
+        command = ['cloc', location, '--yaml', '--report-file={}'
+                   .format(report)]
+        if job['paths']:
+            command.append('--exclude-list-file={}'.format(
+                path.join(location, CLOC_EXCLUDE_FILE)))
+        _, seconds, cpu = timed_call(command, stdout=dn, stderr=dn)
+        dn.close()
+    except OSError:
+        raise IndexerDependencyFailure('`cloc` application was not found '
+                                       'on this machine.')
+
+    if not path.isfile(report):
+        logger.info('\033[1;31mEmpty\033[0m {}, skipping ..'
+                    .format(job['url']))
+        raise StatisticsUnavailable('Empty repository')
+
+    languages = Languages(report, job['name'])
+    if checkpoint:
+        checkpoint.save('languages')
+    return {'languages': languages,
+            'cloc': {'seconds': seconds, 'cpu': cpu}}
+
+
+@register('readme', provides=('readme',))
+def extract_readme(job):
+    """
+    Searchable text currently includes README files. They contain the
+    rundown of the codebase; we're primarily interested in its purpose. A
+    user search for "ruby web framework", could match a line in the rails
+    readme:
+        'Ruby on Rails is a "web framework" written in "ruby"'
+    Similarly, works for the absolute case too: "rails web framework".
+    """
+    checkpoint = job['checkpoint']
+    if checkpoint and checkpoint.has('readme'):
+        return {'readme': checkpoint.load('readme')}
+
+    readme = None
+    try:
+        # prefer README.md
+        r = re.compile(r'^README.md', re.IGNORECASE)
+        try:
+            readme_location = match_in_dir(r, job['location'])[0]
+
+        except Exception:
+            r = re.compile(r'^README', re.IGNORECASE)
+            readme_location = match_in_dir(r, job['location'])[0]
+
+        f = open(readme_location, 'r')
+        readme = normalize_string(f.read())
+        f.close()
+
+    except Exception:
+        pass  # no readme
+
+    if checkpoint:
+        checkpoint.save('readme', readme)
+    return {'readme': readme}
+
+
+@register('commit_index', provides=('commit_index',), mode=PROCESS,
+          needs=HISTORY, uses=('paths',))
+def extract_commit_index(job):
+    """
+    Brings the repository's persisted CommitIndex up to HEAD, walking only the
+    commits added since the last job, and fills in per-commit churn for up to
+    `commit_index.diff_budget` commits. Provides the index file location, or
+    None when indexes are not kept.
+    """
+    settings = cfg.settings.commit_index
+    if not settings.enabled:
+        return {'commit_index': None}
+
+    try:
+        makedirs(settings.directory)
+    except OSError:
+        pass  # exists
+    # Batch jobs without a repository id are keyed by their url
+    name = str(job['id']) if ObjectId.is_valid(str(job['id'])) else \
+        hashlib.sha1(job['id']).hexdigest()
+    location = path.join(settings.directory, '{}.idx'.format(name))
+    repository = pygit2.Repository(job['location'])
+
+    previous = CommitIndex.open(location)
+    index = CommitIndex.build(repository, previous=previous)
+    updated = index is not previous
+    if not updated:
+        index = previous.copy()  # the mapping is read only
+    if previous is not None:
+        previous.close()
+
+    def churn(a, b):
+        return score(repository, a, b, 1, job['paths'])[1:3]
+    diffed = index.diff(churn, settings.diff_budget)
+    if updated or diffed:
+        index.write(location)
+    logger.info('Indexed {} commits of {}, {} diffed'.format(
+        len(index), job['url'], diffed))
+    return {'commit_index': location}
+
+
+@register('metrics', provides=('metrics', 'contributors', 'diff_skipped'),
+          mode=PROCESS, needs=HISTORY, uses=('paths', 'commit_index'))
+def extract_metrics(job):
+    """
+    Runs the MetricSampler to get all metrics such as additions, deletions
+    number of commits for each week in time of the repository. The repository
+    and the commit index are opened here, handles cannot be passed between
+    processes.
+    """
+    index = None
+    if job['commit_index']:
+        index = CommitIndex.open(job['commit_index'])
+    try:
+        sampler = MetricSampler(pygit2.Repository(job['location']),
+                                job['paths'], job['checkpoint'], index)
+        sampler.sample_sectors()
+        return {
+            'metrics': sampler.get_metrics(),
+            'contributors': sampler.sample_contributors(),
+            'diff_skipped': sampler.skipped
+        }
+    finally:
+        if index is not None:
+            index.close()
@@ -0,0 +1,42 @@
+"""
+gate.py
+
+Limits how many workers on a node clone at the same time. The gate is created
+by the main process and shared with the workers; the limit is read on every
+acquire so it can be changed while running.
+"""
+
+from contextlib import contextmanager
+from multiprocessing import Condition, Value
+
+
+class CloneGate(object):
+
+    def __init__(self):
+        self.__active = Value('i', 0, lock=False)
+        self.__condition = Condition()
+
+    def acquire(self, limit):
+        """
+        Blocks until fewer than `limit` clones are active. Waiting re-reads
+        the limit every second.
+        :param limit: callable returning the current limit, 0 for no limit
+        :return: None
+        """
+        with self.__condition:
+            while limit() and self.__active.value >= limit():
+                self.__condition.wait(1)
+            self.__active.value += 1
+
+    def release(self):
+        with self.__condition:
+            self.__active.value -= 1
+            self.__condition.notify_all()
+
+    @contextmanager
+    def slot(self, limit):
+        self.acquire(limit)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,95 @@
+"""
+hashring.py
+
+Consistent hashing of repository ids onto indexing nodes. Each node is placed
+on the ring at a number of virtual points; a key belongs to the first node
+point at or after its own hash. When a node joins or leaves, only the keys in
+the arcs it gains or loses move.
+"""
+
+import bisect
+import hashlib
+
+
+RING_SIZE = 2 ** 32
+
+
+def point(key):
+    """
+    Position of a key on the ring.
+    :param key: string
+    :return: int
+    """
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+
+    def __init__(self, nodes=(), replicas=100):
+        """
+        :param nodes: iterable of string node names
+        :param replicas: int virtual points per node
+        """
+        self.replicas = replicas
+        self.nodes = set()
+        self.__points = []
+        self.__owners = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            p = point('{}#{}'.format(node, i))
+            self.__owners[p] = node
+            bisect.insort(self.__points, p)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for i in range(self.replicas):
+            p = point('{}#{}'.format(node, i))
+            if self.__owners.get(p) == node:
+                del self.__owners[p]
+                self.__points.remove(p)
+
+    def get_node(self, key):
+        """
+        Node owning a key.
+        :param key: string, e.g. a repository id
+        :return: string node name, or None if the ring is empty
+        """
+        if not self.__points:
+            return None
+        i = bisect.bisect_left(self.__points, point(key))
+        return self.__owners[self.__points[i % len(self.__points)]]
+
+    def arcs(self):
+        """
+        Share of the ring owned by each node.
+        :return: dict of node name to fraction
+        """
+        shares = dict((node, 0) for node in self.nodes)
+        for i, p in enumerate(self.__points):
+            previous = self.__points[i - 1] if i else \
+                self.__points[-1] - RING_SIZE
+            shares[self.__owners[p]] += p - previous
+        return dict((node, share / float(RING_SIZE))
+                    for node, share in shares.items())
+
+
+def moved(old, new, samples=4096):
+    """
+    Estimates the fraction of keys owned by a different node in `new` than in
+    `old`, by sampling evenly spaced keys.
+    :param old: HashRing
+    :param new: HashRing
+    :param samples: int
+    :return: float between 0 and 1
+    """
+    keys = [str(i) for i in range(samples)]
+    return sum(1 for k in keys if old.get_node(k) != new.get_node(k)) / \
+        float(samples)
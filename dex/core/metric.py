@@ -3,11 +3,23 @@
 from datetime import datetime
 
 
-class Metric:
+class Metric(object):
     """
     Metric is a model object to hold repository features at a specific point in
     time. This time is based on the resolution in the MetricSampler.
+
+    The commit is held as its hex id rather than a pygit2.Commit, so metrics do
+    not keep repository objects alive after sampling.
+
+    Estimated metrics have a sampling rate below 1, the share of the sector's
+    commits scored, and margins giving the bounds of the additions and
+    deletions estimates.
     """
+
+    __slots__ = ('commit', 'timestamp', 'additions', 'deletions', 'activity',
+                 'commit_count', 'contributors', 'sampling_rate',
+                 'additions_margin', 'deletions_margin')
+
     def __init__(self):
         self.commit = None
         self.timestamp = 0
@@ -15,17 +27,33 @@ class Metric:
         self.deletions = 0
         self.activity = 0
         self.commit_count = 0
+        self.contributors = 0
+        self.sampling_rate = 1.0
+        self.additions_margin = 0.0
+        self.deletions_margin = 0.0
 
     def __str__(self):
-        return '{},{:=6} additions, {:=6} deletions, {:=6} commits, {:=6} activity @ {}'.format(self.commit.id, self.additions, -self.deletions,
+        return '{},{:=6} additions, {:=6} deletions, {:=6} commits, {:=6} activity @ {}'.format(self.commit, self.additions, -self.deletions,
                            self.commit_count, self.activity, self.timestamp)
 
-    def serialize(self):
-        return dict(
-            commit=self.commit.id,
-            additions=self.additions,
-            deletions=self.deletions,
-            commit_count=self.commit_count,
-            activity=self.activity,
-            timestamp=self.timestamp
-        )
\ No newline at end of file
+    def serialize(self, repository=None):
+        """
+        Builds the database document for this metric.
+        :param repository: DBRef, repository the metric belongs to
+        :return: dict
+        """
+        document = {
+            'commit': self.commit,
+            'additions': self.additions,
+            'deletions': self.deletions,
+            'commit_count': self.commit_count,
+            'activity': self.activity,
+            'contributors': self.contributors,
+            'sampling_rate': self.sampling_rate,
+            'additions_margin': self.additions_margin,
+            'deletions_margin': self.deletions_margin,
+            'timestamp': self.timestamp
+        }
+        if repository is not None:
+            document['repository'] = repository
+        return document
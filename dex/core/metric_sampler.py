@@ -1,15 +1,121 @@
 #!/usr/bin/env python
 
 import pygit2
+import calendar
 import datetime
+import time
+import math
+import multiprocessing
+import random
+from itertools import izip
+import numpy
 from metric import Metric
-from sector import Sector
+from dex.cfg.loader import cfg
+from dex.core.commit_index import CommitIndex
 from dex.core.model.contributor import Contributor
+from dex.core.util.git import numstat, partial
 
 
 ONE_WEEK = 604800
 RESOLUTION = ONE_WEEK
 
+# Repository handle and path classifier owned by a scoring pool process, see
+# `open_repository`.
+_pool_repository = None
+_pool_classifier = None
+
+
+def score(repository, a, b, commits_for_sector, classifier=None):
+    """
+    Determines the activity score. Basic algorithm
+        commits per day * changes since last week.
+    Also determines additions and deletions which are needed in the
+    calculation. Files excluded by the classifier are not diffed. Partial
+    clones are diffed by the git client, which fetches missing blobs.
+    :return: tuple (activity, additions, deletions, files skipped)
+    """
+    additions = 0
+    deletions = 0
+    skipped = 0
+    try:
+        if partial(repository):
+            for path, added, deleted in numstat(repository.path, a, b):
+                if classifier and classifier.excluded(path):
+                    skipped += 1
+                else:
+                    additions += added
+                    deletions += deleted
+            return (1 / commits_for_sector + (additions + deletions),
+                    additions, deletions, skipped)
+
+        diff = repository.diff(a, b)
+
+        if classifier:
+            patches = []
+            for i, delta in enumerate(diff.deltas):
+                if classifier.excluded(delta.new_file.path):
+                    skipped += 1
+                else:
+                    patches.append(diff[i])
+        else:
+            patches = diff
+
+        for patch in patches:
+            additions += patch.additions
+            deletions += patch.deletions
+
+        activity = 1 / commits_for_sector + (additions + deletions)
+
+        return activity, additions, deletions, skipped
+    except ValueError:
+        return 0, 0, 0, 0
+
+
+def open_repository(location, classifier=None):
+    """
+    Scoring pool initializer. pygit2 handles cannot be shared between
+    processes, so each pool process opens its own on the same path.
+    :param location: string path to the repository
+    :param classifier: PathClassifier, or None to score every file
+    :return: None
+    """
+    global _pool_repository, _pool_classifier
+    _pool_repository = pygit2.Repository(location)
+    _pool_classifier = classifier
+
+
+def score_chunk(chunk):
+    """
+    Scores a chunk of sectors inside a pool process.
+    :param chunk: list of (a, b, commits_for_sector) tuples
+    :return: list of score tuples, in chunk order
+    """
+    return [score(_pool_repository, a, b, count, _pool_classifier)
+            for a, b, count in chunk]
+
+
+def pool_size():
+    """
+    Scoring processes a worker may use. The node has one budget,
+    `metrics.parallel.processes` or a process per core, shared between its
+    workers.
+    :return: int
+    """
+    budget = cfg.settings.metrics.parallel.processes or \
+        multiprocessing.cpu_count()
+    return budget // max(cfg.settings.general.workers, 1)
+
+
+def variance(values):
+    """
+    Sample variance, 0 for fewer than two values.
+    """
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean = sum(values) / float(n)
+    return sum((v - mean) ** 2 for v in values) / (n - 1)
+
 
 class MetricSampler:
     """
@@ -23,12 +129,31 @@ class MetricSampler:
     is determined by since/resolution. As resolution gets smaller the number of
     records produced increases. We must take data storage into consideration
     when setting the resolution. 1 week is ok. 52 metrics per Repository/year.
+    The resolution is read from `metrics.resolution` when the sampler is
+    created.
+
+    Only history newer than the configured horizon (`metrics.horizon`) is
+    scored, so the cost of sampling does not grow with the age of a
+    repository.
+
+    History is read from a CommitIndex: the repository's persisted index
+    when given, else one built by a time sorted walk that stops past the
+    horizon, allowing for `metrics.horizon.skew` seconds of clock skew.
+    Sectors are row ranges of the index.
+
+    Histories above `metrics.sampling.min_commits` are estimated rather than
+    scored exactly, see `__estimate`.
     """
 
-    def __init__(self, repository):
+    def __init__(self, repository, classifier=None, checkpoint=None,
+                 index=None):
         """
         Initialize Metric
         :param repository: pygit2.Repository
+        :param classifier: PathClassifier, files it excludes are not scored
+        :param checkpoint: Checkpoint scored sectors are saved to and resumed
+                           from
+        :param index: CommitIndex of the full history at HEAD
         """
 
         if repository and type(repository) != pygit2.Repository:
@@ -36,61 +161,83 @@ class MetricSampler:
 
         # Current features extracted are:
         self.r = repository
+        self.classifier = classifier
+        self.checkpoint = checkpoint
+        self.skipped = 0
+        self.resolution = cfg.settings.metrics.resolution
         self.head = self.r.get(self.r.head.target)
-        self.__load_commits()
+        self.horizon = self.__horizon()
+        self.index = index or self.__build_index()
+        # Rows of the commits inside the horizon, the leading rows
+        self.count = self.index.within(self.horizon)
         self.__sectors = []
         self.__metrics = []
         self.__contributors = []
+        # Per author row, filled by `sample_sectors`: additions, deletions
+        # and whether any of it is estimated, see `__attribute`
+        self.__authors = None
 
     def sample_sectors(self):
         """
-        Runs the process to sample the repository.
+        Runs the process to sample the repository. Large histories are scored
+        on a process pool, see `__parallel`.
         :return:
         """
         self.__sectors = self.__generate_sectors()
+        index = self.index
+        spans = []
 
-        for sector in self.__sectors:
-            commits_in_sector = sector.get_objects()
-            commits_count = len(commits_in_sector)
+        for first, end in self.__sectors:
+            last = end - 1
+            m = Metric()
 
-            if commits_count:
-                m = Metric()
+            m.commit_count = end - first
+            m.commit = index.hex(first)
+            m.timestamp = datetime.datetime.fromtimestamp(index.times[last])
 
-                m.commit_count = commits_count
-                last_commit = commits_in_sector[commits_count - 1]
+            m.contributors = len(numpy.unique(index.authors[first:end]))
 
-                m.commit = commits_in_sector[0]
-                score = self.__score(commits_in_sector[0].id.hex,
-                                     last_commit.id.hex, commits_count)
-                m.activity = score[0]
-                m.additions = score[1]
-                m.deletions = score[2]
-                m.timestamp = datetime.datetime.fromtimestamp(
-                    last_commit.commit_time)
+            self.__metrics.append(m)
+            spans.append((m.commit, index.hex(last), m.commit_count))
 
-                self.__metrics.append(m)
+        if self.__sampling():
+            scores = self.__estimate()
+        else:
+            scores = self.__score(spans)
+
+        for m, (activity, additions, deletions, skipped) in \
+                zip(self.__metrics, scores):
+            m.activity = activity
+            m.additions = additions
+            m.deletions = deletions
+            self.skipped += skipped
+
+        self.__authors = self.__attribute()
 
     def sample_contributors(self):
         """
-        Extracts all unique authors from the Commit objects.
+        Builds the contributors from the index: their commits within the
+        horizon, or over the full history when `metrics.horizon.contributors`
+        is `full`, and the additions and deletions attributed to them within
+        the horizon by `sample_sectors`.
         :return:
         """
+        count = self.count
+        if cfg.settings.metrics.horizon.contributors == 'full':
+            count = len(self.index)
+        commits = numpy.bincount(self.index.authors[:count],
+                                 minlength=len(self.index.emails))
+        additions, deletions, estimated = self.__authors or \
+            self.__attribute()
 
-        # Store in hashmap
-        contributors = dict()
-        for commit in self.commits:
-            try:
-                contributors[commit.author.email]["count"] += 1
-            except KeyError:
-                contributors[commit.author.email] = dict(
-                    name=commit.author.name,
-                    count=1
-                )
-
-        for k in contributors.iterkeys():
-            self.__contributors.append(Contributor(name=contributors[k]["name"],
-                                            email=k,
-                                            count=contributors[k]["count"]))
+        self.__contributors = []
+        for row in numpy.flatnonzero(commits):
+            self.__contributors.append(Contributor(
+                name=self.index.names[row], email=self.index.emails[row],
+                count=int(commits[row]),
+                additions=int(round(additions[row])),
+                deletions=int(round(deletions[row])),
+                estimated=bool(estimated[row])))
         return self.__contributors
 
     def get_metrics(self):
@@ -99,72 +246,262 @@ class MetricSampler:
     def get_contributors(self):
         return self.__contributors
 
-    def __score(self, a, b, commits_for_sector):
+    def __attribute(self):
         """
-        Determines the activity score. Basic algorithm
-            commits per day * changes since last week.
-        Also determines additions and deletions which are needed in the
-        calculation.
-        :return: tuple
+        Attributes the churn within the horizon to authors. A commit whose
+        churn against its first parent the index holds (see
+        `CommitIndex.diff`) counts for its author as is; root commits, which
+        are not diffed, count as none. The churn of the other commits is not
+        known per commit: each gets an even share of its sector's churn, and
+        the authors of such commits are marked estimated.
+        :return: tuple of arrays by author row: additions, deletions and
+                 whether estimated
         """
-        additions = 0
-        deletions = 0
-        try:
-            diff = self.r.diff(a, b)
-
-            for patch in diff:
-                additions += patch.additions
-                deletions += patch.deletions
+        index = self.index
+        count = self.count
+        size = len(index.emails)
+        authors = index.authors[:count]
+        known = (index.additions[:count] >= 0) | (index.parents[:count] < 0)
+        unknown = ~known
+
+        additions, deletions = [
+            numpy.bincount(authors[known], minlength=size,
+                           weights=numpy.maximum(churn[:count][known], 0))
+            .astype(numpy.float64)
+            for churn in (index.additions, index.deletions)]
+        if unknown.any():
+            # Sectors are contiguous runs of rows from the first
+            sizes = [end - first for first, end in self.__sectors]
+            rates = [(m.additions / float(m.commit_count),
+                      m.deletions / float(m.commit_count))
+                     for m in self.__metrics]
+            if rates:
+                rate = numpy.repeat(numpy.array(rates, numpy.float64), sizes,
+                                    axis=0)[unknown]
+                additions += numpy.bincount(authors[unknown], minlength=size,
+                                            weights=rate[:, 0])
+                deletions += numpy.bincount(authors[unknown], minlength=size,
+                                            weights=rate[:, 1])
+        estimated = numpy.bincount(authors[unknown], minlength=size) > 0
+        return additions, deletions, estimated
+
+    def __parallel(self, sectors):
+        """
+        Scoring on a pool only pays off for long histories, and when the
+        worker's share of the node's scoring budget is more than one process.
+        Daemonic processes may not have children, in which case scoring stays
+        serial.
+        :param sectors: int number of sectors to score
+        :return: boolean
+        """
+        settings = cfg.settings.metrics.parallel
+        return settings.enabled and pool_size() > 1 and \
+            not multiprocessing.current_process().daemon and \
+            self.__total_commits() >= settings.min_commits and \
+            sectors >= settings.min_sectors
+
+    def __sampling(self):
+        settings = cfg.settings.metrics.sampling
+        return bool(settings.min_commits) and \
+            self.__total_commits() > settings.min_commits
+
+    def __estimate(self):
+        """
+        Estimates the churn of each sector from a stratified random sample of
+        commits, each scored against its first parent. The sample is at most
+        `metrics.sampling.budget` commits for the repository: adjacent sectors
+        too small for a sampled commit of their own are merged into strata of
+        at least total / budget commits, and each stratum is allocated its
+        share of the budget, rounded down. The sample is seeded by HEAD, so a
+        resumed job samples the same commits. Commits whose churn the index
+        holds already are not diffed. Sector totals are extrapolated from the
+        sample mean of their stratum, with bounds of `confidence` standard
+        errors (finite population corrected) and the sampling rate of the
+        stratum set on the metric.
+
+        Note the estimate is of the churn of the sector's commits, which can
+        exceed the net diff scored in exact mode.
+        :return: list of score tuples, in sector order
+        """
+        settings = cfg.settings.metrics.sampling
+        budget = settings.budget
+        total = self.__total_commits()
+        index = self.index
+        rng = random.Random(self.head.id.hex)
+
+        strata = self.__strata(total / float(budget))
+        samples = []
+        for sectors in strata:
+            first, end = sectors[0][0], sectors[-1][1]
+            rows = numpy.arange(first, end)
+            candidates = rows[index.parents[first:end] >= 0].tolist()
+            n = min(len(candidates), int(budget * (end - first) / total))
+            samples.append(rng.sample(candidates, n))
+
+        unknown = [row for sample in samples for row in sample
+                   if index.additions[row] < 0]
+        scored = dict(izip(unknown, self.__score(
+            [(index.hex(index.parents[row]), index.hex(row), 1)
+             for row in unknown])))
+        strata_scores = [[(row,) + (scored[row] if row in scored else
+                                    (0, int(index.additions[row]),
+                                     int(index.deletions[row]), 0))
+                          for row in sample] for sample in samples]
+
+        # Strata with a single sampled commit borrow the repository's
+        # variance.
+        flat = [s for scores in strata_scores for s in scores]
+        pooled = (variance([s[2] for s in flat]),
+                  variance([s[3] for s in flat]))
+
+        results = []
+        metrics = iter(self.__metrics)
+        for sectors, scores in izip(strata, strata_scores):
+            stratum = sectors[-1][1] - sectors[0][0]
+            n = len(scores)
+            means, errors = [], []
+            for i in (2, 3):
+                values = [s[i] for s in scores]
+                var = variance(values) if n > 1 else pooled[i - 2]
+                fpc = 1 - n / float(stratum)
+                means.append(sum(values) / float(n) if n else 0.0)
+                errors.append(settings.confidence *
+                              math.sqrt(var / n * fpc) if n else 0.0)
+
+            for first, end in sectors:
+                m = next(metrics)
+                size = end - first
+                m.sampling_rate = n / float(stratum)
+                m.additions_margin, m.deletions_margin = \
+                    [size * error for error in errors]
+                additions = int(round(means[0] * size))
+                deletions = int(round(means[1] * size))
+                skipped = sum(s[4] for s in scores if first <= s[0] < end)
+                activity = 1 / size + (additions + deletions)
+                results.append((activity, additions, deletions, skipped))
+        return results
+
+    def __strata(self, least):
+        """
+        Merges adjacent sectors into strata of at least `least` commits; the
+        remainder joins the last stratum.
+        :param least: float commits per stratum
+        :return: list of lists of (first row, end row)
+        """
+        strata = []
+        current = []
+        for first, end in self.__sectors:
+            current.append((first, end))
+            if end - current[0][0] >= least:
+                strata.append(current)
+                current = []
+        if current:
+            if strata:
+                strata[-1].extend(current)
+            else:
+                strata.append(current)
+        return strata
 
-            activity = 1 / commits_for_sector + (additions + deletions)
+    def __score(self, spans):
+        """
+        Scores the sectors, skipping those scored before the last checkpoint.
+        Scores are checkpointed every `checkpoints.sectors` sectors.
+        :param spans: list of (a, b, commits_for_sector) tuples
+        :return: list of score tuples, in span order
+        """
+        done = self.checkpoint.load('sectors', {}) if self.checkpoint else {}
+        pending = [span for span in spans if span[:2] not in done]
+
+        if self.__parallel(len(pending)):
+            results = self.__score_parallel(pending)
+        else:
+            results = ((span, score(self.r, span[0], span[1], span[2],
+                                    self.classifier)) for span in pending)
+
+        every = cfg.settings.checkpoints.sectors
+        for n, (span, result) in enumerate(results, 1):
+            done[span[:2]] = result
+            if self.checkpoint and n % every == 0:
+                self.checkpoint.save('sectors', done)
+        if self.checkpoint and pending:
+            self.checkpoint.save('sectors', done)
+
+        return [done[span[:2]] for span in spans]
+
+    def __score_parallel(self, spans):
+        """
+        Splits sectors into chunks and scores them on a process pool. Results
+        are yielded in sector (time) order as chunks complete.
+        :param spans: list of (a, b, commits_for_sector) tuples
+        :return: generator of (span, score tuple)
+        """
+        settings = cfg.settings.metrics.parallel
+        size = settings.chunk_size
+        chunks = [spans[i:i + size] for i in range(0, len(spans), size)]
 
-            return activity, additions, deletions
-        except ValueError:
-            return 0, 0, 0
+        pool = multiprocessing.Pool(processes=pool_size(),
+                                    initializer=open_repository,
+                                    initargs=(self.r.path, self.classifier))
+        try:
+            for chunk, chunk_scores in izip(chunks,
+                                            pool.imap(score_chunk, chunks)):
+                for result in izip(chunk, chunk_scores):
+                    yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
     def __total_commits(self):
-        return len(self.commits)
+        return self.count
 
     # --------------------------------------------------------------------------
     # Helpers
     # --------------------------------------------------------------------------
 
-    def __load_commits(self):
+    def __build_index(self):
         """
-        Loads all commits in the repository into a list. Sets the pointer to
-        zero.
-        :return: None
+        Indexes the history to sample in memory. The walk stops past the
+        horizon, see `CommitIndex.build`, unless contributors are counted over
+        the full history.
+        :return: CommitIndex
         """
-        self.commits = list()
-        for _commit in self.r.walk(self.r.head.target,
-                                   pygit2.GIT_SORT_TOPOLOGICAL):
-            self.commits.append(_commit)
+        settings = cfg.settings.metrics.horizon
+        full = settings.contributors == 'full'
+        return CommitIndex.build(self.r, 0 if full else self.horizon,
+                                 skew=settings.skew)
 
-        self.commits = sorted(self.commits, key=lambda x: x.commit_time,
-                              reverse=True)
+    @staticmethod
+    def __horizon():
+        """
+        Oldest commit time sampled, from `metrics.horizon`: either commits
+        since a date or the last number of weeks.
+        :return: int timestamp, 0 for the full history
+        """
+        settings = cfg.settings.metrics.horizon
+        if settings.since:
+            return calendar.timegm(time.strptime(str(settings.since),
+                                                 '%Y-%m-%d'))
+        if settings.weeks:
+            return int(time.time()) - settings.weeks * ONE_WEEK
+        return 0
 
     def __generate_sectors(self):
         """
-        Returns all commits from HEAD to given commit based on the resolution.
-        :return: list
+        Splits the commits inside the horizon into sectors of the resolution.
+        A sector starts at its newest commit and holds the commits up to a
+        resolution older.
+        :return: list of (first row, end row)
         """
+        times = -self.index.times[:self.count]
         sectors = list()
-        sector = None
         x = 0
-        num_commits = len(self.commits)
-        while x < num_commits:
-            commit = self.commits[x]
-            if not sector:
-                sector = Sector(commit.commit_time,
-                                commit.commit_time - RESOLUTION)
-
-            if sector.add_object(commit, commit.commit_time):
-                x += 1
-            else:
-                sectors.append(sector)
-                sector = None
-
-        # Add last sector
-        sectors.append(sector)
-
+        while x < self.count:
+            # Commits with start >= time > start - resolution
+            end = int(numpy.searchsorted(times, times[x] + self.resolution,
+                                         side='left'))
+            sectors.append((x, end))
+            x = end
         return sectors
@@ -0,0 +1,282 @@
+"""
+metric_series.py
+
+Packed storage for a repository's metric series. Rather than one document per
+weekly Metric, a repository's series is stored as a handful of documents, each
+holding a bucket of metrics as packed parallel arrays:
+
+    {
+        repository: ObjectId,
+        bucket: 2014,           # year of the bucket, or 0 for the whole series
+        start: datetime,
+        end: datetime,
+        count: 52,
+        timestamps: Binary,     # int64 epoch seconds
+        commits: Binary,        # 20 byte raw commit ids
+        additions: Binary,      # int64
+        deletions: Binary,      # int64
+        commit_count: Binary,   # int64
+        activity: Binary,       # float64
+        contributors: Binary,   # int64, distinct authors active in the sector
+        sampling_rate: Binary,  # float64, 1 unless the sector was estimated
+        additions_margin: Binary,   # float64, bounds of estimated sectors
+        deletions_margin: Binary    # float64
+    }
+
+Arrays are little-endian regardless of the host, so documents written by one
+node can be read by any other.
+"""
+
+import struct
+from binascii import hexlify, unhexlify
+from calendar import timegm
+from datetime import datetime
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+from dex.core.digest import digest
+from dex.core.metric import Metric
+
+
+BUCKET_YEAR = 'year'
+BUCKET_ALL = 'all'
+
+COMMIT_ID_SIZE = 20
+
+# field name -> struct type code
+FIELDS = (
+    ('timestamps', 'q'),
+    ('additions', 'q'),
+    ('deletions', 'q'),
+    ('commit_count', 'q'),
+    ('activity', 'd'),
+    ('contributors', 'q'),
+    ('sampling_rate', 'd'),
+    ('additions_margin', 'd'),
+    ('deletions_margin', 'd'),
+)
+
+# Values of fields missing from documents written before they existed
+DEFAULTS = {
+    'sampling_rate': 1.0,
+}
+
+
+def pack(code, values):
+    """
+    Packs a sequence of numbers into a little-endian Binary.
+    :param code: struct type code
+    :param values: list
+    :return: bson.binary.Binary
+    """
+    return Binary(struct.pack('<{}{}'.format(len(values), code), *values))
+
+
+def unpack(code, data):
+    """
+    Reverses `pack`.
+    :param code: struct type code
+    :param data: bytes
+    :return: tuple
+    """
+    return struct.unpack('<{}{}'.format(len(data) // struct.calcsize(code),
+                                        code), data)
+
+
+def to_epoch(timestamp):
+    return timegm(timestamp.utctimetuple())
+
+
+def from_epoch(seconds):
+    return datetime.utcfromtimestamp(seconds)
+
+
+class MetricSeries(object):
+    """
+    A bucket of metrics held as parallel arrays, ordered oldest first.
+    """
+
+    __slots__ = ('bucket', 'timestamps', 'commits', 'additions', 'deletions',
+                 'commit_count', 'activity', 'contributors', 'sampling_rate',
+                 'additions_margin', 'deletions_margin')
+
+    def __init__(self, bucket=0):
+        self.bucket = bucket
+        self.timestamps = []
+        self.commits = []
+        self.additions = []
+        self.deletions = []
+        self.commit_count = []
+        self.activity = []
+        self.contributors = []
+        self.sampling_rate = []
+        self.additions_margin = []
+        self.deletions_margin = []
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, metric):
+        """
+        Appends a Metric to the end of the series.
+        :param metric: Metric
+        :return: None
+        """
+        self.timestamps.append(to_epoch(metric.timestamp))
+        self.commits.append(metric.commit)
+        self.additions.append(metric.additions)
+        self.deletions.append(metric.deletions)
+        self.commit_count.append(metric.commit_count)
+        self.activity.append(float(metric.activity))
+        self.contributors.append(metric.contributors)
+        self.sampling_rate.append(float(metric.sampling_rate))
+        self.additions_margin.append(float(metric.additions_margin))
+        self.deletions_margin.append(float(metric.deletions_margin))
+
+    def metrics(self, start=None, end=None):
+        """
+        Unpacks the series back into Metric objects, optionally restricted to
+        metrics with start <= timestamp <= end.
+        :param start: datetime
+        :param end: datetime
+        :return: list
+        """
+        lower = to_epoch(start) if start else None
+        upper = to_epoch(end) if end else None
+        metrics = []
+        for i, timestamp in enumerate(self.timestamps):
+            if (lower is not None and timestamp < lower) or \
+                    (upper is not None and timestamp > upper):
+                continue
+            m = Metric()
+            m.timestamp = from_epoch(timestamp)
+            m.commit = self.commits[i]
+            m.additions = self.additions[i]
+            m.deletions = self.deletions[i]
+            m.commit_count = self.commit_count[i]
+            m.activity = self.activity[i]
+            m.contributors = self.contributors[i]
+            m.sampling_rate = self.sampling_rate[i]
+            m.additions_margin = self.additions_margin[i]
+            m.deletions_margin = self.deletions_margin[i]
+            metrics.append(m)
+        return metrics
+
+    def serialize(self, repository):
+        """
+        Builds the packed document for this bucket.
+        :param repository: ObjectId
+        :return: dict
+        """
+        document = {
+            'repository': repository,
+            'bucket': self.bucket,
+            'start': from_epoch(self.timestamps[0]),
+            'end': from_epoch(self.timestamps[-1]),
+            'count': len(self),
+            'commits': Binary(''.join(unhexlify(c) for c in self.commits)),
+        }
+        for name, code in FIELDS:
+            document[name] = pack(code, getattr(self, name))
+        return document
+
+    @classmethod
+    def deserialize(cls, document):
+        series = cls(document['bucket'])
+        for name, code in FIELDS:
+            if name in document:
+                setattr(series, name, list(unpack(code, document[name])))
+            else:
+                # Written before the field existed
+                setattr(series, name,
+                        [DEFAULTS.get(name, 0)] * document['count'])
+        commits = document['commits']
+        series.commits = [hexlify(commits[i:i + COMMIT_ID_SIZE])
+                          for i in range(0, len(commits), COMMIT_ID_SIZE)]
+        return series
+
+
+class MetricSeriesStore(object):
+    """
+    Reads and writes packed metric series in the `metric_series` collection.
+    """
+
+    def __init__(self, db, bucket=BUCKET_YEAR):
+        if bucket not in (BUCKET_YEAR, BUCKET_ALL):
+            raise ValueError('Unknown metric bucket `{}`.'.format(bucket))
+        self.collection = db.metric_series
+        self.bucket = bucket
+        self.collection.ensure_index([('repository', ASCENDING),
+                                      ('bucket', ASCENDING)], unique=True)
+
+    def __bucket_of(self, metric):
+        return metric.timestamp.year if self.bucket == BUCKET_YEAR else 0
+
+    def pack(self, metrics):
+        """
+        Groups metrics into buckets.
+        :param metrics: list of Metric, in any order
+        :return: list of MetricSeries, oldest first
+        """
+        buckets = dict()
+        for metric in sorted(metrics, key=lambda m: m.timestamp):
+            key = self.__bucket_of(metric)
+            if key not in buckets:
+                buckets[key] = MetricSeries(key)
+            buckets[key].append(metric)
+        return [buckets[key] for key in sorted(buckets)]
+
+    def write(self, repository, metrics, previous=None):
+        """
+        Replaces the stored series of the repository with the given metrics.
+        Given the bucket hashes of the last write, only buckets whose content
+        changed are written and buckets no longer produced are removed.
+        :param repository: ObjectId
+        :param metrics: list of Metric
+        :param previous: dict of bucket to hash, from the last write
+        :return: dict of bucket to hash
+        """
+        repository = ObjectId(str(repository))
+        documents = dict((str(series.bucket), series.serialize(repository))
+                         for series in self.pack(metrics))
+        hashes = dict((bucket, digest(document))
+                      for bucket, document in documents.items())
+
+        if previous is None:
+            self.collection.remove({'repository': repository})
+            if documents:
+                self.collection.insert(documents.values())
+            return hashes
+
+        for bucket, document in documents.items():
+            if previous.get(bucket) != hashes[bucket]:
+                self.collection.update({'repository': repository,
+                                        'bucket': document['bucket']},
+                                       document, upsert=True)
+        removed = [int(bucket) for bucket in previous
+                   if bucket not in documents]
+        if removed:
+            self.collection.remove({'repository': repository,
+                                    'bucket': {'$in': removed}})
+        return hashes
+
+    def read(self, repository, start=None, end=None):
+        """
+        Unpacks the metrics of a repository within a time range. Only buckets
+        overlapping the range are fetched.
+        :param repository: ObjectId
+        :param start: datetime, inclusive
+        :param end: datetime, inclusive
+        :return: list of Metric, oldest first
+        """
+        query = {'repository': ObjectId(str(repository))}
+        if start:
+            query['end'] = {'$gte': start}
+        if end:
+            query['start'] = {'$lte': end}
+
+        metrics = []
+        for document in self.collection.find(query).sort('bucket', ASCENDING):
+            metrics.extend(MetricSeries.deserialize(document)
+                           .metrics(start, end))
+        return metrics
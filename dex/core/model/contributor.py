@@ -5,10 +5,18 @@ class Contributor(object):
     Repository Contributor.
     """
 
-    def __init__(self, name, email, count=0):
+    __slots__ = ('name', 'email', 'count', 'additions', 'deletions',
+                 'estimated')
+
+    def __init__(self, name, email, count=0, additions=0, deletions=0,
+                 estimated=False):
         self.name = name
         self.email = email
         self.count = count
+        self.additions = additions
+        self.deletions = deletions
+        # Additions and deletions are partly estimated from commit shares
+        self.estimated = estimated
 
     def get_name(self):
         return self.name
@@ -25,5 +33,22 @@ class Contributor(object):
     def inc_count(self):
         self.count += 1
 
+    def serialize(self, repository=None):
+        """
+        Builds the contributions document for this contributor.
+        :param repository: DBRef, repository contributed to
+        :return: dict
+        """
+        document = {
+            'email': self.email,
+            'contributions': self.count,
+            'additions': self.additions,
+            'deletions': self.deletions,
+            'estimated': self.estimated
+        }
+        if repository is not None:
+            document['repository'] = repository
+        return document
+
     def __str__(self):
-        return "Contributor [{} <{}>]".format(self.name, self.email)
\ No newline at end of file
+        return "Contributor [{} <{}>]".format(self.name, self.email)
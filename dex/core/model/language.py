@@ -2,15 +2,9 @@
 Statistics for a repository.
 """
 
-class Language:
+class Language(object):
 
-    name = None
-    files = None
-    lines = None
-    comments = None
-    blank = None
-    total = None
-    percentage = None
+    __slots__ = ('name', 'files', 'lines', 'comments', 'blank', 'total', 'percentage')
 
     def __init__(self, name, files, lines, comments, blank, percentage):
         self.name = name
@@ -22,15 +16,16 @@ class Language:
         self.percentage = percentage
 
     def serialize(self):
-        return dict(
-            language=self.name,
-            files=self.files,
-            lines=self.lines,
-            comments=self.comments,
-            blank=self.blank,
-            total=self.total,
-            percentage=self.percentage,
-        )
+        return {
+            'language': self.name,
+            'files': self.files,
+            'lines': self.lines,
+            'comments': self.comments,
+            'blank': self.blank,
+            'total': self.total,
+            'percentage': self.percentage,
+        }
 
     def __str__(self):
-        return "{} : files {}, lines {}, codebase - {}%".format(self.name, self.lines, round(self.percentage, 2))
+        return "{} : files {}, lines {}, codebase - {}%".format(self.name, self.files, self.lines,
+                                                                 round(self.percentage, 2))
@@ -5,45 +5,37 @@ result.py
 from datetime import datetime
 
 
-class Result:
+class Result(object):
     """
     Result is the final output from the indexing process. It encapsulates all found knowledge, indexable on the
     repository. This object can be serialized into a json object by which it is inserted into the database
     making it searchable.
+
+    State is held per instance; the document sent to the index is only built when `serialize` is called, so no
+    structure outlives the job that produced it.
     """
 
-    # serial, is the datastructure holding the object which is sent to the index.
-    __serial = dict(
-        text=dict(
-            readme=None
-        ),
-        repository=dict(
-            name=None,
-            url=None,
-            languages=list()
-        ),
-        processed=None
-    )
+    __slots__ = ('name', 'url', 'processed', 'readme', 'languages')
 
     def __init__(self, name, url):
-        self.__serial["repository"]["name"] = name
-        self.__serial["repository"]["url"] = url
-        self.__serial["processed"] = datetime.today()
+        self.name = name
+        self.url = url
+        self.processed = datetime.today()
+        self.readme = None
+        self.languages = []
 
     def set_statistics(self, statistics):
         """
         Takes a repository statistics object, serializable, appropriately
-        binding it to the object.
+        binding it to the object. The common language is always listed first.
 
         :param statistics: RepositoryStatistic
         :return: None
         """
-        languages = statistics.get_languages()
         common = statistics.get_common_language()
-        self.__serial["repository"]["languages"].append(common.serialize())
-        for language in languages:
-            if language.name != common.name:
-                self.__serial["repository"]["languages"].append(language.serialize())
+        self.languages = [common]
+        self.languages.extend(language for language in statistics.get_languages()
+                              if language.name != common.name)
 
     def set_fulltext(self, readme='', license='', changelog=''):
         """
@@ -54,7 +46,21 @@ class Result:
         :param changelog: String
         :return: None
         """
-        self.__serial["text"]["readme"] = readme
+        self.readme = readme
 
     def serialize(self):
-        return self.__serial
+        """
+        Builds the document sent to the index in a single pass.
+        :return: dict
+        """
+        return {
+            'text': {
+                'readme': self.readme
+            },
+            'repository': {
+                'name': self.name,
+                'url': self.url,
+                'languages': [language.serialize() for language in self.languages]
+            },
+            'processed': self.processed
+        }
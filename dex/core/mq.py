@@ -0,0 +1,152 @@
+"""
+Message queue helpers. Every process connects to the broker with the same
+parameters, derived from the `mq` configuration section.
+"""
+
+import json
+import pika
+from dex.cfg.loader import cfg
+
+
+def connection_parameters(timeout=None):
+    """
+    Builds the broker connection parameters.
+    :param timeout: float socket timeout in seconds, None for pika's default
+    :return: pika.ConnectionParameters
+    """
+    settings = cfg.settings.mq.connection
+    parameters = pika.ConnectionParameters(
+        host=settings.host,
+        credentials=pika.PlainCredentials(settings.username, settings.password)
+    )
+    if timeout:
+        parameters.socket_timeout = timeout
+    return parameters
+
+
+def connect(timeout=None):
+    """
+    Opens a blocking connection to the broker.
+    :param timeout: float socket timeout in seconds
+    :return: pika.BlockingConnection
+    """
+    return pika.BlockingConnection(connection_parameters(timeout))
+
+
+def publish(channel, message, queue=None):
+    """
+    Publishes a persistent JSON message onto a queue.
+    :param channel: pika channel
+    :param message: dict
+    :param queue: string queue name, defaults to the indexing queue
+    :return: None; on a channel in a transaction (see `Feeder.publish`) the
+             message is delivered once the transaction is committed
+    """
+    channel.basic_publish(
+        exchange='',
+        routing_key=queue or cfg.settings.mq.queue_name,
+        body=json.dumps(message),
+        properties=pika.BasicProperties(delivery_mode=2)
+    )
+
+
+def queue_depth(channel, queue=None, declare=False):
+    """
+    Number of messages ready on a queue, not counting unacknowledged ones.
+    :param channel: pika channel
+    :param queue: string queue name, defaults to the indexing queue
+    :param declare: boolean, declare the queue if it does not exist rather
+                    than fail
+    :return: int
+    """
+    return channel.queue_declare(queue=queue or cfg.settings.mq.queue_name,
+                                 durable=True, passive=not declare)\
+        .method.message_count
+
+
+#-------------------------------------------------------------------------------
+#   Retries
+#   A failed job is republished onto a delay queue whose TTL is the backoff
+#   for its attempt; on expiry the broker dead-letters it back onto the queue it
+#   came from. After `mq.max_retries` attempts it is parked on `<queue>.dead`.
+#-------------------------------------------------------------------------------
+
+ATTEMPTS_HEADER = 'x-attempts'
+
+
+def retry_delay(attempt):
+    """
+    Exponential backoff for an attempt, capped at `mq.max_sleep`.
+    :param attempt: int, from 1
+    :return: int seconds
+    """
+    settings = cfg.settings.mq
+    return min(settings.retry_base * 2 ** (attempt - 1), settings.max_sleep)
+
+
+def retry_queue(queue, attempt):
+    # Named by delay, so changing the backoff declares new queues rather than
+    # conflicting with the arguments of existing ones.
+    return '{}.retry.{}s'.format(queue, retry_delay(attempt))
+
+
+def dead_letter_queue(queue):
+    return '{}.dead'.format(queue)
+
+
+def declare_retry_queues(channel, queue):
+    """
+    Declares the delay queues and the dead letter queue for a queue.
+    :param channel: pika channel
+    :param queue: string queue name
+    :return: None
+    """
+    for attempt in range(1, cfg.settings.mq.max_retries + 1):
+        channel.queue_declare(queue=retry_queue(queue, attempt), durable=True,
+                              arguments={
+                                  'x-message-ttl': retry_delay(attempt) * 1000,
+                                  'x-dead-letter-exchange': '',
+                                  'x-dead-letter-routing-key': queue
+                              })
+    channel.queue_declare(queue=dead_letter_queue(queue), durable=True)
+
+
+def retry_depth(channel, queue):
+    """
+    Messages waiting on the delay queues of a queue for another attempt. The
+    queues must have been declared, see `declare_retry_queues`.
+    :param channel: pika channel
+    :param queue: string queue name
+    :return: int
+    """
+    return sum(queue_depth(channel, name) for name in set(
+        retry_queue(queue, attempt)
+        for attempt in range(1, cfg.settings.mq.max_retries + 1)))
+
+
+def retry(channel, queue, body, properties):
+    """
+    Schedules a failed message for another attempt, or dead-letters it once
+    its retries are exhausted.
+    :param channel: pika channel
+    :param queue: string queue the message was consumed from
+    :param body: string message body
+    :param properties: pika.BasicProperties of the failed message
+    :return: int attempt scheduled, None if dead-lettered
+    """
+    headers = dict(properties.headers or {})
+    attempt = headers.get(ATTEMPTS_HEADER, 0) + 1
+    headers[ATTEMPTS_HEADER] = attempt
+
+    if attempt <= cfg.settings.mq.max_retries:
+        target = retry_queue(queue, attempt)
+    else:
+        target = dead_letter_queue(queue)
+
+    channel.basic_publish(
+        exchange='',
+        routing_key=target,
+        body=body,
+        properties=pika.BasicProperties(delivery_mode=2, headers=headers)
+    )
+    return attempt if attempt <= cfg.settings.mq.max_retries else None
@@ -0,0 +1,192 @@
+"""
+paths.py
+
+Classifies repository paths the analysis should skip: vendored dependencies,
+generated code, documentation and oversized files. Rules come from
+
+    * the repository's top level `.gitattributes`, using the linguist
+      attributes (`linguist-vendored`, `linguist-generated`,
+      `linguist-documentation`); unsetting one (`-linguist-vendored` or
+      `linguist-vendored=false`) overrides the built-in rules,
+    * built-in path rules, after those of github/linguist,
+    * a size threshold, `paths.max_file_size`.
+
+Paths are relative to the repository root and use forward slashes.
+"""
+
+import os
+import re
+from fnmatch import fnmatch
+
+
+VENDORED = 'vendored'
+GENERATED = 'generated'
+DOCUMENTATION = 'documentation'
+LARGE = 'large'
+
+ATTRIBUTES = {
+    'linguist-vendored': VENDORED,
+    'linguist-generated': GENERATED,
+    'linguist-documentation': DOCUMENTATION,
+}
+
+RULES = [
+    (VENDORED, r'(^|/)(node_modules|bower_components|vendor|vendors|'
+               r'third[_-]?party|Godeps|Carthage|Pods|jspm_packages)/'),
+    (VENDORED, r'(^|/)(jquery|bootstrap|angular|react|d3|lodash|underscore|'
+               r'backbone|modernizr)([.-][\d.]+)?(\.min)?\.(js|css)$'),
+    (VENDORED, r'(^|/)\.(git|hg|svn)/'),
+    (GENERATED, r'\.min\.(js|css)$'),
+    (GENERATED, r'\.(js|css)\.map$'),
+    (GENERATED, r'(^|/)(package-lock\.json|yarn\.lock|Gemfile\.lock|'
+                r'composer\.lock|Cargo\.lock)$'),
+    (GENERATED, r'\.(pb\.go|pb\.cc|pb\.h|_pb2\.py|designer\.cs)$'),
+    (GENERATED, r'(^|/)(dist|build)/.*\.(js|css)$'),
+    (DOCUMENTATION, r'^(docs?|Documentation|javadoc|man)/'),
+]
+
+
+def read_attributes(location):
+    """
+    Reads the linguist rules of a .gitattributes file.
+    :param location: string path to the file
+    :return: list of (pattern, kind, set)
+    """
+    rules = []
+    try:
+        with open(location) as f:
+            lines = f.readlines()
+    except IOError:
+        return rules
+
+    for line in lines:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        for attribute in fields[1:]:
+            value = True
+            if attribute.startswith('-') or attribute.startswith('!'):
+                attribute, value = attribute[1:], False
+            elif '=' in attribute:
+                attribute, setting = attribute.split('=', 1)
+                value = setting.lower() not in ('false', '0')
+            if attribute in ATTRIBUTES:
+                rules.append((fields[0], ATTRIBUTES[attribute], value))
+    return rules
+
+
+def match(pattern, path):
+    """
+    gitattributes pattern matching: patterns without a slash match the file
+    name at any depth, others match from the root.
+    """
+    if '/' not in pattern.rstrip('/'):
+        return any(fnmatch(part, pattern.rstrip('/'))
+                   for part in path.split('/'))
+    pattern = pattern.lstrip('/')
+    if pattern.endswith('/**'):
+        return path.startswith(pattern[:-2])
+    return fnmatch(path, pattern) or path.startswith(pattern.rstrip('/') + '/')
+
+
+class PathClassifier(object):
+
+    def __init__(self, attributes=(), builtin=True, max_size=0):
+        """
+        :param attributes: list of (pattern, kind, set) from .gitattributes
+        :param builtin: boolean, apply the built-in rules
+        :param max_size: int bytes, larger files are skipped; 0 for no limit
+        """
+        self.attributes = list(attributes)
+        self.rules = [(kind, re.compile(rule)) for kind, rule in RULES] \
+            if builtin else []
+        self.max_size = max_size
+        self.large = set()
+
+    @classmethod
+    def from_checkout(cls, root, builtin=True, max_size=0):
+        return cls(read_attributes(os.path.join(root, '.gitattributes')),
+                   builtin, max_size)
+
+    def classify(self, path):
+        """
+        Why a path is skipped.
+        :param path: string path relative to the repository root
+        :return: string kind, or None if the path is analysed
+        """
+        # The last matching .gitattributes line wins over built-in rules
+        for pattern, kind, value in reversed(self.attributes):
+            if match(pattern, path):
+                return kind if value else None
+
+        for kind, rule in self.rules:
+            if rule.search(path):
+                return kind
+        if path in self.large:
+            return LARGE
+        return None
+
+    def excluded(self, path):
+        return self.classify(path) is not None
+
+    def scan(self, root):
+        """
+        Walks a checkout, classifying every file. Excluded directories are not
+        descended into for classification but their size is still counted.
+        Files over the size threshold are remembered, so diff scoring skips
+        them too.
+        :param root: string path to the checkout
+        :return: tuple (list of excluded absolute paths, dict of skipped
+                 files and bytes per kind)
+        """
+        excluded = []
+        skipped = dict()
+
+        def count(kind, files, size):
+            totals = skipped.setdefault(kind, {'files': 0, 'bytes': 0})
+            totals['files'] += files
+            totals['bytes'] += size
+
+        for directory, dirs, files in os.walk(root):
+            relative = os.path.relpath(directory, root)
+            relative = '' if relative == '.' else relative + '/'
+            if relative == '':
+                dirs[:] = [d for d in dirs if d != '.git']
+
+            for d in list(dirs):
+                kind = self.classify(relative + d + '/')
+                if kind:
+                    dirs.remove(d)
+                    location = os.path.join(directory, d)
+                    excluded.append(location)
+                    count(kind, *tree_size(location))
+
+            for f in files:
+                location = os.path.join(directory, f)
+                try:
+                    size = os.lstat(location).st_size
+                except OSError:
+                    continue
+                if self.max_size and size > self.max_size:
+                    self.large.add(relative + f)
+                kind = self.classify(relative + f)
+                if kind:
+                    excluded.append(location)
+                    count(kind, 1, size)
+
+        return excluded, skipped
+
+
+def tree_size(root):
+    """
+    :return: tuple (number of files, total bytes) under a directory
+    """
+    files = size = 0
+    for directory, dirs, names in os.walk(root):
+        for name in names:
+            try:
+                size += os.lstat(os.path.join(directory, name)).st_size
+                files += 1
+            except OSError:
+                pass
+    return files, size
@@ -0,0 +1,218 @@
+"""
+pipeline.py
+
+Runs the registered extractors of a job as a dependency graph. Every extractor
+starts as soon as the values it requires are available, on a thread of its
+own; process extractors are run by their thread on a child process. Where the
+worker is daemonic and may not have children, they run on the thread instead.
+
+The children are forked before the first thread starts, and are sent their
+job once it is ready: a process forked while other threads run inherits
+whatever locks those threads held at that moment, e.g. of logging, and may
+deadlock on them.
+"""
+
+import multiprocessing
+import traceback
+from Queue import Empty, Queue
+from threading import Thread
+from logging import getLogger
+from dex.cfg.loader import cfg
+from dex.core.extractors import PROCESS
+
+
+logger = getLogger('dex')
+
+INPUTS = ('id', 'location', 'name', 'url', 'checkpoint')
+
+
+def waits_for(extractor, provided):
+    """
+    The values an extractor waits for: its requirements, and the values it
+    uses that are provided.
+    :param provided: set of names provided by the extractors run
+    :return: tuple of names
+    """
+    return extractor.requires + tuple(v for v in extractor.uses
+                                      if v in provided)
+
+
+def order(extractors, available=INPUTS):
+    """
+    Checks the graph can run: every requirement is provided by exactly one
+    extractor or is an input, and there is no cycle.
+    :param extractors: list of Extractor
+    :param available: names available before any extractor runs
+    :return: list of Extractor in a runnable order
+    """
+    providers = dict()
+    for extractor in extractors:
+        for value in extractor.provides:
+            if value in providers or value in available:
+                raise ValueError('`{}` is provided by both {} and {}'.format(
+                    value, providers.get(value, 'the job'), extractor.name))
+            providers[value] = extractor.name
+
+    done = set(available)
+    ordered = []
+    pending = list(extractors)
+    while pending:
+        ready = [e for e in pending
+                 if done.issuperset(waits_for(e, providers))]
+        if not ready:
+            raise ValueError('unsatisfiable extractor requirements: {}'.format(
+                ', '.join('{} requires {}'.format(
+                    e.name, ', '.join(set(waits_for(e, providers)) - done))
+                    for e in pending)))
+        for extractor in ready:
+            pending.remove(extractor)
+            ordered.append(extractor)
+            done.update(extractor.provides)
+    return ordered
+
+
+def child(function, pipe):
+    """
+    Process target, waits for its job and sends back (values, None) or
+    (None, error). A None job means the extractor is not run.
+    """
+    try:
+        job = pipe.recv()
+        if job is None:
+            return
+        try:
+            pipe.send((function(job), None))
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            pipe.send((None, e))
+    except EOFError:
+        pass  # the pipeline gave up
+    finally:
+        pipe.close()
+
+
+def fork(function):
+    """
+    Starts a child process for an extractor, waiting for its job.
+    :return: tuple (process, pipe)
+    """
+    pipe, child_pipe = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=child,
+                                      args=(function, child_pipe))
+    process.start()
+    child_pipe.close()
+    return process, pipe
+
+
+def in_process(process, pipe, job):
+    """
+    Runs an extractor on its child process, see `fork`.
+    :return: dict of provided values
+    """
+    try:
+        pipe.send(job)
+        # Read before joining, a large result would block the child on send.
+        values, error = pipe.recv()
+    except (EOFError, IOError):
+        values, error = None, RuntimeError(
+            'extractor process exited with {}'.format(process.exitcode))
+    finally:
+        process.join()
+        pipe.close()
+    if error:
+        raise error
+    return values
+
+
+def processes_allowed():
+    return cfg.settings.extractors.processes and \
+        not multiprocessing.current_process().daemon
+
+
+def run(extractors, inputs, stage=None):
+    """
+    Runs extractors concurrently as their requirements become available. Once
+    an extractor fails no more are started; those running are waited for and
+    the first failure is raised.
+    :param extractors: list of Extractor
+    :param inputs: dict of the job's inputs, see INPUTS
+    :param stage: callable reporting the leading running extractor by name
+    :return: dict of every value provided
+    """
+    extractors = order(extractors, inputs.keys())
+    provided = set(v for e in extractors for v in e.provides)
+    values = dict(inputs)
+    pending = list(extractors)
+    running = []
+    finished = Queue()
+    errors = []
+    leading = None
+    children = dict()
+    if processes_allowed():
+        children = dict((e.name, fork(e.function)) for e in extractors
+                        if e.mode == PROCESS)
+
+    def work(extractor, job):
+        try:
+            if extractor.name in children:
+                result = in_process(*children[extractor.name] + (job,))
+            else:
+                result = extractor.function(job)
+            finished.put((extractor, result, None))
+        except Exception as e:
+            finished.put((extractor, None, e))
+
+    try:
+        while pending or running:
+            if not errors:
+                for extractor in [e for e in pending if all(
+                        r in values for r in waits_for(e, provided))]:
+                    pending.remove(extractor)
+                    job = dict((k, values[k])
+                               for k in INPUTS + extractor.requires)
+                    job.update((k, values.get(k)) for k in extractor.uses)
+                    thread = Thread(target=work, args=(extractor, job),
+                                    name='extractor-{}'.format(extractor.name))
+                    thread.daemon = True
+                    thread.start()
+                    running.append(extractor)
+            elif not running:
+                break
+
+            if stage and running and running[0].name != leading:
+                leading = running[0].name
+                stage(leading)
+
+            while True:
+                try:
+                    # A timed wait, so the worker still takes signals meanwhile
+                    extractor, result, error = finished.get(timeout=1)
+                    break
+                except Empty:
+                    pass
+            running.remove(extractor)
+            if error:
+                errors.append(error)
+            else:
+                missing = set(extractor.provides) - set(result or {})
+                if missing:
+                    errors.append(ValueError('{} did not provide {}'.format(
+                        extractor.name, ', '.join(missing))))
+                else:
+                    values.update(result)
+    finally:
+        # Children of extractors not started are released; those started are
+        # joined by their thread.
+        for extractor in pending:
+            if extractor.name in children:
+                process, pipe = children[extractor.name]
+                try:
+                    pipe.send(None)
+                except IOError:
+                    pass
+                process.join()
+                pipe.close()
+
+    if errors:
+        raise errors[0]
+    return values
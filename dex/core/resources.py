@@ -0,0 +1,312 @@
+"""
+resources.py
+
+What a job costs. A `Meter` is started when a job begins and read when it is
+stored; the usage is kept on the repository record (`resources`) and appended
+to the `job_resources` collection, one document per job, for `dex report`:
+
+    {
+        _id: ObjectId,
+        repository: ObjectId,
+        url: '...',
+        node: 'indexer-3',
+        time: datetime,         # job end, expires after `resources.history`
+        seconds: 12.1,          # wall time
+        cpu: 8.3,               # user + system of the worker and its children
+        cpu_children: 6.9,      # extractor processes and cloc
+        max_rss: 181240,        # KB, peak of the worker during the job
+        max_rss_children: 912,  # KB, largest child of the worker so far
+        read_bytes: 0,          # storage I/O of the worker, /proc/self/io
+        write_bytes: 52121600,
+        clone_strategy: 'full', # shallow | blobless | full
+        clone_bytes: 48213011,  # received by the clone
+        clone_objects: 31022,   # full clones only
+        fetched_bytes: 0,       # fetched on demand after the clone
+        cloc_seconds: 1.9,
+        cloc_cpu: 1.8,
+        workspace_bytes: 61820119
+    }
+
+Jobs of a worker run one at a time, so process wide counters are the job's.
+Where the peak RSS cannot be reset (before Linux 4.0) `max_rss` is the peak of
+the worker so far. Counters the platform does not have are left out.
+"""
+
+import os
+import resource
+import time
+from datetime import datetime, timedelta
+from subprocess import Popen
+import pygit2
+from pymongo import ASCENDING, DESCENDING
+from bson.objectid import ObjectId
+from dex.cfg.loader import cfg
+
+
+# Costs of `dex report`: name -> (heading, field, divisor), in column order
+COSTS = (
+    ('cpu', ('cpu s', 'cpu', 1)),
+    ('seconds', ('wall s', 'seconds', 1)),
+    ('rss', ('rss MB', 'max_rss', 1024)),
+    ('clone', ('clone MB', 'clone_bytes', 1024 * 1024)),
+    ('written', ('write MB', 'write_bytes', 1024 * 1024)),
+    ('cloc', ('cloc s', 'cloc_seconds', 1)),
+)
+
+
+def proc_io():
+    """
+    Storage I/O of this process and its threads.
+    :return: dict of read_bytes and write_bytes, empty where unavailable
+    """
+    counters = dict()
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('read_bytes', 'write_bytes'):
+                    counters[name] = int(value)
+    except (IOError, ValueError):
+        pass
+    return counters
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of this process (Linux 4.0+), so it can
+    be read per job.
+    :return: boolean, whether the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def peak_rss():
+    """
+    :return: int KB, peak resident set size of this process
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError, IndexError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def disk_usage(location):
+    """
+    :return: int bytes of the files under a directory
+    """
+    total = 0
+    for root, _, files in os.walk(location):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def timed_call(command, **kwargs):
+    """
+    Runs a subprocess to completion, as `subprocess.call`, and measures it.
+    :return: tuple (return code, wall seconds, cpu seconds)
+    """
+    start = time.time()
+    process = Popen(command, **kwargs)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) \
+        else -os.WTERMSIG(status)
+    return (process.returncode, time.time() - start,
+            usage.ru_utime + usage.ru_stime)
+
+
+class TransferCounter(pygit2.RemoteCallbacks):
+    """
+    Clone callbacks keeping the last transfer progress.
+    """
+
+    def __init__(self):
+        super(TransferCounter, self).__init__()
+        self.received_bytes = 0
+        self.received_objects = 0
+
+    def transfer_progress(self, stats):
+        self.received_bytes = stats.received_bytes
+        self.received_objects = stats.received_objects
+
+
+class Meter(object):
+
+    def __init__(self):
+        self.__start = None
+        self.__counters = dict()
+
+    def start(self):
+        """
+        Takes the baseline of the process counters.
+        :return: self
+        """
+        self.__counters = dict()
+        self.__start = (time.time(),
+                        resource.getrusage(resource.RUSAGE_SELF),
+                        resource.getrusage(resource.RUSAGE_CHILDREN),
+                        proc_io())
+        reset_peak_rss()
+        return self
+
+    def add(self, name, value):
+        """
+        Adds to a counter measured by the job itself, e.g. clone bytes.
+        """
+        self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.__counters[name] = value
+
+    def usage(self):
+        """
+        The usage since `start`.
+        :return: dict, see the module documentation
+        """
+        if self.__start is None:
+            return dict()
+        started, own, children, io = self.__start
+        own_now = resource.getrusage(resource.RUSAGE_SELF)
+        children_now = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        cpu_children = children_now.ru_utime + children_now.ru_stime - \
+            children.ru_utime - children.ru_stime
+        usage = {
+            'seconds': time.time() - started,
+            'cpu': own_now.ru_utime + own_now.ru_stime - own.ru_utime -
+            own.ru_stime + cpu_children,
+            'cpu_children': cpu_children,
+            'max_rss': peak_rss(),
+            'max_rss_children': children_now.ru_maxrss,
+        }
+        for name, value in proc_io().items():
+            if name in io:
+                usage[name] = value - io[name]
+        usage.update(self.__counters)
+        return usage
+
+
+class ResourceStore(object):
+    """
+    Per-job usage in the `job_resources` collection.
+    """
+
+    def __init__(self, db):
+        self.collection = db.job_resources
+        self.collection.ensure_index(
+            [('time', ASCENDING)],
+            expireAfterSeconds=cfg.settings.resources.history * 86400)
+        self.collection.ensure_index([('repository', ASCENDING),
+                                      ('time', DESCENDING)])
+
+    def record(self, repository, url, node, usage):
+        """
+        :param repository: string repository id
+        :param usage: dict from `Meter.usage`
+        :return: None
+        """
+        document = dict(usage)
+        document.update({
+            'repository': ObjectId(str(repository)),
+            'url': url,
+            'node': node,
+            'time': datetime.utcnow()
+        })
+        self.collection.insert(document)
+
+    def jobs(self, days):
+        """
+        Jobs of the last days, oldest first.
+        """
+        since = datetime.utcnow() - timedelta(days=days)
+        return self.collection.find({'time': {'$gte': since}}) \
+            .sort('time', ASCENDING)
+
+
+#-------------------------------------------------------------------------------
+#   Report
+#-------------------------------------------------------------------------------
+
+def cost(job, name):
+    """
+    :param job: job_resources document
+    :param name: name in COSTS
+    :return: float, in the unit of the report
+    """
+    _, field, divisor = dict(COSTS)[name]
+    return (job.get(field) or 0) / float(divisor)
+
+
+def rank(jobs, by, top):
+    """
+    Ranks repositories by their mean cost per job.
+    :param jobs: iterable of job_resources documents
+    :param by: name in COSTS
+    :param top: int repositories returned
+    :return: list of dict with url, jobs, and the mean and last of each cost
+    """
+    repositories = dict()
+    for job in jobs:
+        entry = repositories.setdefault(job['repository'], {
+            'url': job.get('url'), 'jobs': 0,
+            'total': dict((name, 0.0) for name, _ in COSTS)})
+        entry['jobs'] += 1
+        entry['last'] = dict((name, cost(job, name)) for name, _ in COSTS)
+        for name, _ in COSTS:
+            entry['total'][name] += entry['last'][name]
+
+    for entry in repositories.values():
+        entry['mean'] = dict((name, total / entry['jobs'])
+                             for name, total in entry['total'].items())
+    return sorted(repositories.values(), key=lambda e: e['mean'][by],
+                  reverse=True)[:top]
+
+
+def trend(jobs):
+    """
+    Daily mean cost per job.
+    :param jobs: iterable of job_resources documents
+    :return: list of (date, jobs, dict of mean cost), oldest first
+    """
+    days = dict()
+    for job in jobs:
+        day = days.setdefault(job['time'].date(),
+                              [0, dict((name, 0.0) for name, _ in COSTS)])
+        day[0] += 1
+        for name, _ in COSTS:
+            day[1][name] += cost(job, name)
+    return [(date, count, dict((name, total / count)
+                               for name, total in totals.items()))
+            for date, (count, totals) in sorted(days.items())]
+
+
+def strategies(jobs):
+    """
+    Mean bytes transferred per job by clone strategy, to compare them.
+    :param jobs: iterable of job_resources documents
+    :return: list of (strategy, jobs, mean clone MB, mean fetched MB)
+    """
+    totals = dict()
+    for job in jobs:
+        if 'clone_strategy' not in job:
+            continue  # resumed, or recorded before strategies
+        total = totals.setdefault(job['clone_strategy'], [0, 0, 0])
+        total[0] += 1
+        total[1] += job.get('clone_bytes') or 0
+        total[2] += job.get('fetched_bytes') or 0
+    megabyte = 1024.0 * 1024
+    return [(strategy, count, cloned / megabyte / count,
+             fetched / megabyte / count)
+            for strategy, (count, cloned, fetched) in sorted(totals.items())]
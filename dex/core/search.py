@@ -0,0 +1,150 @@
+"""
+search.py
+
+Management of the search index. Documents are written through an alias
+(`search.alias`), so the index behind it can be rebuilt from scratch and
+swapped in atomically:
+
+    check_alias(es, alias)              # the alias name is not an index
+    index = create_rebuild_index(es)    # refresh off, no replicas
+    ... load every document into `index` ...
+    finish_rebuild(es, index, expected) # restore, count, merge, swap the alias
+"""
+
+import os
+import yaml
+from datetime import datetime
+from logging import getLogger
+from elasticsearch import helpers
+from dex.cfg.loader import cfg
+from dex.core.exceptions.indexer import RebuildFailure
+
+
+logger = getLogger('dex')
+
+
+def mapping():
+    """
+    Loads the mapping template from the configuration directory.
+    :return: dict
+    """
+    location = os.path.join(os.path.dirname(cfg.location),
+                            cfg.settings.search.mapping)
+    with open(location) as fp:
+        return yaml.load(fp)
+
+
+def check_alias(es, alias):
+    """
+    Refuses to rebuild while a concrete index holds the alias name: it would
+    have to be deleted before the alias is created, taking search down.
+    :param es: Elasticsearch
+    :param alias: string alias name
+    :return: None
+    """
+    if not es.indices.exists_alias(name=alias) and \
+            es.indices.exists(index=alias):
+        raise RebuildFailure(
+            '`{0}` is an index rather than an alias. Migrate it first: '
+            'reindex it into a versioned index, e.g. `{0}_v1`, then delete '
+            '`{0}` and add the alias `{0}` to the copy.'.format(alias))
+
+
+def create_rebuild_index(es):
+    """
+    Creates a new versioned index with bulk friendly settings: refresh
+    disabled and no replicas.
+    :param es: Elasticsearch
+    :return: string name of the new index
+    """
+    index = '{}_{}'.format(cfg.settings.search.alias,
+                           datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    es.indices.create(index=index, body={
+        'settings': {
+            'index': {
+                'number_of_replicas': 0,
+                'refresh_interval': '-1'
+            }
+        },
+        'mappings': mapping()
+    })
+    return index
+
+
+def finish_rebuild(es, index, expected=None, force=False):
+    """
+    Restores serving settings on a rebuilt index, merges it down to a single
+    segment and swaps the alias over to it.
+    :param es: Elasticsearch
+    :param index: string name of the rebuilt index
+    :param expected: int documents the index should hold at least
+    :param force: boolean, swap even if it holds fewer
+    :return: list of indices previously behind the alias
+    """
+    settings = cfg.settings.search
+    es.indices.put_settings(index=index, body={
+        'index': {
+            'number_of_replicas': settings.replicas,
+            'refresh_interval': settings.refresh_interval
+        }
+    })
+    es.indices.refresh(index=index)
+
+    count = es.count(index=index)['count']
+    if expected is not None and count < expected and not force:
+        raise RebuildFailure(
+            '{} holds {} documents, {} expected; the alias was not swapped. '
+            'Inspect the index, then swap with --force or delete it.'.format(
+                index, count, expected))
+
+    # forcemerge replaced optimize in Elasticsearch 2.1
+    merge = getattr(es.indices, 'forcemerge', None) or es.indices.optimize
+    merge(index=index, max_num_segments=1)
+
+    return swap_alias(es, settings.alias, index)
+
+
+def swap_alias(es, alias, index):
+    """
+    Points the alias at `index` and away from every other index in a single
+    atomic update. Previous indices are kept for rollback.
+    :return: list of indices previously behind the alias
+    """
+    check_alias(es, alias)
+    previous = []
+    if es.indices.exists_alias(name=alias):
+        previous = es.indices.get_alias(name=alias).keys()
+
+    actions = [{'remove': {'index': i, 'alias': alias}} for i in previous]
+    actions.append({'add': {'index': index, 'alias': alias}})
+    es.indices.update_aliases(body={'actions': actions})
+    return previous
+
+
+def bulk_load(es, index, results):
+    """
+    Writes search documents with the bulk API, on several threads when the
+    client supports it.
+    :param es: Elasticsearch
+    :param index: string index or alias to write to
+    :param results: iterable of (repository id, Result)
+    :return: int number of documents written
+    """
+    settings = cfg.settings.search
+    actions = ({
+        '_index': index,
+        '_type': settings.doc_type,
+        '_id': str(_id),
+        '_source': result.serialize()
+    } for _id, result in results)
+
+    written = 0
+    if hasattr(helpers, 'parallel_bulk'):
+        for ok, item in helpers.parallel_bulk(
+                es, actions, thread_count=settings.bulk_threads,
+                chunk_size=settings.bulk_size):
+            written += ok
+    else:
+        written, errors = helpers.bulk(es, actions,
+                                       chunk_size=settings.bulk_size)
+    return written
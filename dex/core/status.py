@@ -0,0 +1,236 @@
+"""
+status.py
+
+Live status of a node's workers. Each worker owns one slot of a shared memory
+table and writes its current job and stage into it; the main process reads the
+table to render the status board and to write a JSON snapshot for scripts
+(`dex status`).
+
+Slots are fixed size ctypes structures, so reporting a stage costs a lock and
+a few stores; nothing is sent between processes.
+"""
+
+import json
+import os
+from collections import deque
+from ctypes import Structure, c_char, c_double, c_int
+from multiprocessing import Array
+from time import time
+
+
+IDLE = 'idle'
+EXTRACT = 'extract'  # extractors without a stage of their own
+STAGES = ('check', 'clone', 'paths', 'languages', 'readme', 'metrics',
+          EXTRACT, 'store', 'search', 'paused')
+
+ID_SIZE = 24
+URL_SIZE = 160
+
+
+class Slot(Structure):
+    _fields_ = [
+        ('pid', c_int),
+        ('stage', c_int),            # index into STAGES, -1 when idle
+        ('id', c_char * ID_SIZE),
+        ('url', c_char * URL_SIZE),
+        ('job_started', c_double),
+        ('stage_started', c_double),
+        ('jobs', c_int),
+        ('failures', c_int),
+        ('stage_time', c_double * len(STAGES)),
+    ]
+
+
+class WorkerStatus(object):
+    """
+    A worker's handle on its slot.
+    """
+
+    def __init__(self, board, worker_id):
+        self.lock = board.slots.get_lock()
+        self.slot = board.slots[worker_id - 1]
+        with self.lock:
+            self.slot.pid = os.getpid()
+            self.slot.stage = -1
+            self.slot.job_started = 0  # left by a worker that died mid-job
+
+    def __close_stage(self, now):
+        if self.slot.stage >= 0:
+            self.slot.stage_time[self.slot.stage] += \
+                now - self.slot.stage_started
+
+    def job(self, _id, url):
+        """
+        Starts reporting a job.
+        :param _id: string repository ID
+        :param url: string repository url
+        :return: None
+        """
+        now = time()
+        with self.lock:
+            self.slot.id = str(_id)[:ID_SIZE]
+            self.slot.url = url.encode('utf-8')[:URL_SIZE]
+            self.slot.job_started = now
+            self.slot.stage = -1
+
+    def stage(self, name):
+        """
+        Moves the current job to a stage, accounting the time of the last one.
+        :param name: string, one of STAGES
+        :return: None
+        """
+        now = time()
+        with self.lock:
+            self.__close_stage(now)
+            self.slot.stage = STAGES.index(name if name in STAGES
+                                           else EXTRACT)
+            self.slot.stage_started = now
+
+    def retire(self):
+        with self.lock:
+            self.slot.pid = 0
+
+    def done(self, failed=False):
+        """
+        Ends the current job.
+        :param failed: boolean
+        :return: None
+        """
+        with self.lock:
+            self.__close_stage(time())
+            self.slot.stage = -1
+            self.slot.id = ''
+            self.slot.url = ''
+            self.slot.job_started = 0
+            self.slot.jobs += 1
+            if failed:
+                self.slot.failures += 1
+
+
+class StatusBoard(object):
+    """
+    The shared status table of a node, one slot per worker id.
+    """
+
+    def __init__(self, size):
+        self.slots = Array(Slot, size)
+        self.__history = deque()
+
+    def reporter(self, worker_id):
+        """
+        :param worker_id: int, from 1
+        :return: WorkerStatus, or None if the id has no slot
+        """
+        if worker_id > len(self.slots):
+            return None
+        return WorkerStatus(self, worker_id)
+
+    def busy(self):
+        """
+        :return: int number of workers holding a job
+        """
+        with self.slots.get_lock():
+            return sum(1 for s in self.slots if s.pid and s.job_started)
+
+    def snapshot(self, depth=None):
+        """
+        Reads the table into a document. Throughput is measured over the last
+        minute of snapshots.
+        :param depth: dict of queue name to depth, to include
+        :return: dict
+        """
+        now = time()
+        with self.slots.get_lock():
+            slots = [(i + 1, s.pid, s.stage, s.id, s.url, s.job_started,
+                      s.stage_started, s.jobs, s.failures, list(s.stage_time))
+                     for i, s in enumerate(self.slots) if s.pid]
+
+        workers = []
+        stage_time = [0.0] * len(STAGES)
+        jobs = 0
+        for worker_id, pid, stage, _id, url, job_started, stage_started, \
+                done, failures, times in slots:
+            busy = bool(job_started)
+            workers.append({
+                'worker': worker_id,
+                'pid': pid,
+                'stage': STAGES[stage] if stage >= 0 else IDLE,
+                'id': _id or None,
+                'url': url or None,
+                'job_time': now - job_started if busy else 0,
+                'stage_time': now - stage_started if stage >= 0 else 0,
+                'jobs': done,
+                'failures': failures,
+            })
+            jobs += done
+            for i, seconds in enumerate(times):
+                stage_time[i] += seconds
+            if stage >= 0:
+                stage_time[stage] += now - stage_started
+
+        self.__history.append((now, jobs))
+        while self.__history[0][0] < now - 60:
+            self.__history.popleft()
+        start, start_jobs = self.__history[0]
+        rate = (jobs - start_jobs) * 60.0 / (now - start) \
+            if now > start else 0
+
+        return {
+            'time': now,
+            'workers': workers,
+            'jobs': jobs,
+            'jobs_per_minute': rate,
+            'queues': depth or {},
+            'stages': dict(zip(STAGES, stage_time)),
+        }
+
+
+def write_snapshot(snapshot, location):
+    """
+    Writes a snapshot atomically, so readers never see a partial file.
+    """
+    with open(location + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.rename(location + '.tmp', location)
+
+
+def read_snapshot(location):
+    with open(location) as f:
+        return json.load(f)
+
+
+def render(snapshot, longest=5):
+    """
+    Formats a snapshot as the terminal board.
+    :param snapshot: dict, see `StatusBoard.snapshot`
+    :param longest: int number of longest running jobs to list
+    :return: string
+    """
+    workers = snapshot['workers']
+    busy = [w for w in workers if w['id']]
+    lines = ['workers {}/{} busy   jobs {}   {:.1f} jobs/min   {}'.format(
+        len(busy), len(workers), snapshot['jobs'],
+        snapshot['jobs_per_minute'], '   '.join(
+            '{} {}'.format(q, d) for q, d in sorted(
+                snapshot['queues'].items()))), '']
+
+    lines.append('{:>4} {:<10} {:>8} {:>6} {:>6}  {}'.format(
+        '#', 'stage', 'for', 'jobs', 'failed', 'repository'))
+    for w in workers:
+        lines.append('{:>4} {:<10} {:>7.0f}s {:>6} {:>6}  {}'.format(
+            w['worker'], w['stage'], w['stage_time'], w['jobs'],
+            w['failures'], w['url'] or ''))
+
+    total = sum(snapshot['stages'].values())
+    if total:
+        lines.extend(['', 'time by stage: ' + '  '.join(
+            '{} {:.0%}'.format(stage, snapshot['stages'][stage] / total)
+            for stage in STAGES if snapshot['stages'].get(stage))])
+
+    if busy:
+        lines.extend(['', 'longest running:'])
+        for w in sorted(busy, key=lambda w: w['job_time'],
+                        reverse=True)[:longest]:
+            lines.append('  {:>7.0f}s  worker#{:<3} {:<10} {}'.format(
+                w['job_time'], w['worker'], w['stage'], w['url']))
+    return '\n'.join(lines)
@@ -0,0 +1,139 @@
+"""
+Utilities for talking to git remotes, through the git client. Every command
+is killed after a timeout from the `git` configuration section, raising
+GitTimeout; transfers that stall are aborted by git itself.
+"""
+
+import os
+import signal
+from subprocess import Popen, PIPE
+from threading import Timer
+from dex.cfg.loader import cfg
+from dex.core.exceptions.indexer import GitTimeout
+
+
+def run(arguments, timeout):
+    """
+    Runs a git command. It runs in a process group of its own, so transports
+    and other helpers git starts are killed with it on timeout.
+    :param arguments: list of git arguments
+    :param timeout: float seconds
+    :return: tuple (return code, stdout, stderr)
+    """
+    settings = cfg.settings.git
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0',
+               GIT_HTTP_LOW_SPEED_LIMIT=str(settings.low_speed_limit),
+               GIT_HTTP_LOW_SPEED_TIME=str(settings.low_speed_time))
+    process = Popen(['git'] + arguments, stdout=PIPE, stderr=PIPE, env=env,
+                    preexec_fn=os.setsid)
+    expired = []
+
+    def kill():
+        expired.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass  # exited meanwhile
+
+    watchdog = Timer(timeout, kill)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        out, err = process.communicate()
+    finally:
+        watchdog.cancel()
+        watchdog.join()
+    if expired:
+        raise GitTimeout('`git {}` timed out after {}s'.format(
+            ' '.join(arguments), timeout))
+    return process.returncode, out, err
+
+
+def remote_head(url):
+    """
+    Resolves the commit the remote HEAD points to. Only the ref advertisement
+    is read; no objects are transferred.
+
+    :param url: string repository url
+    :return: string hex commit id, or None if it could not be resolved
+    """
+    try:
+        code, out, err = run(['ls-remote', url, 'HEAD'],
+                             cfg.settings.git.remote_timeout)
+    except OSError:
+        return None  # git is not installed
+
+    if code != 0:
+        return None
+    for line in out.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1] == 'HEAD':
+            return fields[0]
+    return None
+
+
+SHALLOW = 'shallow'
+BLOBLESS = 'blobless'
+FULL = 'full'
+
+CLONE_OPTIONS = {
+    SHALLOW: ['--depth', '1', '--no-tags', '--single-branch'],
+    BLOBLESS: ['--filter=blob:none'],
+}
+
+
+def clone(url, location, strategy):
+    """
+    Clones with the git client. A `shallow` clone fetches the HEAD commit and
+    its tree only; a `blobless` clone fetches every commit and tree but only
+    the blobs HEAD checks out, the others are fetched on demand (a partial
+    clone, the server must allow filters). Full clones are done by pygit2.
+
+    Plain paths are cloned locally and ignore both options; to compare the
+    strategies locally serve the repository as a file:// url, with
+    `uploadpack.allowFilter` set for blobless clones.
+
+    :param url: string repository url
+    :param location: string path, must not exist or be empty
+    :param strategy: SHALLOW or BLOBLESS
+    :return: string error, or None once cloned
+    """
+    code, out, err = run(['clone', '--quiet'] + CLONE_OPTIONS[strategy] +
+                         [url, location], cfg.settings.git.clone_timeout)
+    if code != 0:
+        return err.strip() or 'git clone exited with {}'.format(code)
+    return None
+
+
+def partial(repository):
+    """
+    :param repository: pygit2.Repository
+    :return: boolean, whether the repository is a partial clone, with objects
+             only its promisor remote holds
+    """
+    return 'remote.origin.promisor' in repository.config
+
+
+def numstat(location, a, b):
+    """
+    Lines added and deleted per file between two commits, by the git client.
+    Unlike libgit2 it fetches the blobs a partial clone is missing.
+
+    :param location: string path to the repository
+    :param a: string commit id
+    :param b: string commit id
+    :return: list of (path, additions, deletions), binary files count 0
+    """
+    code, out, err = run(['-C', location, 'diff', '--numstat', '-z',
+                          '--no-renames', a, b], cfg.settings.git.diff_timeout)
+    if code != 0:
+        raise ValueError(err.strip())
+
+    files = []
+    for record in out.split('\0'):
+        fields = record.split('\t', 2)
+        if len(fields) == 3:
+            additions, deletions, path = fields
+            files.append((path, int(additions) if additions != '-' else 0,
+                          int(deletions) if deletions != '-' else 0))
+    return files
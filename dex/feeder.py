@@ -0,0 +1,226 @@
+"""
+feeder.py
+
+Fills the indexing queue from the `repositories` collection at the rate the
+workers consume it. A repository is due when it
+
+    * is idle, i.e. never indexed or re-queued by hand,
+    * was indexed more than `feed.refresh_after` days ago, or
+    * was queued more than `feed.requeue_after` hours ago and never finished,
+      e.g. its message was lost; a failed job's pending retry counts as
+      queued when it is due to be delivered (see `Worker.record_failure`),
+
+and has failed fewer than `feed.max_errors` times in a row; a successful job
+resets the count. Oldest first.
+
+Every `feed.interval` seconds the feeder measures how many messages were
+consumed since the last tick and smooths the rate with an exponentially
+weighted moving average (`mq.smoothing_constant`). It tops the queue up to
+what the workers will consume before the next tick, never below
+`feed.min_depth`, in batches of at most `mq.feed_size`. In cluster mode the
+depth is that of the shared queue plus the queue of every live node, since
+the routers empty the shared queue as soon as messages arrive.
+
+A batch is published in one broker transaction: the repositories are marked
+queued once the broker committed the whole batch, with one round trip rather
+than a confirm per message.
+"""
+
+from datetime import datetime, timedelta
+from math import ceil
+from time import sleep, time
+from pymongo import ASCENDING
+from logger import logger
+from cfg.loader import cfg
+from pika import exceptions
+from core import constants, mq
+from core.cluster import NodeRegistry, node_queue
+from core.db import MongoConnection
+
+logger = logger.get_logger('dex')
+
+
+def ensure_indexes(collection):
+    """
+    Due queries select on state, then range over indexed_on or queued_on;
+    error_count is checked from the index.
+    """
+    collection.ensure_index([('state', ASCENDING), ('indexed_on', ASCENDING),
+                             ('error_count', ASCENDING)])
+    collection.ensure_index([('state', ASCENDING), ('queued_on', ASCENDING),
+                             ('error_count', ASCENDING)])
+
+
+def due_queries(now):
+    """
+    :param now: datetime
+    :return: list of (query, sort field), in order of priority
+    """
+    settings = cfg.settings.feed
+    errors = {'$not': {'$gte': settings.max_errors}}  # missing counts as 0
+    return [
+        ({'state': {'$in': [constants.REPOSITORY_IDLE, None]},
+          'error_count': errors},
+         'indexed_on'),
+        ({'state': constants.REPOSITORY_INDEXED, 'error_count': errors,
+          'indexed_on': {'$lt': now - timedelta(days=settings.refresh_after)}},
+         'indexed_on'),
+        ({'state': constants.REPOSITORY_QUEUED, 'error_count': errors,
+          'queued_on': {'$lt': now - timedelta(hours=settings.requeue_after)}},
+         'queued_on'),
+    ]
+
+
+def due(collection, limit):
+    """
+    Selects up to `limit` due repositories.
+    :return: list of repository documents with _id and url
+    """
+    now = datetime.today()
+    repositories = []
+    for query, field in due_queries(now):
+        if len(repositories) >= limit:
+            break
+        repositories.extend(collection.find(query, {'url': 1})
+                            .sort(field, ASCENDING)
+                            .limit(limit - len(repositories)))
+    return repositories
+
+
+class Feeder(object):
+
+    def __init__(self):
+        db = MongoConnection().get_db()
+        self.collection = db.repositories
+        self.registry = NodeRegistry(db)
+        self.connection = None
+        self.channel = None
+        self.rate = None  # smoothed messages consumed per second
+        self.published = 0
+        self.last = None  # (time, depth) at the last tick
+        self.consumers = 1  # nodes consuming, at the last tick
+
+    def connect(self):
+        self.connection = mq.connect(cfg.settings.boot.timeout)
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=cfg.settings.mq.queue_name,
+                                   durable=True)
+        self.channel.tx_select()
+
+    def nodes(self):
+        if cfg.settings.cluster.enabled:
+            return self.registry.live()
+        return []
+
+    def depth(self, nodes):
+        """
+        Messages ready for the workers: on the shared queue and the queues of
+        the given nodes.
+        :param nodes: list of string node names
+        :return: int
+        """
+        return mq.queue_depth(self.channel) + sum(
+            mq.queue_depth(self.channel, node_queue(node), declare=True)
+            for node in nodes)
+
+    def min_depth(self):
+        settings = cfg.settings
+        return settings.feed.min_depth or \
+            settings.general.workers * settings.mq.prefetch * self.consumers
+
+    def observe(self, depth):
+        """
+        Updates the consumption rate from the queue depth: whatever was there
+        at the last tick, plus what was published since, minus what is left
+        has been consumed.
+        :param depth: int messages ready on the queue
+        :return: None
+        """
+        now = time()
+        if self.last:
+            then, last_depth = self.last
+            consumed = max(0, last_depth + self.published - depth)
+            rate = consumed / max(now - then, 1e-3)
+            alpha = cfg.settings.mq.smoothing_constant
+            self.rate = rate if self.rate is None else \
+                alpha * rate + (1 - alpha) * self.rate
+        self.last = (now, depth)
+        self.published = 0
+
+    def target(self):
+        """
+        Queue depth that keeps every worker busy until the next tick.
+        :return: int
+        """
+        expected = int(ceil((self.rate or 0) * cfg.settings.feed.interval))
+        return max(self.min_depth(), expected)
+
+    def publish(self, repositories):
+        """
+        Publishes a batch in one transaction, marking the repositories queued
+        once the broker committed it.
+        :param repositories: list of repository documents
+        :return: int number committed
+        """
+        if not repositories:
+            return 0
+        try:
+            for repository in repositories:
+                mq.publish(self.channel, {'id': str(repository['_id']),
+                                          'url': repository['url']})
+            self.channel.tx_commit()
+        except exceptions.AMQPError as e:
+            # Nothing of an uncommitted batch is delivered; the repositories
+            # stay due.
+            logger.warning('feeder: batch of {} not committed: {}'.format(
+                len(repositories), e))
+            self.connection.close()
+            self.connect()
+            return 0
+
+        self.collection.update(
+            {'_id': {'$in': [r['_id'] for r in repositories]}},
+            {'$set': {'state': constants.REPOSITORY_QUEUED,
+                      'queued_on': datetime.today()}},
+            multi=True)
+        return len(repositories)
+
+    def tick(self):
+        """
+        Tops the queue up to its target depth.
+        :return: int number published
+        """
+        nodes = self.nodes()
+        depth = self.depth(nodes)
+        self.consumers = max(len(nodes), 1)
+        self.observe(depth)
+        need = min(self.target() - depth, cfg.settings.mq.feed_size)
+        if need <= 0:
+            return 0
+
+        repositories = due(self.collection, need)
+        self.published = self.publish(repositories)
+        return self.published
+
+    def run(self, once=False):
+        ensure_indexes(self.collection)
+        self.connect()
+        try:
+            while True:
+                published = self.tick()
+                print '> depth {} target {} rate {:.2f}/s published {}'\
+                    .format(self.last[1], self.target(), self.rate or 0,
+                            published)
+                if once:
+                    break
+                sleep(cfg.settings.feed.interval)
+                cfg.refresh()
+        finally:
+            self.connection.close()
+
+
+def run(args):
+    """
+    Feeds the indexing queue until interrupted.
+    """
+    Feeder().run(once=args.once)
@@ -4,61 +4,92 @@ module then performs a number of analysis on the repository. The results from
 this is then searchable for users.
 """
 
-import re
 import time
 from datetime import datetime
-from os import makedirs, devnull
+from os import makedirs
 from os import path
 from shutil import rmtree
-from subprocess import call
 import pygit2
-from algthm.utils.file import match_in_dir
-from algthm.utils.string import normalize_string
 from bson.objectid import ObjectId
 from bson.dbref import DBRef
 from cfg.loader import cfg
+from core import constants
+from core.cluster import node_name
 from core.db import MongoConnection
-from core.exceptions.indexer import IndexerDependencyFailure
+from core.util import git
+from core.util.git import remote_head
 from core.exceptions.indexer import RepositoryCloneFailure
-from core.exceptions.indexer import StatisticsUnavailable
-from core.model.languages import Languages
 from core.model.result import Result
 from logger import logger
-from core.metric_sampler import MetricSampler
+from core import extractors, pipeline
+from core.metric_series import MetricSeriesStore
+from core.contributor_store import ContributorStore
+from core.digest import changed, digest
+from core.resources import Meter, ResourceStore, TransferCounter, \
+    disk_usage
+from core.analysis_store import AnalysisStore
 from elasticsearch import Elasticsearch
 
 
 logger = logger.get_logger('dex')
-CLOC_OUTPUT_FILE = 'cloc.yaml'
+# Search document fields that change every run, left out of its hash
+SEARCH_VOLATILE = ('processed',)
 
 
 class Indexer:
     """Indexer analyses repositories and stores result in database"""
 
-    def __init__(self, worker_id, _id, url):
+    def __init__(self, worker_id, _id, url, clone_gate=None, index=None,
+                 status=None, checkpoint=None):
         """
         Initialize an indexer with id and url.
 
         :param worker_id: int worker ID
         :param _id: int repository ID
         :param url: string repository url
+        :param clone_gate: CloneGate limiting concurrent clones on this node
+        :param index: string search index to write to, defaults to the alias
+        :param status: WorkerStatus the stages of the job are reported to
+        :param checkpoint: Checkpoint to resume from and save completed stages
+                           to; the clone then lives in the checkpoint
         :return: None
         """
         self.db_conn = MongoConnection().get_db()
         self.worker_id = worker_id
         self.id = _id
         self.url = url
+        self.clone_gate = clone_gate
+        self.status = status
+        self.index_name = index or cfg.settings.search.alias
         self.name = url.split('/')[-1]
         self.location = path.join(cfg.settings.general.directory,
                                   '{}@{}'.format(self.name, self.worker_id))
 
+        # A checkpoint held by another worker, e.g. of a duplicate job, is
+        # left alone and the job runs from scratch.
+        self.checkpoint = checkpoint if checkpoint and checkpoint.acquire() \
+            else None
+        if self.checkpoint:
+            self.location = self.checkpoint.location
+        self.completed = False
+        self.meter = Meter()
+        # Size of the object store once cloned, to measure on demand fetches
+        self.__cloned_objects = None
+
         self.repo = None
         self.result = None
         self.language_statistics = None
         self.readme = None
+        self.metrics = None
+        self.contributors = None
+        self.paths = None
+        self.skipped = dict()
         self.__start_time = None
 
     def __enter__(self):
+        self.meter.start()
+        if self.checkpoint and self.checkpoint.has('clone'):
+            return self  # resuming
         try:
             rmtree(self.location)
         except OSError:
@@ -67,11 +98,18 @@ class Indexer:
         return self
 
     def __exit__(self, type, value, traceback):
-        try:
-            rmtree(self.location)
-            # pass
-        except OSError:
-            pass
+        if self.checkpoint:
+            # Unfinished jobs keep their checkpoint for the retry.
+            if self.completed:
+                self.checkpoint.clear()
+            else:
+                self.checkpoint.release()
+        else:
+            try:
+                rmtree(self.location)
+                # pass
+            except OSError:
+                pass
         self.repo = None
         self.language_statistics = None
         self.name = None
@@ -79,172 +117,329 @@ class Indexer:
 
     def load(self):
         """
-        Downloads the repository to the file system.
+        Downloads the repository to the file system, unless a checkpoint holds
+        the clone already.
         """
-        logger.info('\033[1;33mCloning\033[0m {}'.format(self.url))
-        try:
-            pygit2.clone_repository(self.url, self.location)
-            self.repo = pygit2.init_repository(self.location)
-        except pygit2.GitError, err:
-            raise RepositoryCloneFailure(
-                ('Unable to clone repository {}, with error: {}'.format(
-                    self.url, err)))
+        self.stage('clone')
+        if self.checkpoint and self.checkpoint.has('clone'):
+            logger.info('\033[1;33mResuming\033[0m {}'.format(self.url))
+            self.repo = pygit2.Repository(self.location)
+            return self
+
+        strategy = self.clone_strategy()
+        if self.clone_gate:
+            with self.clone_gate.slot(
+                    lambda: cfg.settings.general.clone_concurrency):
+                self.__clone(strategy)
+        else:
+            self.__clone(strategy)
 
+        if self.checkpoint:
+            self.checkpoint.save('clone', self.repo.head.target.hex)
         return self
 
+    def clone_strategy(self):
+        """
+        Picks how much of the repository to clone. Jobs whose enabled
+        extractors only read the checkout clone shallow. Jobs reading history
+        clone blobless - diffs then fetch the blobs they need - when the last
+        full clone received more than `clone.blobless_above` bytes, or the
+        repository was cloned blobless before; otherwise, and while the size
+        is unknown, in full.
+        :return: string strategy, see `git.clone`
+        """
+        settings = cfg.settings.clone
+        if not settings.select:
+            return git.FULL
+        if all(e.needs != extractors.HISTORY for e in extractors.enabled()):
+            return git.SHALLOW
+
+        repo_model = dict()
+        if ObjectId.is_valid(str(self.id)):  # batch jobs may have no record
+            repo_model = self.db_conn.repositories.find_one(
+                {'_id': ObjectId(self.id)}, {'resources': 1}) or {}
+        last = repo_model.get('resources') or {}
+        strategy = last.get('clone_strategy', git.FULL)
+        if strategy == git.BLOBLESS or (strategy == git.FULL and
+                                        last.get('clone_bytes', 0) >
+                                        settings.blobless_above):
+            return git.BLOBLESS
+        return git.FULL
+
+    def __clone(self, strategy):
+        logger.info('\033[1;33mCloning\033[0m {} ({})'.format(self.url,
+                                                              strategy))
+        if strategy != git.FULL:
+            try:
+                error = git.clone(self.url, self.location, strategy)
+            except OSError:
+                logger.warning('`git` was not found, cloning {} in full'
+                               .format(self.url))
+                strategy = git.FULL
+            else:
+                if error:
+                    raise RepositoryCloneFailure(
+                        'Unable to clone repository {}, with error: {}'.format(
+                            self.url, error))
+                self.repo = pygit2.Repository(self.location)
+                # Packs are kept as received
+                self.__cloned_objects = disk_usage(self.__objects())
+                self.meter.add('clone_bytes', self.__cloned_objects)
+
+        if strategy == git.FULL:
+            transfer = TransferCounter()
+            try:
+                pygit2.clone_repository(self.url, self.location,
+                                        callbacks=transfer)
+                self.repo = pygit2.init_repository(self.location)
+            except pygit2.GitError, err:
+                raise RepositoryCloneFailure(
+                    ('Unable to clone repository {}, with error: {}'.format(
+                        self.url, err)))
+            finally:
+                self.meter.add('clone_bytes', transfer.received_bytes)
+                self.meter.add('clone_objects', transfer.received_objects)
+            self.__cloned_objects = disk_usage(self.__objects())
+        self.meter.set('clone_strategy', strategy)
+
+    def __objects(self):
+        return path.join(self.repo.path, 'objects')
+
+    def unchanged(self):
+        """
+        Checks whether the remote HEAD still points at the commit indexed last
+        time, without cloning.
+        :return: boolean
+        """
+        self.stage('check')
+        repo_model = self.db_conn.repositories.find_one(
+            {'_id': ObjectId(self.id)}, {'head': 1})
+        if not repo_model or not repo_model.get('head'):
+            return False
+        return remote_head(self.url) == repo_model['head']
+
+    def touch(self):
+        """
+        Marks an unchanged repository as indexed now.
+        :return: None
+        """
+        self.db_conn.repositories.update(
+            {
+                '_id': ObjectId(self.id)
+            },
+            {
+                '$set': {
+                    'state': constants.REPOSITORY_INDEXED,
+                    'indexed_on': datetime.today(),
+                    'error_count': 0,
+                    'node': node_name()
+                }
+            },
+            upsert=False
+        )
+        self.completed = True
+        logger.info('\033[1;32mUnchanged\033[0m {}, skipping ..'
+                    .format(self.url))
+
     def index(self):
         """
         Begin the indexing transaction. A number of steps are carried out once
         the repository has been cloned on to the file system.
         """
-        repo_model = self.db_conn.repositories.find_one({'_id': self.id})
+        self.analyse()
+        self.process_results()
 
+    def analyse(self):
+        """
+        Runs every registered extractor on the cloned repository, independent
+        ones concurrently (see `pipeline`), and aggregates the results,
+        without writing anywhere.
+        :return: self
+        """
         self.__start_time = time.time()
-        self.extract_language_statistics()
-        self.extract_readme()
-        self.extract_metrics()
+        values = pipeline.run(extractors.enabled(), {
+            'id': self.id,
+            'location': self.location,
+            'name': self.name,
+            'url': self.url,
+            'checkpoint': self.checkpoint
+        }, self.stage)
+
+        # Any extractor may be disabled, see `extractors.enabled`
+        self.paths = values.get('paths')
+        self.skipped = values.get('skipped') or dict()
+        self.language_statistics = values.get('languages')
+        self.readme = values.get('readme')
+        self.metrics = values.get('metrics')
+        self.contributors = values.get('contributors')
+        cloc = values.get('cloc')
+        if cloc:
+            self.meter.add('cloc_seconds', cloc['seconds'])
+            self.meter.add('cloc_cpu', cloc['cpu'])
+        if self.paths and 'diff_skipped' in values:
+            self.skipped['diff'] = {'files': values['diff_skipped']}
 
-        self.process_results()
+        # Aggregate results
+        self.result = Result(self.name, self.url)
+        if self.language_statistics is not None:
+            self.result.set_statistics(self.language_statistics)
+        self.result.set_fulltext(readme=self.readme)
+        return self
+
+    def discard(self):
+        """
+        Drops the checkpoint on exit though the job did not complete, for jobs
+        that will not be retried.
+        """
+        self.completed = True
+
+    def stage(self, name):
+        """
+        Reports the stage the job is in, see `WorkerStatus`.
+        """
+        if self.status:
+            self.status.stage(name)
+
+    def resources(self):
+        """
+        What the job cost so far, see `Meter`.
+        :return: dict
+        """
+        usage = self.meter.usage()
+        usage['workspace_bytes'] = disk_usage(self.location)
+        if self.__cloned_objects is not None:
+            usage['fetched_bytes'] = disk_usage(self.__objects()) - \
+                self.__cloned_objects
+        return usage
+
+    def duration(self):
+        return time.strftime('%H:%M:%S', time.gmtime(time.time() -
+                                                     self.__start_time))
+
+    def serialize(self):
+        """
+        Everything the analysis produced, as one document.
+        :return: dict
+        """
+        return {
+            'id': str(self.id),
+            'url': self.url,
+            'head': self.repo.head.target.hex,
+            'index_duration': self.duration(),
+            'resources': self.resources(),
+            'skipped': self.skipped,
+            'search': self.result.serialize(),
+            'metrics': [m.serialize() for m in self.metrics or []],
+            'contributors': [c.serialize() for c in self.contributors or []]
+        }
 
     def process_results(self):
         """
-        Store the results in the repo model, then add job to queue for later
-        indexing.
+        Store the results in the analysis and metric stores, the search index
+        and the repo model. Each payload is hashed and compared with the hash
+        of the last write, see `digest`; unchanged payloads are not written,
+        changed search documents are updated field by field.
         :return: None
         """
-        index_duration = time.strftime('%H:%M:%S', time.gmtime(time.time() -
-                                                            self.__start_time))
+        self.stage('store')
+        index_duration = self.duration()
+        resources = self.resources()
+        repo_model = self.db_conn.repositories.find_one(
+            {'_id': ObjectId(self.id)}, {'hashes': 1}) or {}
+        previous = repo_model.get('hashes') or {}
+        if self.metrics is not None:
+            hashes = self.store_metrics(previous)
+        else:
+            # Not sampled this run, what is stored stays
+            hashes = dict((k, v) for k, v in previous.items()
+                          if k in ('series', 'contributors'))
+
+        # Index the search document
+        self.stage('search')
+        hashes['search'] = self.store_search(previous.get('search'))
+
         self.db_conn.repositories.update(
             {
                 '_id': ObjectId(self.id)
             },
             {
                 '$set': {
-                    'state': 2,
+                    'state': constants.REPOSITORY_INDEXED,
                     'indexed_on': datetime.today(),
-                    'index_duration': index_duration
+                    'error_count': 0,
+                    'index_duration': index_duration,
+                    'head': self.repo.head.target.hex,
+                    'node': node_name(),
+                    'skipped': self.skipped,
+                    'resources': resources,
+                    'hashes': hashes
                 }
             },
             upsert=False,
             multi=True
         )
+        if cfg.settings.resources.enabled:
+            ResourceStore(self.db_conn).record(self.id, self.url, node_name(),
+                                               resources)
 
-        # Aggregate results
-        self.result = Result(self.name, self.url)
-        self.result.set_statistics(self.language_statistics)
-        self.result.set_fulltext(readme=self.readme)
-
-        # Store Metrics
-        es = Elasticsearch()
-        es.index(index='repositories', doc_type='json',
-                 body=self.result.serialize(), id=str(self.id))
-
+        self.completed = True
         logger.info('\033[1;32mCompleted\033[0m {} in {}'
                     .format(self.url, index_duration))
 
-    #---------------------------------------------------------------------------
-    #   DO_ METHODS
-    #   Routines below do various indexing operations.
-    #---------------------------------------------------------------------------
-
-    def extract_metrics(self):
-        """
-        Runs the MetricSampler to get all metrics such as additions, deletions
-        number of commits for each week in time of the repository.
-        :return:
-        """
-        sampler = MetricSampler(self.repo)
-        sampler.sample_sectors()
-
-        metrics = sampler.get_metrics()
-        self.db_conn.metrics.remove({"repository.$id": ObjectId(str(self.id))})
-        bulk_sample = []
-        for sample in metrics:
-            sample = sample.serialize()
-            sample["commit"] = str(sample["commit"])
-            sample["repository"] = DBRef("repositories", ObjectId(str(self.id)))
-            bulk_sample.append(sample)
-        self.db_conn.metrics.insert(bulk_sample)
-
-        # Remove all old records
-        self.db_conn.contributions.remove({"repository.$id":
-                                              ObjectId(str(self.id))})
-
-        # Use a bulk insertion to minimise network ops.
-        bulk = []
-        contributors = sampler.sample_contributors()
-        for contributor in contributors:
-            bulk.append(dict(
-                email=contributor.get_email(),
-                contributions=contributor.get_count(),
-                repository=DBRef(collection="repositories",
-                                 id=ObjectId(str(self.id)))
-            ))
-        self.db_conn.contributions.insert(bulk)
-
-    def extract_language_statistics(self):
-        """
-        Method calls a subprocess 'cloc' to do some stats on the directory. The
-        result of this is saved to `CLOC_OUTPUT_FILE` in the repository
-        location. The results are in yaml format, which will be later read.
-        `cloc` understand language specific syntax for a vast number of
-        languages; it knows what language a file is written, and to a further
-        extent, what a comment looks like in this language. From this
-        information, we can determine its main language, eg, ruby framework, js,
-        etc.
-
-        Throws StatisticsUnavailable, if repo contains no code
-        """
-        try:
-            dn = open(devnull, 'w')
-            call(['cloc', self.location, '--yaml', '--report-file={}'.format(
-                path.join(self.location, CLOC_OUTPUT_FILE))], stdout=dn,
-                 stderr=dn)
-            dn.close()
-        except OSError:
-            raise IndexerDependencyFailure('`cloc` application was not found '
-                                           'on this machine.')
-
-        if not path.isfile(path.join(self.location, CLOC_OUTPUT_FILE)):
-            logger.info('\033[1;31mEmpty\033[0m {}, skipping ..'
-                        .format(self.url))
-            raise StatisticsUnavailable('Empty repository')
-        else:
-            self.language_statistics = Languages(
-                path.join(self.location, CLOC_OUTPUT_FILE), self.name)
-
-    def extract_readme(self):
+    def store_search(self, previous=None):
         """
-        Searchable text currently includes README files. They contain the
-        rundown of the codebase; we're primarily interested in its purpose. A
-        user search for "ruby web framework", could match a line in the rails
-        readme:
-            'Ruby on Rails is a "web framework" written in "ruby"'
-        Similarly, works for the absolute case too: "rails web framework".
+        Writes the search document and its analysis. The time of the run is
+        not part of the content: `processed` is only updated along with a
+        change. Rebuilds write into an empty index, so always write whole.
+        :param previous: dict of field to hash, from the last write
+        :return: dict of field to hash
         """
-        try:
-            # prefer README.md
-            r = re.compile(r'^README.md', re.IGNORECASE)
-            try:
-                readme_location = match_in_dir(r, self.location)[0]
-
-            except Exception:
-                r = re.compile(r'^README', re.IGNORECASE)
-                readme_location = match_in_dir(r, self.location)[0]
-
-            f = open(readme_location, 'r')
-            self.readme = normalize_string(f.read())
-            f.close()
-
-        except Exception:
-            pass  # no readme
+        document = self.result.serialize()
+        hashes = dict((field, digest(value))
+                      for field, value in document.items()
+                      if field not in SEARCH_VOLATILE)
+        fields = changed(hashes, previous) \
+            if self.index_name == cfg.settings.search.alias else None
+        if fields == []:
+            return hashes
+
+        AnalysisStore(self.db_conn).write(self.id, self.result,
+                                          self.index_name)
+        es = Elasticsearch()
+        if fields is None:
+            es.index(index=self.index_name,
+                     doc_type=cfg.settings.search.doc_type,
+                     body=document, id=str(self.id))
+        else:
+            es.update(index=self.index_name,
+                      doc_type=cfg.settings.search.doc_type, id=str(self.id),
+                      body={'doc': dict((field, document[field]) for field in
+                                        fields + list(SEARCH_VOLATILE))})
+        return hashes
 
-    def extract_license(self):
+    def store_metrics(self, previous=None):
         """
-        License information may be something to display in the application
-        results. This would be useful for organisations who are conscientious of
-        the open source projects they use in their products or development.
+        Replaces the stored metric series and contributors of the repository.
+        Both are stored packed, see `MetricSeriesStore` and
+        `ContributorStore`, and only written where their content changed.
+        :param previous: dict of stored hashes, from the last write
+        :return: dict of hashes, `series` and `contributors`
         """
-        #TODO: Get license information
-        pass
-
+        previous = previous or {}
+        repository = DBRef("repositories", ObjectId(str(self.id)))
+        hashes = {
+            'series': MetricSeriesStore(
+                self.db_conn, cfg.settings.metrics.bucket).write(
+                repository.id, self.metrics, previous.get('series')),
+            'contributors': ContributorStore(self.db_conn).write(
+                repository.id, self.contributors or [],
+                previous.get('contributors'))
+        }
+
+        if not previous:
+            # Drop any per-week and per-contributor documents left from the
+            # unpacked formats
+            self.db_conn.metrics.remove({"repository.$id": repository.id})
+            self.db_conn.contributions.remove(
+                {"repository.$id": repository.id})
+        return hashes
@@ -1,19 +1,26 @@
 """
 Logging singleton. Ensures logging is consistent across the entire application. Logger configuration is found in
 the `conf/` directory. This logger subclasses the python `logging` module.
+
+In queue mode (`setup_queue_logging`) processes only enqueue records; a single listener process owns the configured
+handlers, so the worker pool never shares a log file or blocks on output.
 """
 
 __author__ = 'Jon Scanes <me@jscanes.com>'
 
 import logging
 import logging.config
+import multiprocessing
 import pkg_resources
 import yaml
+from dex.logger.handlers import QueueHandler, listen
 
 
 class Logger:
     def __init__(self):
-        pass
+        self.queue = None
+        self.dropped = None
+        self.listener = None
 
     def get_logger(self, name):
         return logging.getLogger(name)
@@ -23,5 +30,33 @@ class Logger:
         config = yaml.load(stream)
         logging.config.dictConfig(config)
 
+    def setup_queue_logging(self, size):
+        """
+        Starts the listener process and routes this process, and any process
+        forked from it, through a bounded queue to the listener.
+        :param size: int maximum number of records buffered
+        :return: None
+        """
+        self.queue = multiprocessing.Queue(size)
+        self.dropped = multiprocessing.Value('L', 0)
+        self.listener = multiprocessing.Process(target=listen, args=(self.queue, self.dropped, self.setup_logging))
+        self.listener.daemon = True
+        self.listener.start()
+
+        handler = QueueHandler(self.queue, self.dropped)
+        loggers = [logging.getLogger()] + [l for l in logging.Logger.manager.loggerDict.values()
+                                           if isinstance(l, logging.Logger) and l.handlers]
+        for l in loggers:
+            l.handlers = [handler]
+
+    def stop_queue_logging(self, timeout=5):
+        """
+        Flushes the queue and stops the listener.
+        """
+        if self.listener:
+            self.queue.put(None, timeout=timeout)
+            self.listener.join(timeout)
+            self.listener = None
+
 # Initialize logger config
 logger = Logger()
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Handlers for centralized logging. Processes log through a `QueueHandler` onto a
+bounded queue; a single listener process, see `listen`, owns the configured
+handlers and does all formatting, rotation and output.
+"""
+
+import logging
+import signal
+from Queue import Empty, Full
+
+
+DROP_REPORT_INTERVAL = 5
+"""Seconds between reports of dropped records.
+"""
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts records on a multiprocessing queue without blocking. When the queue is
+    full the record is dropped and counted, so logging never throttles the
+    caller.
+    """
+
+    def __init__(self, queue, dropped):
+        """
+        :param queue: multiprocessing.Queue, bounded
+        :param dropped: multiprocessing.Value counting dropped records
+        """
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = dropped
+
+    def prepare(self, record):
+        """
+        Merges args and exception text into the message so the record can be
+        pickled and formatted by the listener.
+        """
+        message = self.format(record)
+        record.message = message
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Full:
+            with self.dropped.get_lock():
+                self.dropped.value += 1
+        except Exception:
+            self.handleError(record)
+
+
+def listen(queue, dropped, configure):
+    """
+    Listener process target. Handles records from the queue with the handlers
+    set up by `configure` until a None record is received.
+    :param queue: multiprocessing.Queue
+    :param dropped: multiprocessing.Value counting dropped records
+    :param configure: callable configuring logging in this process
+    :return: None
+    """
+    # Interrupts are handled by the main process, which stops the listener.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure()
+    logger = logging.getLogger('dex')
+    reported = 0
+
+    while True:
+        try:
+            record = queue.get(timeout=DROP_REPORT_INTERVAL)
+        except Empty:
+            record = False
+
+        if record is None:
+            break
+        if record:
+            logging.getLogger(record.name).handle(record)
+
+        if dropped.value != reported:
+            logger.warning('{} log records dropped, queue full'.format(
+                dropped.value - reported))
+            reported = dropped.value
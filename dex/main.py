@@ -7,91 +7,221 @@ fixed number of worker process where each worker feeds repository urls fetched
 from the queue. These are passed to the indexing object.
 
 The worker is defined by worker.py which is the root execution of the process.
+
+Commands:
+    dex [run]       index repositories from the queue
+    dex rebuild     rebuild the search index into a new index and swap its alias
+    dex reproject   regenerate search documents from stored analyses
+    dex nodes       report indexing nodes, their locality and rebalances
+    dex status      show the worker status board of the running node
+    dex report      rank the most expensive repositories and daily usage
+    dex batch       index a list of urls or local paths without the queue
+    dex feed        fill the indexing queue with due repositories
 """
 
-import pika
+import argparse
+import batch
+import feeder
+import json
 import sys
+import router
 import worker
+from Queue import Empty
 from shutil import rmtree
-from time import sleep
+from threading import Thread
+from time import sleep, time
 from algthm.utils.file import dir_empty
 from cfg.loader import cfg
-from multiprocessing import Process
+from multiprocessing import Process, Queue, Value
+from signal import signal, SIGHUP
 from logger import logger
+from dex.core import checkpoint, constants, mq, resources, search
+from dex.core.analysis_store import AnalysisStore
+from dex.core.cluster import NodeRegistry, consume_queue, node_name
 from dex.core.db import MongoConnection
-from dex.core.exceptions.indexer import IndexerBootFailure
+from dex.core.hashring import HashRing
+from dex.core.metric_sampler import pool_size
+from dex.core.gate import CloneGate
+from dex.core.status import StatusBoard, read_snapshot, render, \
+    write_snapshot
+from dex.core.exceptions.indexer import IndexerBootFailure, RebuildFailure
 from logging import CRITICAL, getLogger
 from datetime import datetime
-from elasticsearch import Elasticsearch, ElasticsearchException
+from elasticsearch import Elasticsearch
 
 
 logger.setup_logging()
+log_setup = logger
 logger = logger.get_logger('dex')
 pika_logger = getLogger('pika')
 pika_logger.setLevel(CRITICAL)
 
 
-def initialize_workers(num_workers, target, daemon=True):
+def initialize_workers(worker_ids, target, args, daemon=True):
     """
-    Initializes the worker processes.
+    Initializes the worker processes. Workers are started at once and report
+    on their `ready` queue once they are consuming, see `wait_for_workers`.
+    :param worker_ids: list of int worker ids to start
+    :param target: callable run by each worker, called with (id,) + args
+    :param args: tuple of shared arguments
+    :return: dict of worker id to Process
     """
-    workers = []
+    workers = dict()
     process = None
 
-    print '> initializing {} workers ..'.format(num_workers),
+    print '> initializing {} workers ..'.format(len(worker_ids)),
 
-    for i in range(num_workers):
+    for i in worker_ids:
         try:
-            process = Process(target=target, args=(i + 1,))
+            process = Process(target=target, args=(i,) + args)
             process.daemon = daemon
             process.start()
-            workers.append(process)
-
-            sys.stdout.write('\r')
-            sys.stdout.write('> %s workers initialized' % (i + 1))
-            sys.stdout.flush()
-            sleep(cfg.settings.general.worker_cooling)
+            workers[i] = process
 
         except RuntimeError:
             pass
 
-    print ' .. ok'
+    print 'started'
     return workers
 
 
-def test_db_connection(db_conn):
+def scale_workers(workers, target, args, daemon=True, size=None):
     """
-    Tests that the db connection is alive and well.
+    Brings the pool to the configured size. Workers above the configured count
+    retire themselves between jobs; exited workers are reaped here and missing
+    ones started.
+    :param size: int number of workers, defaults to `general.workers`
+    :return: dict of worker id to Process
     """
-    # TODO: implement mongo connection test
-    return True
+    workers = dict((i, p) for i, p in workers.items() if p.is_alive())
+    missing = [i for i in range(1, (size or cfg.settings.general.workers) + 1)
+               if i not in workers]
+    if missing:
+        workers.update(initialize_workers(missing, target, args, daemon))
+    return workers
 
 
-def test_mq_connection(mq_conn):
+def wait_for_workers(ready, num_workers, timeout):
     """
-    Tests that the mq connection is alive and well.
+    Collects readiness reports from the workers until all have reported or
+    the timeout expires.
+    :return: int number of workers ready
     """
-    # TODO: implement mq conn test
-    return True
+    num_ready = 0
+    deadline = time() + timeout
+    for reported in range(num_workers):
+        try:
+            worker_id, error = ready.get(timeout=max(0, deadline - time()))
+        except Empty:
+            break
 
+        if error:
+            logger.error('worker#{} failed to start: {}'.format(worker_id,
+                                                              error))
+        else:
+            num_ready += 1
 
-def test_es_connection(es_conn):
-    return es_conn.ping()
+        sys.stdout.write('\r')
+        sys.stdout.write('> %s/%s workers ready' % (num_ready, num_workers))
+        sys.stdout.flush()
+
+    print
+    return num_ready
 
 
-def cool_off(duration=3, char='*'):
+def probe(name, connect, test):
     """
-    Throws up a progress bar for the given duration.
+    Connects to a backend and runs its readiness test, retrying with
+    exponential backoff.
+    :param name: string backend name, used in reporting
+    :param connect: callable returning a connection
+    :param test: callable taking the connection, returning True when ready
+    :return: connection
     """
-    interval = duration / 100.0
-    for i in range(101):
-        sys.stdout.write('\r')
-        sys.stdout.write('\033[1;34m%-82s %d\033[0m' %
-                         (char * (int(i * 0.82)), i))
-        sys.stdout.flush()
-        sleep(interval)
+    settings = cfg.settings.boot
+    delay = settings.backoff
+    error = 'readiness test failed'
+    for attempt in range(settings.retries + 1):
+        try:
+            conn = connect()
+            if test(conn):
+                return conn
+        except Exception as e:
+            error = e
 
-    print
+        if attempt < settings.retries:
+            sleep(delay)
+            delay *= 2
+
+    raise IndexerBootFailure('{} not ready after {} attempts: {}'.format(
+        name, settings.retries + 1, error))
+
+
+def connect_backends():
+    """
+    Connects to Mongo, MQ and ES in parallel and waits for each to pass its
+    readiness test.
+    :return: dict of connections, keyed by backend name
+    """
+    timeout = cfg.settings.boot.timeout
+    backends = [
+        ('Mongo', lambda: MongoConnection().get_db(), test_db_connection),
+        ('MQ', lambda: mq.connect(timeout), test_mq_connection),
+        ('ElasticSearch', lambda: Elasticsearch(timeout=timeout),
+         test_es_connection),
+    ]
+    connections = dict()
+    errors = []
+
+    def run(name, connect, test):
+        start = time()
+        try:
+            connections[name] = probe(name, connect, test)
+            print '> {} ready in {:.2f}s'.format(name, time() - start)
+        except IndexerBootFailure as e:
+            errors.append(e)
+
+    threads = [Thread(target=run, args=backend) for backend in backends]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return connections
+
+
+def reload_workers(generation):
+    """
+    SIGHUP handler. Bumps the shared generation; the main process and every
+    worker reload the configuration at their next refresh.
+    """
+    generation.value += 1
+
+
+def test_db_connection(db_conn):
+    """
+    Tests that the db connection is alive and well, and that the repositories
+    collection exists.
+    """
+    db_conn.command('ping')
+    return 'repositories' in db_conn.collection_names()
+
+
+def test_mq_connection(mq_conn):
+    """
+    Tests that the mq connection is alive and well, and that the indexing
+    queue can be declared.
+    """
+    channel = mq_conn.channel()
+    channel.queue_declare(queue=cfg.settings.mq.queue_name, durable=True)
+    channel.close()
+    return mq_conn.is_open
+
+
+def test_es_connection(es_conn):
+    return es_conn.ping()
 
 
 def finish_session(db_conn, session_id):
@@ -129,93 +259,464 @@ def welcome(working_directory):
                 .replace('[working_directory]', working_directory))
 
 
-def main():
-    working_directory = cfg.settings.general.directory
-    welcome(working_directory)
+class WorkerPool(object):
+    """
+    The node's worker processes and the state they share: a generation bumped
+    on SIGHUP to make everyone reload, the node's clone concurrency gate and
+    the status board the workers report to. In cluster mode the pool also
+    supervises the node's router.
+    """
 
-    while 1:
-        try:
-            print '> preparing workspace ..',
-            if prepare_workspace(cfg.settings.general.directory):
-                print 'ok'
-
-            print '> connecting to Mongo ..',
-            db_conn = MongoConnection().get_db()
-            if db_conn:
-                print 'done'
-            else:
-                raise IndexerBootFailure('Could not connect to DB.')
-
-            print '> connecting to MQ @ {} ..'\
-                .format(cfg.settings.mq.connection.host),
-            try:
-                mq_conn = pika.BlockingConnection(pika.ConnectionParameters(
-                    host=cfg.settings.mq.connection.host
-                ))
-                if mq_conn:
-                    print 'done'
-            except pika.exceptions.AMQPConnectionError:
-                raise IndexerBootFailure('Could not connect to MQ.')
-
-            print '> connecting to ElasticSearch @ localhost ..',
+    def __init__(self, target):
+        self.target = target
+        self.generation = Value('i', 0)
+        self.clone_gate = CloneGate()
+        # Every worker needs a slot for `drain` to see its job, including
+        # those a live change of `general.workers` adds.
+        self.board = StatusBoard(max(cfg.settings.status.slots,
+                                     cfg.settings.general.max_workers,
+                                     cfg.settings.general.workers))
+        self.refused = None  # worker count beyond the board, last warned of
+        # Workers that score on a process pool or run extractors on processes
+        # may not be daemonic.
+        self.daemon = not ((cfg.settings.metrics.parallel.enabled and
+                            pool_size() > 1) or
+                           cfg.settings.extractors.processes)
+        self.workers = dict()
+        self.router = None
+        cfg.follow(self.generation)
+        signal(SIGHUP, lambda signum, frame: reload_workers(self.generation))
+
+    def args(self, ready=None):
+        return ready, self.generation, self.clone_gate, self.board
+
+    def start(self):
+        """
+        Starts the configured number of workers and waits for them to report.
+        :return: int number of workers ready
+        """
+        ready = Queue()
+        self.workers = initialize_workers(range(1, self.size() + 1),
+                                          self.target, self.args(ready),
+                                          self.daemon)
+        return wait_for_workers(ready, len(self.workers),
+                                cfg.settings.boot.workers_timeout)
+
+    def size(self):
+        """
+        The configured number of workers, capped at the slots of the board: a
+        worker without one would hold jobs `drain` cannot see.
+        :return: int
+        """
+        workers = cfg.settings.general.workers
+        slots = len(self.board.slots)
+        if workers <= slots:
+            return workers
+        if workers != self.refused:
+            logger.warning('general.workers {} exceeds the {} status slots; '
+                           'running {}, restart to scale further'.format(
+                               workers, slots, slots))
+            self.refused = workers
+        return slots
+
+    def scale(self):
+        self.workers = scale_workers(self.workers, self.target, self.args(),
+                                     self.daemon, self.size())
+        if cfg.settings.cluster.enabled:
+            self.supervise_router()
+
+    def supervise_router(self):
+        """
+        Starts the node's router, restarting it if it exited.
+        """
+        if self.router is not None:
+            if self.router.is_alive():
+                return
+            logger.error('router exited with {}, restarting'.format(
+                self.router.exitcode))
+        self.router = Process(target=router.target)
+        self.router.daemon = True
+        self.router.start()
+
+    def terminate(self):
+        for p in self.workers.values():
             try:
-                es_conn = Elasticsearch()
-                if es_conn:
-                    print 'done'
-            except ElasticsearchException as e:
-                raise IndexerBootFailure('Could not connect to ES {}'.format(e))
-
-            print 'letting connections establish before testing.'
-            cool_off(cfg.settings.general.cooling)
-
-            print '> testing DB connection and schema ..',
-            if test_db_connection(db_conn):
-                print 'ok'
-            else:
-                raise IndexerBootFailure('Algthm schema not defined in DB.')
-
-            print '> testing MQ connection ..',
-            if test_mq_connection(mq_conn):
-                print 'ok'
-            else:
-                raise IndexerBootFailure('MQ connection failed.')
-
-            workers = initialize_workers(cfg.settings.general.workers,
-                                         worker.target)
-            print 'letting workers establish.'
-            cool_off(cfg.settings.general.cooling)
-
-            #-------------------------------------------------------------------
-            #   All Checks Complete - Run
-            #-------------------------------------------------------------------
-            print '> running ...'
-            while True:
-                print '.',
-                sleep(5)
-
-            # Presence of contents in the working directory denotes there are a
-            # number of workers still processes jobs. Wait for directory to be
-            # empty before continuing.
-            print '> finalising ..',
-            while not dir_empty(working_directory):
-                print '.',
-                sleep(5)
-
-            cool_off(1)
-
-            for p in enumerate(workers):
-                try:
-                    p[-1].terminate()
-                except RuntimeError:
-                    pass
-            break
+                p.terminate()
+            except RuntimeError:
+                pass
 
-        except IndexerBootFailure as e:
-            print e
-            print "exiting .."
-            break
 
-if __name__ == "__main__":
-    main()
+def boot():
+    """
+    Prepares the workspace, waits for the backends to be ready and starts the
+    worker pool.
+    :return: WorkerPool
+    """
+    welcome(cfg.settings.general.directory)
 
+    print '> preparing workspace ..',
+    if prepare_workspace(cfg.settings.general.directory):
+        print 'ok'
+    checkpoint.clean()
 
+    boot_start = time()
+    print '> connecting to Mongo, MQ @ {} and ElasticSearch ..'\
+        .format(cfg.settings.mq.connection.host)
+    connect_backends()
+
+    pool = WorkerPool(worker.target)
+    if cfg.settings.cluster.enabled:
+        print '> joining cluster as {} ..'.format(node_name()),
+        pool.supervise_router()
+        print 'ok'
+
+    if not pool.start():
+        raise IndexerBootFailure('No workers became ready.')
+    print '> ready in {:.2f}s'.format(time() - boot_start)
+    return pool
+
+
+def in_flight(pool, channel):
+    """
+    Whether there is work left for the pool: messages on its queues or
+    waiting to be retried, workers on a job as reported on the status board,
+    checkpoints held by a live worker (clones are moved into the checkpoint),
+    or clones left in the working directory.
+    """
+    return bool(mq.queue_depth(channel) or
+                mq.queue_depth(channel, consume_queue()) or
+                mq.retry_depth(channel, consume_queue()) or
+                pool.board.busy() or
+                checkpoint.held() or
+                not dir_empty(cfg.settings.general.directory))
+
+
+def drain(pool):
+    """
+    Waits until the indexing queue is empty and no worker holds a job, then
+    stops the pool. A message prefetched by a worker is neither ready on the
+    queue nor a job yet, so the pool must be idle on two consecutive polls.
+    """
+    mq_conn = mq.connect()
+    channel = mq_conn.channel()
+    print '> finalising ..',
+    idle = 0
+    while idle < 2:
+        idle = 0 if in_flight(pool, channel) else idle + 1
+        if idle < 2:
+            print '.',
+            sleep(5)
+            cfg.refresh()
+            pool.scale()
+    mq_conn.close()
+    print 'done'
+    pool.terminate()
+
+
+def monitor(pool):
+    """
+    Snapshots the status board with the queue depths, writes the snapshot for
+    `dex status` and, on a terminal, redraws the board.
+    """
+    depth = dict()
+    try:
+        mq_conn = mq.connect(cfg.settings.boot.timeout)
+        channel = mq_conn.channel()
+        for queue in set([cfg.settings.mq.queue_name, consume_queue()]):
+            depth[queue] = mq.queue_depth(channel, queue)
+        mq_conn.close()
+    except Exception as e:
+        logger.warning('queue depth unavailable: {}'.format(e))
+
+    snapshot = pool.board.snapshot(depth)
+    try:
+        write_snapshot(snapshot, cfg.settings.status.snapshot)
+    except IOError as e:
+        logger.warning('status snapshot not written: {}'.format(e))
+
+    if cfg.settings.status.board and sys.stdout.isatty():
+        sys.stdout.write('\033[H\033[2J')
+        print render(snapshot, cfg.settings.status.longest)
+    else:
+        print '.',
+
+
+def run(args):
+    """
+    Indexes repositories from the queue until interrupted.
+    """
+    pool = boot()
+
+    #---------------------------------------------------------------------------
+    #   All Checks Complete - Run
+    #---------------------------------------------------------------------------
+    print '> running ...'
+    while True:
+        sleep(cfg.settings.status.interval)
+        cfg.refresh()
+        pool.scale()
+        checkpoint.clean()
+        monitor(pool)
+
+
+def replay(es, db, index, query):
+    """
+    Writes the search documents of stored analyses into an index.
+    :return: int number of documents written
+    """
+    return search.bulk_load(es, index, AnalysisStore(db).results(query))
+
+
+def rebuild(args):
+    """
+    Rebuilds the search index: every repository is re-queued into a new
+    versioned index with bulk friendly settings, and once the queue drains the
+    alias is swapped over to it. Search keeps being served by the old index
+    until then.
+
+    Jobs running meanwhile write through the alias into the old index; their
+    documents are replayed from the stored analyses into the new index before
+    the swap, and once more after it for those written in between.
+    Repositories whose rebuild job failed keep their last analysed document.
+    The alias is only swapped if the new index holds a document for every
+    rebuilt repository with an analysis, unless --force is given.
+    """
+    es = Elasticsearch()
+    alias = cfg.settings.search.alias
+    search.check_alias(es, alias)
+    pool = boot()
+    db = MongoConnection().get_db()
+    index = search.create_rebuild_index(es)
+    print '> rebuilding into {} ..'.format(index),
+
+    started = datetime.utcnow()
+    mq_conn = mq.connect()
+    channel = mq_conn.channel()
+    queued = set()
+    for repository in db.repositories.find({}, {'url': 1}):
+        mq.publish(channel, {'id': str(repository['_id']),
+                             'url': repository['url'],
+                             'index': index})
+        queued.add(repository['_id'])
+    mq_conn.close()
+    print '{} repositories queued'.format(len(queued))
+
+    drain(pool)
+
+    print '> replaying writes to {} ..'.format(alias),
+    replayed = datetime.utcnow()
+    failed = [r['_id'] for r in db.repositories.find(
+        {'state': constants.REPOSITORY_FAILED}, {'_id': 1})
+        if r['_id'] in queued]
+    written = replay(es, db, index, {'$or': [
+        {'written': {'$gte': started}, 'index': {'$ne': index}},
+        {'_id': {'$in': failed}}]})
+    print '{} documents'.format(written)
+
+    expected = sum(1 for a in db.analyses.find({}, {'_id': 1})
+                   if a['_id'] in queued)
+    print '> merging {} and swapping alias {} ..'.format(index, alias),
+    previous = search.finish_rebuild(es, index, expected, args.force)
+    print 'done, previously {}'.format(', '.join(previous) or 'none')
+
+    written = replay(es, db, alias, {'written': {'$gte': replayed},
+                                     'index': {'$ne': index}})
+    print '> replayed {} documents written during the swap'.format(written)
+
+
+def reproject(args):
+    """
+    Regenerates search documents from the stored analyses, without cloning.
+    With --rebuild the documents are loaded into a new index and the alias
+    swapped over to it, as in `rebuild`.
+    """
+    print '> connecting to Mongo and ElasticSearch ..'
+    db_conn = probe('Mongo', lambda: MongoConnection().get_db(),
+                    test_db_connection)
+    es = probe('ElasticSearch',
+               lambda: Elasticsearch(timeout=cfg.settings.boot.timeout),
+               test_es_connection)
+
+    if args.rebuild:
+        search.check_alias(es, cfg.settings.search.alias)
+    index = search.create_rebuild_index(es) if args.rebuild else \
+        cfg.settings.search.alias
+    print '> reprojecting into {} ..'.format(index),
+    start = time()
+    written = search.bulk_load(es, index, AnalysisStore(db_conn).results())
+    print '{} documents in {:.2f}s'.format(written, time() - start)
+
+    if args.rebuild:
+        print '> merging {} and swapping alias {} ..'.format(
+            index, cfg.settings.search.alias),
+        previous = search.finish_rebuild(es, index)
+        print 'done, previously {}'.format(', '.join(previous) or 'none')
+
+
+def nodes(args):
+    """
+    Reports the indexing nodes: ring share, locality and rebalances.
+    """
+    registry = NodeRegistry(MongoConnection().get_db())
+    live = registry.live()
+    shares = HashRing(live, cfg.settings.cluster.replicas).arcs()
+    print '{:<24} {:>5} {:>7} {:>8} {:>9} {:>10} {:>7}'.format(
+        'node', 'live', 'share', 'jobs', 'locality', 'rebalances', 'moved')
+    for node in registry.collection.find().sort('_id'):
+        jobs = node.get('jobs', 0)
+        print '{:<24} {:>5} {:>6.1%} {:>8} {:>8.1%} {:>10} {:>6.1%}'.format(
+            node['_id'], 'yes' if node['_id'] in live else 'no',
+            shares.get(node['_id'], 0), jobs,
+            node.get('local', 0) / float(jobs) if jobs else 0,
+            node.get('rebalances', 0), node.get('moved', 0))
+
+
+def status(args):
+    """
+    Shows the status board of the node running on this host, from its last
+    snapshot.
+    """
+    location = cfg.settings.status.snapshot
+    try:
+        snapshot = read_snapshot(location)
+    except (IOError, ValueError):
+        print 'no status snapshot at {}, is dex running?'.format(location)
+        return
+
+    if args.json:
+        print json.dumps(snapshot, indent=2)
+        return
+
+    print render(snapshot, cfg.settings.status.longest)
+    age = time() - snapshot['time']
+    if age > 3 * cfg.settings.status.interval:
+        print
+        print 'snapshot is {:.0f}s old, dex may not be running'.format(age)
+
+
+def report(args):
+    """
+    Ranks repositories by their mean cost per job and shows the daily trend
+    of the mean and the bytes each clone strategy transferred, over the jobs
+    of the last days, see `resources`.
+    """
+    store = resources.ResourceStore(MongoConnection().get_db())
+    jobs = list(store.jobs(args.days))
+    if not jobs:
+        print 'no jobs recorded in the last {} days'.format(args.days)
+        return
+
+    headings = [heading for _, (heading, _, _) in resources.COSTS]
+    names = [name for name, _ in resources.COSTS]
+
+    print 'most expensive repositories by {}, mean per job:'.format(
+        dict(resources.COSTS)[args.by][0])
+    print '{:<48} {:>5} '.format('repository', 'jobs') + \
+        ' '.join('{:>9}'.format(h) for h in headings)
+    for entry in resources.rank(jobs, args.by, args.top):
+        print '{:<48} {:>5} '.format(entry['url'][-48:], entry['jobs']) + \
+            ' '.join('{:>9.1f}'.format(entry['mean'][n]) for n in names)
+
+    print
+    print 'daily mean per job:'
+    print '{:<10} {:>6} '.format('day', 'jobs') + \
+        ' '.join('{:>9}'.format(h) for h in headings)
+    for day, count, means in resources.trend(jobs):
+        print '{:<10} {:>6} '.format(day.isoformat(), count) + \
+            ' '.join('{:>9.1f}'.format(means[n]) for n in names)
+
+    print
+    print 'clone strategies, mean per job:'
+    print '{:<10} {:>6} {:>9} {:>10}'.format('strategy', 'jobs', 'clone MB',
+                                            'fetched MB')
+    for strategy, count, cloned, fetched in resources.strategies(jobs):
+        print '{:<10} {:>6} {:>9.1f} {:>10.1f}'.format(strategy, count, cloned,
+                                                       fetched)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='dex')
+    # Commands running a pool of processes log through the queue listener
+    parser.set_defaults(queue_logging=False)
+    commands = parser.add_subparsers()
+
+    command = commands.add_parser('run', help='index repositories from the '
+                                              'queue (default)')
+    command.set_defaults(command=run, queue_logging=True)
+
+    command = commands.add_parser('rebuild', help='rebuild the search index '
+                                                  'and swap its alias')
+    command.add_argument('--force', action='store_true',
+                         help='swap the alias even if the new index holds '
+                              'fewer documents than expected')
+    command.set_defaults(command=rebuild, queue_logging=True)
+
+    command = commands.add_parser('reproject', help='regenerate search '
+                                  'documents from stored analyses')
+    command.add_argument('--rebuild', action='store_true',
+                         help='load into a new index and swap the alias')
+    command.set_defaults(command=reproject)
+
+    command = commands.add_parser('batch', help='index a list of urls or '
+                                  'local paths without the queue')
+    command.add_argument('input', help='file with one url or path per line, '
+                         'optionally preceded by the repository id')
+    command.add_argument('-o', '--output', default='-',
+                         help='NDJSON output file, - for stdout')
+    command.add_argument('--sinks', action='store_true',
+                         help='write to Mongo and ElasticSearch instead')
+    command.add_argument('-p', '--processes', type=int, default=0,
+                         help='pool size, defaults to general.workers')
+    command.add_argument('--state', help='completed lines, for resuming; '
+                         'defaults to INPUT.done')
+    command.set_defaults(command=batch.run, queue_logging=True)
+
+    command = commands.add_parser('feed', help='fill the indexing queue '
+                                  'with due repositories')
+    command.add_argument('--once', action='store_true',
+                         help='top the queue up once and exit')
+    command.set_defaults(command=feeder.run)
+
+    command = commands.add_parser('nodes', help='report indexing nodes')
+    command.set_defaults(command=nodes)
+
+    command = commands.add_parser('status', help='show the worker status '
+                                  'board')
+    command.add_argument('--json', action='store_true',
+                         help='print the raw snapshot')
+    command.set_defaults(command=status)
+
+    command = commands.add_parser('report', help='rank the most expensive '
+                                  'repositories and daily usage')
+    command.add_argument('--by', default='cpu',
+                         choices=[name for name, _ in resources.COSTS],
+                         help='cost repositories are ranked by')
+    command.add_argument('--days', type=int,
+                         default=cfg.settings.resources.days,
+                         help='jobs of the last days reported')
+    command.add_argument('--top', type=int, default=cfg.settings.resources.top,
+                         help='repositories ranked')
+    command.set_defaults(command=report)
+
+    argv = sys.argv[1:] if argv is None else argv
+    return parser.parse_args(argv or ['run'])
+
+
+def main():
+    args = parse_args()
+    if args.queue_logging and cfg.settings.logging.mode == 'queue':
+        log_setup.setup_queue_logging(cfg.settings.logging.queue_size)
+
+    try:
+        args.command(args)
+
+    except (IndexerBootFailure, RebuildFailure) as e:
+        print e
+        print "exiting .."
+
+    finally:
+        log_setup.stop_queue_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+router.py
+
+In cluster mode every node runs one router process next to its workers. The
+router keeps the node registered with a heartbeat, consumes the shared
+indexing queue and forwards each job to the queue of the node owning the
+repository on the consistent hash ring. All routers build the ring from the
+same registry, so a job is routed the same way whichever router takes it.
+
+Jobs left on the queue of a node that dropped out of the ring, including
+retries its delay queues dead-letter there later, are moved back onto the
+shared queue by the live routers on every heartbeat and routed again.
+"""
+
+import json
+from time import time
+from logger import logger
+from cfg.loader import cfg
+from core import mq
+from core.cluster import NodeRegistry, node_name, node_queue
+from core.db import MongoConnection
+from core.hashring import HashRing, moved
+
+logger = logger.get_logger('dex')
+
+
+def target():
+    """
+    boot function
+    """
+    Router(node_name()).run()
+
+
+class Router(object):
+
+    def __init__(self, node):
+        self.node = node
+        self.registry = NodeRegistry(MongoConnection().get_db())
+        self.ring = HashRing(replicas=cfg.settings.cluster.replicas)
+        self.declared = set()
+        self.last_beat = 0
+
+    def beat(self, channel, routed=0):
+        """
+        Sends the heartbeat and rebuilds the ring from the live nodes,
+        reporting how much of the key space moved if membership changed.
+        """
+        self.registry.heartbeat(self.node, routed=routed)
+        self.last_beat = time()
+
+        nodes = set(self.registry.live())
+        if nodes == self.ring.nodes:
+            return
+
+        ring = HashRing(nodes, cfg.settings.cluster.replicas)
+        if self.ring.nodes:
+            share = moved(self.ring, ring)
+            self.registry.heartbeat(self.node, rebalances=1)
+            self.registry.record(self.node, moved=share)
+            logger.info('ring changed: {} -> {} nodes, {:.1%} of jobs '
+                        'remapped'.format(len(self.ring.nodes), len(nodes),
+                                          share))
+        self.ring = ring
+
+        for node in nodes - self.declared:
+            channel.queue_declare(queue=node_queue(node), durable=True)
+            self.declared.add(node)
+
+    def reclaim(self, channel):
+        """
+        Moves jobs queued for nodes outside the ring back onto the shared
+        queue, at most `cluster.reclaim_batch` per node and heartbeat.
+        :return: int number moved
+        """
+        reclaimed = 0
+        for node in self.registry.dead():
+            queue = node_queue(node)
+            channel.queue_declare(queue=queue, durable=True)
+            for i in range(cfg.settings.cluster.reclaim_batch):
+                method, properties, body = channel.basic_get(queue)
+                if method is None:
+                    break
+                channel.basic_publish(exchange='',
+                                      routing_key=cfg.settings.mq.queue_name,
+                                      body=body, properties=properties)
+                channel.basic_ack(method.delivery_tag)
+                reclaimed += 1
+        if reclaimed:
+            logger.info('reclaimed {} jobs from nodes outside the ring'.format(
+                reclaimed))
+        return reclaimed
+
+    def run(self):
+        connection = mq.connect()
+        channel = connection.channel()
+        channel.queue_declare(queue=cfg.settings.mq.queue_name, durable=True)
+        channel.basic_qos(prefetch_count=cfg.settings.cluster.prefetch)
+
+        self.beat(channel)
+        self.reclaim(channel)
+        routed = 0
+        try:
+            for method, properties, body in channel.consume(
+                    cfg.settings.mq.queue_name, inactivity_timeout=1):
+                if time() - self.last_beat >= cfg.settings.cluster.heartbeat:
+                    self.beat(channel, routed)
+                    self.reclaim(channel)
+                    routed = 0
+
+                if method is None:
+                    continue  # inactivity, loop for the heartbeat
+
+                owner = self.ring.get_node(str(json.loads(body)['id']))
+                if owner is None:
+                    channel.basic_nack(method.delivery_tag, requeue=True)
+                    continue
+
+                channel.basic_publish(exchange='',
+                                      routing_key=node_queue(owner),
+                                      body=body, properties=properties)
+                channel.basic_ack(method.delivery_tag)
+                routed += 1
+        finally:
+            self.registry.leave(self.node)
@@ -9,11 +9,22 @@ If any clone fails it is passed to the error handler where the appropriate
 systems are informed. One possible error is a 404 from the request. If this
 occurs, the repository should be striked. After a number of strikes, it may be
 necessary to remove it from the rotation and black listed.
+
+Failed jobs are retried with exponential backoff through delay queues and
+dead-lettered after `mq.max_retries` attempts; so are documents
+ElasticSearch rejects. Backend outages (Mongo unreachable, ElasticSearch
+unreachable or failing with 5xx/429) and dependencies missing on this node
+(`cloc`) are not held against the job: the message is returned to the queue
+and a per-backend circuit breaker pauses consumption until the backend
+answers again.
 """
 from bson import ObjectId
-from elasticsearch import ElasticsearchException
-import traceback
-import pika
+from datetime import datetime, timedelta
+from elasticsearch import ConnectionError as ESConnectionError
+from elasticsearch import Elasticsearch, ElasticsearchException
+from pymongo.errors import ConnectionFailure
+from os import devnull
+from subprocess import call
 from pika import exceptions
 import json
 from logger import logger
@@ -21,93 +32,317 @@ from indexer import Indexer
 from cfg.loader import cfg
 from core.exceptions.indexer import *
 from urllib3.exceptions import ProtocolError
+from core import constants, mq
+from core.breaker import CircuitBreaker
+from core.checkpoint import Checkpoint
+from core.cluster import NodeRegistry, consume_queue, node_name
 from core.db import MongoConnection
-from datetime import datetime
 
 logger = logger.get_logger('dex')
-TIMEOUT = 4
 
 
-def target(_id):
+def backend_outage(err):
+    """
+    Whether an ElasticSearch error means the cluster is unavailable or
+    overloaded, rather than the job's request being at fault, e.g. a mapping
+    error.
+    :param err: ElasticsearchException or ProtocolError
+    :return: boolean
+    """
+    if isinstance(err, (ESConnectionError, ProtocolError)):
+        return True
+    status = getattr(err, 'status_code', None)
+    return isinstance(status, int) and (status >= 500 or status == 429)
+
+
+def cloc_available():
+    try:
+        with open(devnull, 'w') as dn:
+            return call(['cloc', '--version'], stdout=dn, stderr=dn) == 0
+    except OSError:
+        return False
+
+
+def target(_id, ready=None, generation=None, clone_gate=None, board=None):
     """
     boot function
     """
-    Worker(_id).run()
+    if generation is not None:
+        cfg.follow(generation)
+    Worker(_id, clone_gate, board).run(ready)
 
 
 class Worker(object):
 
-    def __init__(self, _id):
+    def __init__(self, _id, clone_gate=None, board=None):
         """
         Downloads repositories with urls retrieved from the Queue
         Arguments:
-            queue, Queue instance
-            repo_location, string location to store repository
+            _id, int worker ID
+            clone_gate, CloneGate shared by the workers of this node
+            board, StatusBoard the worker reports its job and stage to
         """
         self.id = _id
+        self.clone_gate = clone_gate
+        self.status = board.reporter(_id) if board else None
         self.db_conn = MongoConnection().get_db()
+        self.connection = None
+        self.consumer_tag = None
+        self.paused = False
 
-    # Method continues until terminated by indexer
-    def run(self):
-        connection = pika.BlockingConnection(pika.ConnectionParameters(
-            host=cfg.settings.mq.connection.host
-        ))
-        channel = connection.channel()
-        channel.queue_declare(queue=cfg.settings.mq.queue_name,
-                              durable=True)
-
-        def callback(ch, method, properties, body):
-            m = json.loads(body)
-            with Indexer(self.id, m['id'], m['url']) as indexer:
-                try:
-                    indexer.load().index()
-
-                except ExternalSystemException as err:
-                    # should be investigated.
-                    MongoConnection().get_db().system_errors.insert({
-                        'exception': 'ExternalSystemError',
-                        'message': str(err),
-                        'timestamp': datetime.today(),
-                        'task': 'indexing {}'.format(m['id'])
-                    })
-
-                except (RepositoryCloneFailure, StatisticsUnavailable,
-                        IndexerDependencyFailure) as err:
-                    # Repository specific failure
-                    self.db_conn.repositories.update(
-                        {
-                            '_id': ObjectId(m['id'])
-                        },
-                        {
-                            '$inc': {
-                                'error_count': 1
-                            },
-                            '$set': {
-                                'state': 0,
-                                'comment': str(err)
-                            }
-                        },
-                        multi=True
-                    )
-
-                except (ElasticsearchException, ProtocolError) as err:
-                    # External system failure
-                    raise ExternalSystemException('System error: {}'
-                                                  .format(err))
-
-                except OSError as err:
-                    logger.error(err)
-
-                except Exception as e:
-                    print 'Worker failed ', e
-                    traceback.print_exc()
+        settings = cfg.settings.breaker
+        self.breakers = {
+            'mongo': CircuitBreaker(
+                'Mongo', lambda: self.db_conn.command('ping'),
+                settings.threshold, settings.reset, settings.max_reset),
+            'es': CircuitBreaker(
+                'ElasticSearch', lambda: Elasticsearch().ping(),
+                settings.threshold, settings.reset, settings.max_reset),
+            # A missing dependency fails every job on this node, so stop at
+            # once.
+            'dependencies': CircuitBreaker(
+                'cloc', cloc_available, 1, settings.reset,
+                settings.max_reset),
+        }
 
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+    # Method continues until terminated by indexer
+    def run(self, ready=None):
+        """
+        Consumes the indexing queue. Once consuming, or on failing to connect,
+        the worker reports on the `ready` queue as (worker id, error).
+        :param ready: multiprocessing.Queue
+        """
+        try:
+            self.connection = mq.connect(cfg.settings.boot.timeout)
+            channel = self.connection.channel()
+            channel.queue_declare(queue=consume_queue(), durable=True)
+            mq.declare_retry_queues(channel, consume_queue())
+        except exceptions.AMQPError as err:
+            if ready:
+                ready.put((self.id, 'MQ connection failed: {}'.format(err)))
+            return
 
-        channel.basic_qos(prefetch_count=1)
-        channel.basic_consume(callback, queue=cfg.settings.mq.queue_name)
+        channel.basic_qos(prefetch_count=cfg.settings.mq.prefetch)
+        self.consumer_tag = channel.basic_consume(self.on_message,
+                                                  queue=consume_queue())
+        if ready:
+            ready.put((self.id, None))
+        self.schedule_refresh(channel)
         try:
             channel.start_consuming()
         except exceptions.ConnectionClosed:
             print 'worker#{} failed: MQ Connection Closed.'.format(self.id)
+        else:
+            self.connection.close()
+
+    def on_message(self, ch, method, properties, body):
+        m = json.loads(body)
+        if self.status:
+            self.status.job(m['id'], m['url'])
+        failed = True
+        try:
+            failed = not self.process(ch, m, properties, body)
+
+        except (ElasticsearchException, ProtocolError) as err:
+            if backend_outage(err):
+                # External system failure, the job is not at fault
+                self.outage(ch, method, self.breakers['es'], m, err)
+            else:
+                self.rejected(ch, method, properties, body, m, err)
+
+        except IndexerDependencyFailure as err:
+            # This node cannot index anything until the dependency is back
+            self.outage(ch, method, self.breakers['dependencies'], m, err)
+
+        except ConnectionFailure as err:
+            self.outage(ch, method, self.breakers['mongo'], m, err)
+
+        else:
+            for breaker in self.breakers.values():
+                breaker.success()
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        if self.status:
+            self.status.done(failed)
+
+        self.between_jobs(ch)
+
+    def process(self, ch, m, properties, body):
+        """
+        Indexes the repository of a message. Repository specific failures are
+        retried with backoff, then dead-lettered; backend failures propagate.
+        :return: boolean, whether the job succeeded
+        """
+        if cfg.settings.cluster.enabled:
+            self.record_locality(m['id'])
+
+        # Rebuild jobs name the index to load and are never skipped.
+        rebuild = m.get('index')
+        checkpoint = Checkpoint(m['id']) \
+            if cfg.settings.checkpoints.enabled else None
+        with Indexer(self.id, m['id'], m['url'], clone_gate=self.clone_gate,
+                     index=rebuild, status=self.status,
+                     checkpoint=checkpoint) as indexer:
+            try:
+                if cfg.settings.general.skip_unchanged and \
+                        not rebuild and indexer.unchanged():
+                    indexer.touch()
+                else:
+                    indexer.load().index()
+                return True
+
+            except StatisticsUnavailable as err:
+                # Nothing to index, another attempt will not change that
+                indexer.discard()
+                self.record_failure(m['id'], err)
+
+            except (RepositoryCloneFailure, GitTimeout) as err:
+                # Repository specific failure
+                self.retry(ch, indexer, m, properties, body, err)
+
+            except (ElasticsearchException, ProtocolError, ConnectionFailure,
+                    IndexerDependencyFailure):
+                raise
+
+            except Exception as err:
+                # A fault of the job, e.g. an extractor process crashed or the
+                # repository could not be read
+                logger.exception('worker#{} failed {}'.format(self.id,
+                                                               m['id']))
+                self.retry(ch, indexer, m, properties, body, err)
+
+        return False
+
+    def retry(self, ch, indexer, m, properties, body, err):
+        """
+        Schedules another attempt of a failed job, or dead-letters it, and
+        counts the failure against the repository.
+        """
+        attempt = mq.retry(ch, consume_queue(), body, properties)
+        if attempt is None:
+            indexer.discard()
+        self.record_failure(m['id'], err, attempt)
+
+    def record_failure(self, _id, err, attempt=None):
+        """
+        Counts a failure against the repository, until a job succeeds.
+        Permanent failures take the repository out of rotation until it is
+        re-queued by hand. A repository
+        with a retry scheduled stays queued, as of the retry's delivery, so
+        the feeder does not queue it again meanwhile.
+        :param attempt: int retry attempt scheduled, None if the failure is
+                        permanent
+        """
+        update = {
+            '$inc': {
+                'error_count': 1
+            },
+            '$set': {
+                'comment': str(err)
+            }
+        }
+        if attempt is None:
+            update['$set']['state'] = constants.REPOSITORY_FAILED
+        else:
+            update['$set']['state'] = constants.REPOSITORY_QUEUED
+            update['$set']['queued_on'] = datetime.today() + \
+                timedelta(seconds=mq.retry_delay(attempt))
+        self.db_conn.repositories.update({'_id': ObjectId(_id)}, update,
+                                         multi=True)
+
+    def rejected(self, ch, method, properties, body, m, err):
+        """
+        ElasticSearch refused the job's request. The job is retried with
+        backoff and dead-lettered like a repository failure, rather than
+        requeued at once.
+        """
+        logger.error('ElasticSearch rejected {}: {}'.format(m['id'], err))
+        attempt = mq.retry(ch, consume_queue(), body, properties)
+        self.record_failure(m['id'], err, attempt)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def outage(self, ch, method, breaker, m, err):
+        """
+        Returns the message to the queue and, once the backend's circuit is
+        open, pauses consumption until it is available again.
+        """
+        logger.warning('{} failed indexing {}: {}'.format(breaker.name,
+                                                          m['id'], err))
+        breaker.failure()
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+        if not breaker.allow():
+            self.pause(ch)
+
+    def pause(self, ch):
+        """
+        Stops consuming while any backend circuit is open, probing each until it
+        closes, then resumes.
+        """
+        # Cancelling first ensures no message is delivered while sleeping.
+        for method, properties, body in ch.basic_cancel(self.consumer_tag) \
+                or []:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+        if self.status:
+            self.status.stage('paused')
+        self.paused = True
+        for breaker in self.breakers.values():
+            while not breaker.allow():
+                # sleep services the connection, keeping heartbeats alive
+                self.connection.sleep(min(max(breaker.remaining(), 1), 5))
+        self.paused = False
+
+        self.consumer_tag = ch.basic_consume(self.on_message,
+                                             queue=consume_queue())
+
+    def record_locality(self, _id):
+        """
+        Counts the job against this node, noting whether the repository was
+        last indexed here.
+        :param _id: string repository ID
+        :return: None
+        """
+        node = node_name()
+        previous = self.db_conn.repositories.find_one({'_id': ObjectId(_id)},
+                                                      {'node': 1})
+        NodeRegistry(self.db_conn).record_job(
+            node, bool(previous) and previous.get('node') == node)
+
+    def schedule_refresh(self, channel):
+        """
+        Idle workers receive no messages, so configuration changes are also
+        applied every `general.refresh_interval` seconds. Timers only fire
+        while the connection is serviced, i.e. never during a job.
+        :param channel: pika channel
+        :return: None
+        """
+        def refresh():
+            # A paused worker resumes consuming itself; retiring then would
+            # be undone.
+            if self.paused or self.between_jobs(channel):
+                self.schedule_refresh(channel)
+
+        self.connection.add_timeout(cfg.settings.general.refresh_interval,
+                                    refresh)
+
+    def between_jobs(self, channel):
+        """
+        Applies configuration changes between jobs. Workers numbered above the
+        configured worker count retire; unacknowledged messages return to the
+        queue when the connection closes.
+        :param channel: pika channel
+        :return: boolean, False once the worker is retiring
+        """
+        if ('mq', 'prefetch') in cfg.refresh():
+            channel.basic_qos(prefetch_count=cfg.settings.mq.prefetch)
+
+        if self.id > cfg.settings.general.workers:
+            logger.info('worker#{} retiring, {} workers configured'.format(
+                self.id, cfg.settings.general.workers))
+            if self.status:
+                self.status.retire()
+            channel.stop_consuming()
+            return False
+        return True
 
@@ -11,7 +11,7 @@ setup(name='dex-indexer',
     description='Indexing module.',
     author='Jonathon Scanes',
     author_email='me@jscanes.com',
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests', 'tests.*']),
     zip_safe=False,
     install_requires=[
         'pyyaml',
@@ -20,6 +20,7 @@ setup(name='dex-indexer',
         'elasticsearch',
         'bunch',
         'requests',
+        'numpy',
     ],
     package_data={
         '': ['*.yaml']
@@ -0,0 +1,5 @@
+"""
+Tests of the code that runs without backends; collected by nose:
+
+    python setup.py test
+"""
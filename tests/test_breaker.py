@@ -0,0 +1,78 @@
+import unittest
+from dex.core import breaker
+from dex.core.breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.time = breaker.time
+        breaker.time = self.clock
+        self.available = False
+        self.breaker = CircuitBreaker('backend', lambda: self.available,
+                                      threshold=3, reset=10, max_reset=30)
+
+    def tearDown(self):
+        breaker.time = self.time
+
+    def test_opens_after_threshold(self):
+        for _ in range(2):
+            self.breaker.failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.remaining(), 10)
+
+    def test_success_resets_count(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_probe_closes(self):
+        for _ in range(3):
+            self.breaker.failure()
+        self.clock.now += 10
+        self.available = True
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_failed_probe_doubles_wait(self):
+        for _ in range(3):
+            self.breaker.failure()
+        for wait in (20, 30, 30):
+            self.clock.now += self.breaker.remaining()
+            self.assertFalse(self.breaker.allow())
+            self.assertEqual(self.breaker.state, OPEN)
+            self.assertEqual(self.breaker.remaining(), wait)
+
+    def test_half_open_failure_reopens(self):
+        for _ in range(3):
+            self.breaker.failure()
+        self.clock.now += 10
+        self.breaker.state = HALF_OPEN
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_probe_exception_is_a_failure(self):
+        def probe():
+            raise IOError('refused')
+        failing = CircuitBreaker('backend', probe, threshold=1, reset=1)
+        failing.failure()
+        self.clock.now += 1
+        self.assertFalse(failing.allow())
+        self.assertEqual(failing.state, OPEN)
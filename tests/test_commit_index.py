@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from dex.core.commit_index import CommitIndex, ID_SIZE
+
+
+def index(times):
+    """
+    An index of commits at the given times, newest first, each the parent of
+    the one before.
+    """
+    n = len(times)
+    ids = numpy.zeros((n, ID_SIZE), numpy.uint8)
+    ids[:, -1] = numpy.arange(n)
+    parents = numpy.arange(1, n + 1, dtype=numpy.int32)
+    parents[-1] = -1
+    return CommitIndex('ab' * ID_SIZE, ids, numpy.array(times, numpy.int64),
+                       numpy.array([i % 2 for i in range(n)], numpy.int32),
+                       parents, numpy.full(n, -1, numpy.int64),
+                       numpy.full(n, -1, numpy.int64),
+                       [u'a@example.com', u'b@example.com'],
+                       [u'Ann', u'Bj\xf6rn'])
+
+
+class CommitIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'index.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_open(self):
+        written = index([500, 400, 300])
+        written.diff(lambda parent, commit: (10, 2), 1)
+        written.write(self.location)
+
+        mapped = CommitIndex.open(self.location)
+        try:
+            self.assertEqual(mapped.head, written.head)
+            self.assertEqual(len(mapped), 3)
+            for name in ('ids', 'times', 'authors', 'parents', 'additions',
+                         'deletions'):
+                self.assertTrue((getattr(mapped, name) ==
+                                 getattr(written, name)).all(), name)
+            self.assertEqual(mapped.names, [u'Ann', u'Bj\xf6rn'])
+            self.assertEqual(mapped.emails, written.emails)
+            self.assertEqual(mapped.hex(2), written.hex(2))
+            self.assertEqual(list(mapped.additions), [10, -1, -1])
+        finally:
+            mapped.close()
+
+    def test_mapped_is_read_only(self):
+        index([2, 1]).write(self.location)
+        mapped = CommitIndex.open(self.location)
+        try:
+            self.assertRaises(ValueError, mapped.diff, None, 1)
+            copy = mapped.copy()
+            self.assertEqual(copy.diff(lambda parent, commit: (1, 1), 5), 1)
+        finally:
+            mapped.close()
+
+    def test_open_invalid(self):
+        self.assertIsNone(CommitIndex.open(self.location))
+        with open(self.location, 'wb') as f:
+            f.write('not an index' * 10)
+        self.assertIsNone(CommitIndex.open(self.location))
+
+    def test_within(self):
+        commits = index([500, 400, 400, 300, 100])
+        self.assertEqual(commits.within(0), 5)
+        self.assertEqual(commits.within(400), 3)
+        self.assertEqual(commits.within(401), 1)
+        self.assertEqual(commits.within(50), 5)
+        self.assertEqual(commits.within(600), 0)
+
+    def test_diff_budget(self):
+        commits = index([4, 3, 2, 1])
+        self.assertEqual(commits.diff(lambda parent, commit: (1, 2), 2), 2)
+        self.assertEqual(list(commits.additions), [1, 1, -1, -1])
+        # The root commit has no parent to diff against
+        self.assertEqual(commits.diff(lambda parent, commit: (1, 2), 5), 1)
+        self.assertEqual(list(commits.deletions), [2, 2, 2, -1])
@@ -0,0 +1,43 @@
+import unittest
+from collections import OrderedDict
+from datetime import datetime
+from bson.binary import Binary
+from dex.core.digest import changed, digest
+
+
+class DigestTest(unittest.TestCase):
+
+    def test_key_order(self):
+        a = OrderedDict([('x', 1), ('y', {'b': 2, 'a': [1, 2]})])
+        b = OrderedDict([('y', OrderedDict([('a', [1, 2]), ('b', 2)])),
+                         ('x', 1)])
+        self.assertEqual(digest(a), digest(b))
+
+    def test_types_are_tagged(self):
+        self.assertNotEqual(digest({'a': 1}), digest({'a': '1'}))
+        self.assertNotEqual(digest({'a': 1}), digest({'a': 1.0}))
+        self.assertNotEqual(digest([['a', 'b']]), digest(['a', 'b']))
+        self.assertNotEqual(digest(['ab']), digest(['a', 'b']))
+
+    def test_unicode_as_utf8(self):
+        self.assertEqual(digest({'a': u'\xe9'}), digest({'a': '\xc3\xa9'}))
+        self.assertEqual(digest([Binary('\x00\x01')]), digest(['\x00\x01']))
+
+    def test_exclude(self):
+        run = {'text': 'readme', 'processed': datetime(2014, 1, 1)}
+        rerun = {'text': 'readme', 'processed': datetime(2015, 1, 1)}
+        self.assertNotEqual(digest(run), digest(rerun))
+        self.assertEqual(digest(run, exclude=('processed',)),
+                         digest(rerun, exclude=('processed',)))
+
+    def test_stable(self):
+        # Hashes are stored: the encoding must not change between releases
+        self.assertEqual(digest({'a': [1, 'b', None], 'b': {'c': 1.5}}),
+                         '6c631352e284f4e1bea75f50d9aaa9e404471f0b')
+
+    def test_changed(self):
+        self.assertIsNone(changed({'a': '1'}, None))
+        self.assertIsNone(changed({'a': '1'}, {'a': '1', 'b': '2'}))
+        self.assertEqual(changed({'a': '1', 'b': '2'}, {'a': '1', 'b': '3'}),
+                         ['b'])
+        self.assertEqual(changed({'a': '1'}, {'a': '1'}), [])
@@ -0,0 +1,48 @@
+import unittest
+from dex.core.hashring import HashRing, moved
+
+
+NODES = ['indexer-{}'.format(i) for i in range(1, 6)]
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(HashRing().get_node('key'))
+
+    def test_stable(self):
+        ring = HashRing(NODES)
+        again = HashRing(reversed(NODES))
+        for key in map(str, range(100)):
+            self.assertEqual(ring.get_node(key), again.get_node(key))
+
+    def test_arcs(self):
+        shares = HashRing(NODES).arcs()
+        self.assertEqual(set(shares), set(NODES))
+        self.assertAlmostEqual(sum(shares.values()), 1.0)
+        for share in shares.values():
+            self.assertTrue(0.1 < share < 0.3, share)
+
+    def test_join_remaps_only_its_share(self):
+        old = HashRing(NODES)
+        new = HashRing(NODES + ['indexer-6'])
+        share = new.arcs()['indexer-6']
+        self.assertAlmostEqual(moved(old, new), share, delta=0.03)
+        for key in map(str, range(1000)):
+            if old.get_node(key) != new.get_node(key):
+                self.assertEqual(new.get_node(key), 'indexer-6')
+
+    def test_leave_remaps_only_its_keys(self):
+        old = HashRing(NODES)
+        new = HashRing(NODES)
+        new.remove('indexer-3')
+        self.assertNotIn('indexer-3', new.arcs())
+        for key in map(str, range(1000)):
+            if old.get_node(key) != 'indexer-3':
+                self.assertEqual(old.get_node(key), new.get_node(key))
+
+    def test_add_remove_idempotent(self):
+        ring = HashRing(NODES)
+        ring.add('indexer-1')
+        ring.remove('indexer-9')
+        self.assertEqual(ring.arcs(), HashRing(NODES).arcs())
@@ -0,0 +1,64 @@
+import struct
+import unittest
+from datetime import datetime
+from dex.core.metric import Metric
+from dex.core.metric_series import MetricSeries, pack, unpack
+
+
+def metric(week, additions):
+    m = Metric()
+    m.commit = '{:040x}'.format(week + 1)
+    m.timestamp = datetime(2014, 1, 1 + week * 7, 12)
+    m.additions = additions
+    m.deletions = additions // 2
+    m.commit_count = week + 1
+    m.activity = additions + 0.5
+    m.contributors = 2
+    return m
+
+
+class PackTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for code, values in (('q', [0, -1, 2 ** 40]), ('d', [0.5, -1e9]),
+                             ('B', [0, 1])):
+            self.assertEqual(list(unpack(code, pack(code, values))), values)
+
+    def test_little_endian(self):
+        self.assertEqual(str(pack('q', [1])), struct.pack('<q', 1))
+
+    def test_empty(self):
+        self.assertEqual(unpack('q', pack('q', [])), ())
+
+
+class MetricSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.series = MetricSeries(2014)
+        for week in range(3):
+            self.series.append(metric(week, 100 * week))
+
+    def test_round_trip(self):
+        document = self.series.serialize('repository')
+        self.assertEqual(document['count'], 3)
+        self.assertEqual(document['start'], datetime(2014, 1, 1, 12))
+
+        metrics = MetricSeries.deserialize(document).metrics()
+        self.assertEqual(len(metrics), 3)
+        for week, m in enumerate(metrics):
+            expected = metric(week, 100 * week)
+            for field in Metric.__slots__:
+                self.assertEqual(getattr(m, field), getattr(expected, field))
+
+    def test_range(self):
+        metrics = self.series.metrics(start=datetime(2014, 1, 8),
+                                      end=datetime(2014, 1, 9))
+        self.assertEqual([m.commit_count for m in metrics], [2])
+
+    def test_fields_missing_from_old_documents(self):
+        document = self.series.serialize('repository')
+        del document['sampling_rate']
+        del document['contributors']
+        series = MetricSeries.deserialize(document)
+        self.assertEqual(series.sampling_rate, [1.0] * 3)
+        self.assertEqual(series.contributors, [0] * 3)
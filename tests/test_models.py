@@ -0,0 +1,120 @@
+"""
+Result models: per-instance state, and flat memory across many jobs.
+
+Run as a script for the benchmark figures:
+
+    python -m tests.test_models [jobs]
+"""
+
+import sys
+import resource
+import unittest
+from dex.core.metric import Metric
+from dex.core.model.contributor import Contributor
+from dex.core.model.language import Language
+from dex.core.model.result import Result
+
+
+JOBS = 20000
+LANGUAGES = 5
+
+
+class Statistics(object):
+    """
+    Stands in for Languages, the cloc report of a repository.
+    """
+
+    def __init__(self, languages):
+        self.languages = languages
+
+    def get_common_language(self):
+        return self.languages[0]
+
+    def get_languages(self):
+        return self.languages
+
+
+def job(i):
+    """
+    Builds and serializes the models of one job.
+    :return: dict search document
+    """
+    result = Result('repository-{}'.format(i), 'https://host/{}'.format(i))
+    result.set_statistics(Statistics([
+        Language('language-{}'.format(n), 10, 1000, 100, 10, 100.0 / LANGUAGES)
+        for n in range(LANGUAGES)]))
+    result.set_fulltext(readme='readme ' * 50)
+
+    metric = Metric()
+    metric.commit = '0' * 40
+    metric.serialize()
+    Contributor('name', 'email', 1, 10, 2).serialize()
+    return result.serialize()
+
+
+def rss():
+    """
+    :return: int KB, resident set size of this process
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark(jobs):
+    """
+    Runs jobs back to back, as a worker does.
+    :return: tuple (KB after a warm up tenth of the jobs, KB after all,
+             languages in the last document)
+    """
+    warm = jobs // 10
+    for i in range(warm):
+        job(i)
+    before = rss()
+    for i in range(warm, jobs):
+        document = job(i)
+    return before, rss(), len(document['repository']['languages'])
+
+
+class ResultTest(unittest.TestCase):
+
+    def test_state_is_per_instance(self):
+        first = Result('a', 'url-a')
+        first.set_statistics(Statistics([Language('Python', 1, 1, 0, 0, 1)]))
+        second = Result('b', 'url-b')
+        self.assertEqual(second.languages, [])
+        self.assertEqual(second.serialize()['repository']['name'], 'b')
+        self.assertEqual(len(first.serialize()['repository']['languages']), 1)
+
+    def test_common_language_first(self):
+        c = Language('C', 1, 10, 0, 0, 10)
+        python = Language('Python', 1, 90, 0, 0, 90)
+        statistics = Statistics([c, python])
+        statistics.get_common_language = lambda: python
+        result = Result('a', 'url')
+        result.set_statistics(statistics)
+        self.assertEqual([l['language'] for l in
+                          result.serialize()['repository']['languages']],
+                         ['Python', 'C'])
+
+    def test_slots(self):
+        for model in (Result('a', 'url'), Metric(), Contributor('n', 'e'),
+                      Language('C', 1, 1, 1, 1, 1)):
+            self.assertFalse(hasattr(model, '__dict__'))
+
+    def test_memory_is_flat(self):
+        before, after, languages = benchmark(JOBS)
+        self.assertEqual(languages, LANGUAGES)
+        self.assertLess(after - before, 2048)
+
+
+if __name__ == '__main__':
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else JOBS
+    before, after, languages = benchmark(jobs)
+    print '{} jobs: {} KB after warm up, {} KB after all, {} languages per ' \
+          'document'.format(jobs, before, after, languages)
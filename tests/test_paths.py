@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+from dex.core.paths import DOCUMENTATION, GENERATED, LARGE, VENDORED, \
+    PathClassifier, match, read_attributes
+
+
+def write(root, path, content=''):
+    location = os.path.join(root, path)
+    if not os.path.isdir(os.path.dirname(location)):
+        os.makedirs(os.path.dirname(location))
+    with open(location, 'w') as f:
+        f.write(content)
+
+
+class MatchTest(unittest.TestCase):
+
+    def test_name_at_any_depth(self):
+        self.assertTrue(match('*.pb.go', 'api/v1/service.pb.go'))
+        self.assertTrue(match('third_party/', 'src/third_party/lib.c'))
+        self.assertFalse(match('*.go', 'main.py'))
+
+    def test_anchored(self):
+        self.assertTrue(match('/lib/*.js', 'lib/a.js'))
+        self.assertFalse(match('/lib/*.js', 'src/lib/a.js'))
+        self.assertTrue(match('assets/**', 'assets/img/logo.svg'))
+        self.assertTrue(match('gen/', 'gen/a/b.c'))
+
+
+class PathClassifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_builtin_rules(self):
+        paths = PathClassifier()
+        self.assertEqual(paths.classify('node_modules/x/index.js'), VENDORED)
+        self.assertEqual(paths.classify('static/jquery-1.9.1.min.js'),
+                         VENDORED)
+        self.assertEqual(paths.classify('app.min.js'), GENERATED)
+        self.assertEqual(paths.classify('yarn.lock'), GENERATED)
+        self.assertEqual(paths.classify('docs/index.md'), DOCUMENTATION)
+        self.assertIsNone(paths.classify('src/main.py'))
+        self.assertIsNone(PathClassifier(builtin=False)
+                          .classify('node_modules/x/index.js'))
+
+    def test_attributes_override_builtin(self):
+        write(self.root, '.gitattributes', '\n'.join([
+            '# comment',
+            'vendor/** -linguist-vendored',
+            '*.gen.c linguist-generated',
+            'manual/ linguist-documentation=true',
+            'manual/keep.md linguist-documentation=false',
+        ]))
+        paths = PathClassifier.from_checkout(self.root)
+        self.assertIsNone(paths.classify('vendor/ours.c'))
+        self.assertEqual(paths.classify('src/parser.gen.c'), GENERATED)
+        self.assertEqual(paths.classify('manual/a.md'), DOCUMENTATION)
+        self.assertIsNone(paths.classify('manual/keep.md'))
+
+    def test_missing_attributes(self):
+        self.assertEqual(read_attributes(os.path.join(self.root, 'none')), [])
+
+    def test_scan(self):
+        write(self.root, 'src/main.py', 'x' * 10)
+        write(self.root, 'src/big.py', 'x' * 100)
+        write(self.root, 'node_modules/a/index.js', 'x' * 5)
+        write(self.root, 'node_modules/b/index.js', 'x' * 5)
+        write(self.root, 'app.min.js', 'x' * 3)
+        write(self.root, '.git/HEAD', 'ref')
+
+        paths = PathClassifier(max_size=50)
+        excluded, skipped = paths.scan(self.root)
+        self.assertEqual(sorted(os.path.relpath(e, self.root)
+                                for e in excluded),
+                         ['app.min.js', 'node_modules', 'src/big.py'])
+        self.assertEqual(skipped, {
+            VENDORED: {'files': 2, 'bytes': 10},
+            GENERATED: {'files': 1, 'bytes': 3},
+            LARGE: {'files': 1, 'bytes': 100}})
+        # Diff scoring skips the large file too
+        self.assertTrue(paths.excluded('src/big.py'))
+        self.assertFalse(paths.excluded('src/main.py'))
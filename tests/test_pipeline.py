@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import unittest
+try:
+    from dex.core import pipeline
+    from dex.core.extractors import Extractor, PROCESS
+except ImportError as e:
+    # The extractors need the algthm utilities
+    raise unittest.SkipTest('extractors unavailable: {}'.format(e))
+
+
+INPUTS = dict((name, name) for name in pipeline.INPUTS)
+
+
+def extractor(name, requires=(), provides=(), uses=(), mode='thread',
+              function=None):
+    def provide(job):
+        return dict((value, name) for value in provides)
+    return Extractor(name, function or provide, requires, provides, mode,
+                     uses=uses)
+
+
+def pid(job):
+    return {'pid': (os.getpid(), job.get('paths'))}
+
+
+def fail(job):
+    raise ValueError('failed')
+
+
+class OrderTest(unittest.TestCase):
+
+    def test_dependencies_first(self):
+        ordered = pipeline.order([
+            extractor('metrics', requires=('paths', 'index')),
+            extractor('index', requires=('paths',), provides=('index',)),
+            extractor('paths', provides=('paths',)),
+            extractor('readme', provides=('readme',))])
+        names = [e.name for e in ordered]
+        self.assertEqual(names, ['paths', 'readme', 'index', 'metrics'])
+
+    def test_duplicate_provider(self):
+        self.assertRaises(ValueError, pipeline.order, [
+            extractor('a', provides=('x',)), extractor('b', provides=('x',))])
+        self.assertRaises(ValueError, pipeline.order, [
+            extractor('a', provides=('location',))])
+
+    def test_unsatisfiable(self):
+        self.assertRaises(ValueError, pipeline.order, [
+            extractor('a', requires=('x',))])
+
+    def test_cycle(self):
+        self.assertRaises(ValueError, pipeline.order, [
+            extractor('a', requires=('y',), provides=('x',)),
+            extractor('b', requires=('x',), provides=('y',))])
+
+    def test_uses_wait_only_for_provided(self):
+        self.assertEqual(len(pipeline.order([
+            extractor('a', uses=('x',), provides=('y',))])), 1)
+        ordered = pipeline.order([
+            extractor('a', uses=('x',), provides=('y',)),
+            extractor('b', provides=('x',))])
+        self.assertEqual([e.name for e in ordered], ['b', 'a'])
+
+
+class RunTest(unittest.TestCase):
+
+    def test_values(self):
+        values = pipeline.run([
+            extractor('paths', provides=('paths',)),
+            extractor('languages', uses=('paths',), provides=('languages',),
+                      function=lambda job: {'languages': job['paths']})],
+            INPUTS)
+        self.assertEqual(values['languages'], 'paths')
+        self.assertEqual(values['location'], 'location')
+
+    def test_unprovided_uses_are_none(self):
+        values = pipeline.run([extractor(
+            'languages', uses=('paths',), provides=('languages',),
+            function=lambda job: {'languages': job['paths']})], INPUTS)
+        self.assertIsNone(values['languages'])
+
+    def test_failure_stops(self):
+        started = []
+
+        def later(job):
+            started.append(job)
+            return {'y': 1}
+        self.assertRaises(ValueError, pipeline.run, [
+            extractor('a', provides=('x',), function=fail),
+            extractor('b', requires=('x',), provides=('y',),
+                      function=later)], INPUTS)
+        self.assertEqual(started, [])
+
+    def test_missing_value(self):
+        self.assertRaises(ValueError, pipeline.run, [
+            extractor('a', provides=('x',), function=lambda job: {})], INPUTS)
+
+    def test_process_extractors(self):
+        if not pipeline.processes_allowed():
+            raise unittest.SkipTest('extractor processes disabled')
+        values = pipeline.run([
+            extractor('paths', provides=('paths',)),
+            extractor('pid', uses=('paths',), provides=('pid',),
+                      mode=PROCESS, function=pid)], INPUTS)
+        child, paths = values['pid']
+        self.assertNotEqual(child, os.getpid())
+        self.assertEqual(paths, 'paths')
+
+    def test_process_failure_releases_children(self):
+        if not pipeline.processes_allowed():
+            raise unittest.SkipTest('extractor processes disabled')
+        self.assertRaises(ValueError, pipeline.run, [
+            extractor('a', provides=('x',), mode=PROCESS, function=fail),
+            extractor('b', requires=('x',), provides=('pid',),
+                      mode=PROCESS, function=pid)], INPUTS)
+        self.assertEqual(multiprocessing.active_children(), [])